@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# 离线模拟防火墙布隆过滤器：在不同寄存器大小、不同连接数下估算占用率与误判率
+#
+# Usage: bloom_sim.py --flows 1000000 --sizes 4096,65536 --counts 1000,10000,100000
+#        bloom_sim.py --pcap capture.pcap
+# The inserted flows are the SYNs of the capture, or random connections of
+# internal hosts; the probes are random connections that were never opened.
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from controller_lib.bloom import (DEFAULT_ENTRIES, BloomFilterModel, flowKeys,
+                                  printBloomResults, syntheticFlows)
+from controller_lib.capture import PcapFile
+
+
+def parseIntList(arg):
+    try:
+        return [int(value, 0) for value in arg.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected comma-separated integers, got %r" % arg)
+
+
+def main(pcap_file_paths, flows, probes, sizes, counts, seed):
+    rng = np.random.default_rng(seed)
+    if pcap_file_paths:
+        keys = []
+        for path in pcap_file_paths:
+            src, dst, sport, dport = PcapFile(path).tcpSyns()
+            # the SYN of an outgoing connection is hashed with the internal
+            # host, its source, first
+            keys.append(flowKeys(src, dst, sport, dport))
+        # retransmitted SYNs set the same bits
+        keys = np.unique(np.concatenate(keys), axis=0)
+        # connections are inserted in random order when only a part of them is
+        rng.shuffle(keys)
+        print("%d connections in %s" % (len(keys), ', '.join(pcap_file_paths)))
+    else:
+        keys = syntheticFlows(flows, rng)
+    inserted = BloomFilterModel(keys)
+    if counts is None:
+        counts = [len(inserted)]
+    counts = [count for count in counts if count <= len(inserted)]
+    if not counts:
+        print("No flow count is at most the %d flows available" % len(inserted))
+        return 1
+    results = inserted.simulate(BloomFilterModel(syntheticFlows(probes, rng)),
+                                sizes=sizes, counts=counts)
+    printBloomResults(results)
+    if any(entries > 0x10000 for entries in sizes):
+        print("\nbloom_filter_1 is indexed by crc16: only its first 65536 bits are ever used")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulates the Bloom filter of firewall.p4')
+    parser.add_argument('--pcap', help='pcap file whose TCP SYNs are the inserted connections',
+                        type=str, action="append", required=False, default=[])
+    parser.add_argument('--flows', help='number of random connections, without --pcap',
+                        type=int, action="store", required=False, default=100000)
+    parser.add_argument('--probes', help='number of random unsolicited connections',
+                        type=int, action="store", required=False, default=1000000)
+    parser.add_argument('--sizes', help='filter sizes (BLOOM_FILTER_ENTRIES), e.g. 4096,65536',
+                        type=parseIntList, action="store", required=False,
+                        default=[DEFAULT_ENTRIES])
+    parser.add_argument('--counts', help='numbers of inserted connections, all by default',
+                        type=parseIntList, action="store", required=False, default=None)
+    parser.add_argument('--seed', help='random seed',
+                        type=int, action="store", required=False, default=0)
+    args = parser.parse_args()
+
+    for path in args.pcap:
+        if not os.path.exists(path):
+            parser.print_help()
+            print("\npcap file not found: %s" % path)
+            parser.exit(1)
+    try:
+        sys.exit(main(args.pcap, args.flows, args.probes, args.sizes, args.counts, args.seed))
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,182 @@
+"""
+Bloom filter aging.
+布隆过滤器老化：批量读取寄存器统计占用率，周期性清空旧的一代过滤器并切换当前代
+
+firewall.p4 keeps two generations of its Bloom filters in the two halves of
+bloom_filter_1 and bloom_filter_2, and bloom_generation tells which one is
+current. SYNs, and the outgoing packets of connections found in the
+previous generation, set bits in the current generation; incoming packets
+pass when either generation knows their connection.
+
+BloomAger.rotate() clears the previous generation, then makes it the
+current one. The connections that sent nothing for a whole period are
+forgotten after the next rotation, so the occupancy, and with it the false
+positive rate, stays bounded however long the firewall runs.
+
+A register write without index would set every cell of the array, both
+generations, so the previous generation is cleared with one MODIFY per
+cell. The data plane only sets bits in the current generation, so rotate()
+reads the filters and the generation of each switch with one ReadRequest
+and clears only the cells set in the previous one, batch_size of them per
+WriteRequest. With the 2 x 4096 cells of a generation of firewall.p4 that
+is at most 8192 updates of about 20 bytes, 2 WriteRequests of some 80 KB
+at the default batch size, far below the 4 MB gRPC message limit; a
+lightly loaded firewall sends a few hundred. The generation is read again
+at every rotation, never cached, so a switch whose writes failed, or that
+was brought up again with its registers reset, is rotated from what it
+really holds.
+"""
+from collections import namedtuple
+
+from p4.v1 import p4runtime_pb2
+
+from .batch import BatchWriter
+
+# Occupancy of the filters of one switch: current is the current generation,
+# occupancy the fraction of set bits per register and generation, as a list
+# (one per register) of [generation 0, generation 1], false_positive the
+# rate estimated from the occupancies
+BloomOccupancy = namedtuple('BloomOccupancy', ['switch', 'current', 'occupancy',
+                                               'false_positive'])
+
+DEFAULT_FILTERS = ("MyIngress.bloom_filter_1", "MyIngress.bloom_filter_2")
+DEFAULT_GENERATION_REGISTER = "MyIngress.bloom_generation"
+GENERATIONS = 2
+# register writes per WriteRequest when clearing a generation
+DEFAULT_CLEAR_BATCH_SIZE = 4096
+
+
+def _bit(data):
+    return 1 if data.bitstring.strip(b'\x00') else 0
+
+
+class BloomAger(object):
+    """
+    Reads and rotates the Bloom filter generations of switches.
+    """
+
+    def __init__(self, p4info_helper, switches, filters=DEFAULT_FILTERS,
+                 generation_register=DEFAULT_GENERATION_REGISTER,
+                 batch_size=DEFAULT_CLEAR_BATCH_SIZE):
+        """
+        :param p4info_helper: the P4Info helper
+        :param switches: the switch connections running the firewall
+        :param filters: the names of the filter registers
+        :param generation_register: the name of the register holding the
+                                    current generation
+        :param batch_size: max number of register writes per WriteRequest,
+                           see the module documentation for the cost
+        """
+        self.switches = list(switches)
+        self.batch_size = batch_size
+        self._filters = []
+        for name in filters:
+            register = p4info_helper.get('registers', name=name)
+            if register.size % GENERATIONS:
+                raise ValueError("Register %s of size %d does not hold %d generations" % (
+                    name, register.size, GENERATIONS))
+            self._filters.append(register)
+        self._generation = p4info_helper.get('registers', name=generation_register)
+        self.entries = self._filters[0].size // GENERATIONS
+
+    def current(self, sw):
+        """
+        :return: the current generation of sw, read from the switch
+        """
+        return self._read(sw, filters=False)[0]
+
+    def readOccupancy(self, sw):
+        """
+        Reads the filter registers and the generation of sw with one
+        ReadRequest.
+
+        :return: a BloomOccupancy
+        """
+        current, cells = self._read(sw)
+        occupancy = [[len(indexes) / float(self.entries) for indexes in per_generation]
+                     for per_generation in cells]
+        # a probe passes if it finds its bits in the current or the previous
+        # generation
+        miss = 1.0
+        for generation in range(GENERATIONS):
+            passed = 1.0
+            for per_generation in occupancy:
+                passed *= per_generation[generation]
+            miss *= 1.0 - passed
+        return BloomOccupancy(sw.name, current, occupancy, 1.0 - miss)
+
+    def rotate(self):
+        """
+        Clears the set cells of the previous generation of every switch,
+        then makes it the current one.
+
+        :return: the list of UpdateError for the writes the switches rejected;
+                 a switch whose clearing failed keeps its current generation
+        """
+        writer = BatchWriter(batch_size=self.batch_size)
+        targets = {}
+        for sw in self.switches:
+            current, cells = self._read(sw)
+            target = 1 - current
+            targets[sw] = target
+            for register, per_generation in zip(self._filters, cells):
+                for index in per_generation[target]:
+                    writer.addUpdate(sw, p4runtime_pb2.Update.MODIFY,
+                                     register_entry=self._registerEntry(register, index, 0))
+        errors = writer.flush()
+        failed = set(error.switch for error in errors)
+        for sw in self.switches:
+            if sw.name in failed:
+                continue
+            # only switch once the new generation is empty
+            writer.addUpdate(sw, p4runtime_pb2.Update.MODIFY,
+                             register_entry=self._registerEntry(self._generation, 0, targets[sw]))
+        return errors + writer.flush()
+
+    def _read(self, sw, filters=True):
+        # one ReadRequest for the whole filter registers (wildcard reads) and
+        # the generation; returns the current generation and, per filter and
+        # generation, the indexes of the set cells
+        request = p4runtime_pb2.ReadRequest()
+        request.device_id = sw.device_id
+        positions = {}
+        if filters:
+            for position, register in enumerate(self._filters):
+                request.entities.add().register_entry.register_id = register.preamble.id
+                positions[register.preamble.id] = position
+        entry = request.entities.add().register_entry
+        entry.register_id = self._generation.preamble.id
+        entry.index.index = 0
+        current = 0
+        cells = [[[] for _ in range(GENERATIONS)] for _ in self._filters]
+        for response in sw.client_stub.Read(request):
+            for entity in response.entities:
+                entry = entity.register_entry
+                if entry.register_id == self._generation.preamble.id:
+                    current = _bit(entry.data)
+                elif _bit(entry.data):
+                    position = positions[entry.register_id]
+                    cells[position][entry.index.index // self.entries].append(entry.index.index)
+        return current, cells
+
+    @staticmethod
+    def _registerEntry(register, index, value):
+        entry = p4runtime_pb2.RegisterEntry()
+        entry.register_id = register.preamble.id
+        entry.index.index = index
+        width = register.type_spec.bitstring.bit.bitwidth
+        entry.data.bitstring = value.to_bytes((width + 7) // 8, 'big')
+        return entry
+
+
+def printBloomOccupancy(occupancies):
+    """
+    Prints one line per switch.
+
+    :param occupancies: the list of BloomOccupancy
+    """
+    for o in occupancies:
+        print("%s: generation %d current, occupancy %s, false positive rate %.6f" % (
+            o.switch, o.current,
+            ' / '.join('%.4f' % o.occupancy[i][o.current] for i in range(len(o.occupancy))),
+            o.false_positive))
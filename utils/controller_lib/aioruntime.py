@@ -0,0 +1,348 @@
+"""
+Asyncio switch runtime.
+基于 asyncio 与 grpc.aio 的控制器运行时：在一个事件循环上处理所有交换机的 StreamChannel 消息、周期任务和规则更新，没有事件时不占用 CPU
+
+The controllers used to end in `while True: sleep(2)`, checking timers at
+every tick and never reading the StreamChannel. SwitchRuntime opens one
+grpc.aio StreamChannel per switch and does the master arbitration on it,
+so packet-ins, digests and arbitration changes arrive on the event loop as
+soon as the switch sends them:
+
+    runtime = SwitchRuntime([s1, s2, s3])
+    results = runtime.bringUp(p4info, bmv2_file_path)
+    runtime.on('digest', handleDigest)
+    runtime.every(10, printCounters)
+    runtime.run()
+
+A handler receives the switch connection and the message of the update
+(PacketIn, DigestList, MasterArbitrationUpdate, IdleTimeoutNotification or
+StreamError). Coroutine functions run on the event loop; plain functions,
+which may block on gRPC calls like the rest of controller_lib, run on one
+worker thread, one at a time and in the order of the events, so they never
+need locks. Digest lists are acknowledged after their handlers ran.
+
+The event loop runs on a thread of its own from connect() (or bringUp())
+to close(), so the streams are read, and the handlers called, while the
+controller installs its rules; run() only waits for the periodic tasks
+and for stop(). Work of the controller thread that must not interleave
+with the handlers, e.g. the first flush of the rules, goes through
+execute(). Register the handlers before enabling what sends the events
+(e.g. the digests): an update without a handler is only counted.
+
+The switch connections (connection.ControllerConnection) keep their
+synchronous stubs for the pipeline push and the batched writes, and their
+own StreamChannel is closed when the runtime opens its stream. The
+arbitration is sent with the election id of the connection, and the
+election id the switch grants is stored back in it, so that every request
+carries the one this controller is master with.
+"""
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+from google.rpc import code_pb2
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+from .bringup import BringUpResult, bringUpSwitch
+from .pipeline import PipelineArtifact
+
+# The updates of a StreamMessageResponse a handler can be registered for,
+# and 'closed', called with the grpc.aio.AioRpcError (or None) that ended
+# the stream of a switch
+EVENTS = ('arbitration', 'packet', 'digest', 'idle_timeout_notification', 'error', 'closed')
+
+_runtimes = []
+
+
+def closeAllRuntimes():
+    for runtime in list(_runtimes):
+        runtime.close()
+
+
+class SwitchRuntime(object):
+    """
+    Stream events, periodic tasks and blocking work of a set of switches,
+    on one event loop.
+    """
+
+    def __init__(self, switches):
+        """
+        :param switches: the switch connections, not arbitrated yet
+        """
+        self.switches = list(switches)
+        self.loop = asyncio.new_event_loop()
+        # switch name -> True while this controller is its master
+        self.master = {}
+        # (switch name, event) -> number of updates received
+        self.received = {}
+        # number of calls waiting for or running on the worker thread
+        self.backlog = 0
+        self._worker = ThreadPoolExecutor(max_workers=1)
+        self._handlers = dict((event, []) for event in EVENTS)
+        self._periodic = []
+        self._channels = {}
+        self._outgoing = {}
+        self._streams = {}
+        self._stopped = None
+        self._error = None
+        self._thread = None
+        _runtimes.append(self)
+
+    def on(self, event, handler):
+        """
+        Calls handler(sw, message) for every update of type event.
+
+        :param event: one of EVENTS
+        """
+        if event not in self._handlers:
+            raise ValueError("Unknown event %r, expected one of %s" % (event, ', '.join(EVENTS)))
+        self._handlers[event].append(handler)
+
+    def every(self, interval, task, *args):
+        """
+        Calls task(*args) every interval seconds while the runtime runs. A
+        call that takes longer than interval delays the next one instead of
+        piling up.
+        """
+        self._periodic.append((interval, task, args))
+
+    def send(self, sw, request):
+        """
+        Sends a StreamMessageRequest (e.g. a packet-out) on the stream of sw.
+        Safe to call from the worker thread.
+        """
+        self.loop.call_soon_threadsafe(self._outgoing[sw.name].put_nowait, request)
+
+    def queueDepth(self, sw):
+        """
+        :return: the number of StreamMessageRequests waiting to be sent on
+                 the stream of sw
+        """
+        outgoing = self._outgoing.get(sw.name)
+        return 0 if outgoing is None else outgoing.qsize()
+
+    async def call(self, function, *args):
+        """
+        Runs a blocking function on the worker thread, e.g. a BatchWriter
+        flush, and returns its result.
+        """
+        self.backlog += 1
+        try:
+            return await self.loop.run_in_executor(self._worker, functools.partial(function, *args))
+        finally:
+            self.backlog -= 1
+
+    def execute(self, function, *args):
+        """
+        Runs a blocking function on the worker thread, after the handlers
+        already waiting for it, and returns its result. Call it from the
+        controller thread, not from a handler.
+        """
+        return self._submit(self.call(function, *args))
+
+    def connect(self):
+        """
+        Opens the StreamChannel of every switch and sends the master
+        arbitration update, all switches concurrently. The streams are read
+        from then on.
+
+        :return: dict of switch name -> None, or a description of the failure
+        """
+        return self._submit(self._connectAll())
+
+    def bringUp(self, p4info, bmv2_json_file_path, skip_unchanged=False):
+        """
+        Same as bringup.bringUpSwitches, with the arbitration done on the
+        streams of the runtime.
+
+        :return: the list of BringUpResult, in the order of the switches
+        """
+        start = time.time()
+        errors = self.connect()
+        connected = time.time() - start
+        artifact = PipelineArtifact(p4info, bmv2_json_file_path)
+        pushing = [sw for sw in self.switches if errors[sw.name] is None]
+        results = {}
+        if pushing:
+            with ThreadPoolExecutor(max_workers=len(pushing)) as pool:
+                for result in pool.map(lambda sw: bringUpSwitch(sw, artifact, skip_unchanged,
+                                                                arbitrate=False), pushing):
+                    # the arbitrations ran together, count their time for every switch
+                    results[result.switch] = result._replace(elapsed=result.elapsed + connected)
+        return [results.get(sw.name) or BringUpResult(sw.name, errors[sw.name], connected, False)
+                for sw in self.switches]
+
+    def run(self, duration=None):
+        """
+        Handles events and periodic tasks until stop() is called, or for
+        duration seconds. KeyboardInterrupt propagates, and so does the first
+        exception raised by a handler or a periodic task, e.g. a
+        grpc.RpcError, after which the runtime stops.
+        """
+        self._submit(self._serve(duration))
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def stop(self):
+        """
+        Makes run() return. Safe to call from any thread.
+        """
+        if self._stopped is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+    def close(self):
+        """
+        Closes the streams and channels; the runtime cannot be used afterwards.
+        """
+        if self.loop.is_closed():
+            return
+        if self._thread is None:
+            self.loop.run_until_complete(self._closeChannels())
+        else:
+            self._submit(self._closeChannels())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+        self._worker.shutdown(wait=True)
+        self.loop.close()
+        _runtimes.remove(self)
+
+    def _submit(self, coroutine):
+        # runs the coroutine on the loop thread, started the first time, and
+        # waits for it; KeyboardInterrupt only interrupts the wait
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.loop.run_forever,
+                                            name='switch runtime', daemon=True)
+            self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _connectAll(self):
+        errors = await asyncio.gather(*[self._connect(sw) for sw in self.switches])
+        return dict((sw.name, error) for sw, error in zip(self.switches, errors))
+
+    async def _connect(self, sw):
+        # the StreamChannel of p4runtime_lib would never be read
+        sw.closeStream()
+        channel = grpc.aio.insecure_channel(sw.address)
+        self._channels[sw.name] = channel
+        outgoing = self._outgoing[sw.name] = asyncio.Queue()
+        stream = p4runtime_pb2_grpc.P4RuntimeStub(channel).StreamChannel(self._requests(outgoing))
+        self._streams[sw.name] = stream
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.arbitration.device_id = sw.device_id
+        sw.setElectionId(request.arbitration.election_id)
+        outgoing.put_nowait(request)
+        try:
+            response = await stream.read()
+        except grpc.aio.AioRpcError as e:
+            return "%s (%s)" % (e.details(), e.code().name)
+        if response is grpc.aio.EOF:
+            return "stream closed by the switch"
+        status = response.arbitration.status
+        self.master[sw.name] = status.code == code_pb2.OK
+        if status.code == code_pb2.OK and response.arbitration.HasField('election_id'):
+            # the election id of the master, that is ours
+            election_id = response.arbitration.election_id
+            sw.election_id = (election_id.high, election_id.low)
+        self.loop.create_task(self._read(sw, stream))
+        if status.code != code_pb2.OK:
+            return "not master: %s" % status.message
+        return None
+
+    @staticmethod
+    async def _requests(outgoing):
+        while True:
+            yield await outgoing.get()
+
+    async def _read(self, sw, stream):
+        error = None
+        try:
+            # read() like _connect, iterating the call would mix the two APIs
+            while True:
+                response = await stream.read()
+                if response is grpc.aio.EOF:
+                    break
+                event = response.WhichOneof('update')
+                if event not in self._handlers:
+                    continue
+                key = (sw.name, event)
+                self.received[key] = self.received.get(key, 0) + 1
+                message = getattr(response, event)
+                if event == 'arbitration':
+                    self.master[sw.name] = message.status.code == code_pb2.OK
+                for handler in self._handlers[event]:
+                    await self._invoke(handler, sw, message)
+                if event == 'digest':
+                    ack = p4runtime_pb2.StreamMessageRequest()
+                    ack.digest_ack.digest_id = message.digest_id
+                    ack.digest_ack.list_id = message.list_id
+                    self._outgoing[sw.name].put_nowait(ack)
+        except grpc.aio.AioRpcError as e:
+            if e.code() != grpc.StatusCode.CANCELLED:
+                error = e
+        except Exception as e:
+            # an exception of a handler ends run(), like in a polling loop
+            self._fail(e)
+            return
+        self.master[sw.name] = False
+        for handler in self._handlers['closed']:
+            await self._invoke(handler, sw, error)
+
+    async def _invoke(self, function, *args):
+        if asyncio.iscoroutinefunction(function):
+            return await function(*args)
+        return await self.call(function, *args)
+
+    async def _every(self, interval, task, args):
+        deadline = self.loop.time() + interval
+        while True:
+            await asyncio.sleep(max(0.0, deadline - self.loop.time()))
+            try:
+                await self._invoke(task, *args)
+            except Exception as e:
+                self._fail(e)
+                return
+            deadline = max(deadline + interval, self.loop.time())
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def _serve(self, duration):
+        self._stopped = asyncio.Event()
+        if self._error is not None:
+            # a handler failed before run()
+            return
+        periodic = [self.loop.create_task(self._every(interval, task, args))
+                    for interval, task, args in self._periodic]
+        try:
+            if duration is None:
+                await self._stopped.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), duration)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in periodic:
+                task.cancel()
+            # a periodic task interrupted in its sleep ends at once, one
+            # running on the worker finishes first
+            await asyncio.gather(*periodic, return_exceptions=True)
+
+    async def _closeChannels(self):
+        # every task but this one, including run() when it was interrupted
+        # by KeyboardInterrupt
+        pending = asyncio.all_tasks(self.loop) - {asyncio.current_task()}
+        for task in pending:
+            task.cancel()
+        for stream in self._streams.values():
+            stream.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for channel in self._channels.values():
+            await channel.close()
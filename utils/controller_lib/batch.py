@@ -0,0 +1,256 @@
+"""
+Batched P4Runtime writes.
+批量写入：按交换机收集 Update，一个 WriteRequest 携带多个 Update，减少 gRPC 往返次数
+
+SwitchConnection.WriteTableEntry sends one WriteRequest (one round trip) per
+table entry. BatchWriter queues updates per switch and sends them as
+multi-update WriteRequests of up to batch_size updates each.
+
+Building, copying and serializing an Update message takes most of the time
+of a large batch, especially with the pure Python protobuf runtime. When
+many entries of a table differ only by their values, an UpdateTemplate
+serializes one Update once and splices the values of each entry into its
+bytes; BatchWriter sends such serialized updates as they are.
+"""
+from collections import OrderedDict, namedtuple
+
+import grpc
+from google.protobuf import text_format
+from google.rpc import code_pb2
+from p4.v1 import p4runtime_pb2
+
+from p4runtime_lib.error_utils import parseGrpcErrorBinaryDetails
+
+DEFAULT_BATCH_SIZE = 256
+
+
+# A single update of a batch that the switch rejected.
+# switch: the switch name, update: the p4runtime Update message,
+# code: the google.rpc canonical code, message: the error message from the switch
+UpdateError = namedtuple('UpdateError', ['switch', 'update', 'code', 'message'])
+
+
+class BatchWriter(object):
+    """
+    Collects updates per switch and sends them as multi-update WriteRequests.
+
+    A switch's queue is sent as soon as it holds batch_size updates; flush()
+    sends whatever is left. Updates rejected by the switch do not raise, they
+    are collected and returned by flush(). Any other gRPC error (e.g. the
+    switch is unreachable) is raised as grpc.RpcError.
+
+    With skip_existing, INSERTs rejected because the entry is already
+    installed (e.g. the switch kept its pipeline across a controller restart)
+    are counted in `existing` instead of being reported as errors.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, skip_existing=False):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1, got %d" % batch_size)
+        self.batch_size = batch_size
+        self.skip_existing = skip_existing
+        # switch name -> number of updates accepted by the switch
+        self.written = OrderedDict()
+        # switch name -> number of INSERTs skipped because of skip_existing
+        self.existing = OrderedDict()
+        self._errors = []
+        self._pending = OrderedDict()
+
+    def add(self, sw, table_entry):
+        """
+        Queues a table entry for sw, with the same update type that
+        SwitchConnection.WriteTableEntry would use: MODIFY for a default
+        action entry, INSERT otherwise.
+
+        :param sw: the switch connection
+        :param table_entry: the TableEntry built by P4InfoHelper.buildTableEntry
+        """
+        if table_entry.is_default_action:
+            self.modify(sw, table_entry)
+        else:
+            self.insert(sw, table_entry)
+
+    def insert(self, sw, table_entry):
+        self.addUpdate(sw, p4runtime_pb2.Update.INSERT, table_entry=table_entry)
+
+    def modify(self, sw, table_entry):
+        self.addUpdate(sw, p4runtime_pb2.Update.MODIFY, table_entry=table_entry)
+
+    def delete(self, sw, table_entry):
+        self.addUpdate(sw, p4runtime_pb2.Update.DELETE, table_entry=table_entry)
+
+    def addUpdate(self, sw, update_type, **entity):
+        """
+        Queues an update of any entity type, e.g.
+        addUpdate(sw, Update.MODIFY, register_entry=entry)
+
+        :param sw: the switch connection
+        :param update_type: p4runtime_pb2.Update.INSERT, MODIFY or DELETE
+        :param entity: exactly one entity field name of p4runtime_pb2.Entity
+                       and its message
+        """
+        if len(entity) != 1:
+            raise ValueError("Exactly one entity is expected, got %r" % list(entity))
+        update = p4runtime_pb2.Update()
+        update.type = update_type
+        for field_name, message in entity.items():
+            getattr(update.entity, field_name).CopyFrom(message)
+        self.queueUpdate(sw, update)
+
+    def queueUpdate(self, sw, update):
+        """
+        Queues a ready p4runtime Update message. The message is not copied,
+        so the same one can be queued for several switches, but it must not
+        be modified afterwards.
+
+        :param sw: the switch connection
+        :param update: the p4runtime Update message, or its serialized
+                       bytes (e.g. from UpdateTemplate.encode)
+        """
+        pending = self._pending.setdefault(sw, [])
+        pending.append(update)
+        if len(pending) >= self.batch_size:
+            self._send(sw, pending)
+            self._pending[sw] = []
+
+    def pending(self):
+        """Returns the number of queued updates that have not been sent yet."""
+        return sum(len(updates) for updates in self._pending.values())
+
+    def flush(self):
+        """
+        Sends all queued updates.
+
+        :return: the list of UpdateError for every update rejected since the
+                 last flush(), in the order the updates were queued
+        """
+        for sw, pending in self._pending.items():
+            if pending:
+                self._send(sw, pending)
+        self._pending.clear()
+        errors, self._errors = self._errors, []
+        return errors
+
+    def _send(self, sw, updates):
+        failed = 0
+        try:
+            sw.writeUpdates(updates)
+        except grpc.RpcError as e:
+            # BMv2 applies every update of the batch it can and reports the
+            # status of each one in the error details
+            p4_errors = parseGrpcErrorBinaryDetails(e)
+            if not p4_errors:
+                raise
+            for idx, p4_error in p4_errors:
+                failed += 1
+                update = updates[idx]
+                if isinstance(update, bytes):
+                    # only the rejected updates of a batch are parsed
+                    update = p4runtime_pb2.Update.FromString(update)
+                if (self.skip_existing and p4_error.canonical_code == code_pb2.ALREADY_EXISTS
+                        and update.type == p4runtime_pb2.Update.INSERT):
+                    self.existing[sw.name] = self.existing.get(sw.name, 0) + 1
+                    continue
+                self._errors.append(UpdateError(
+                    sw.name, update, p4_error.canonical_code, p4_error.message))
+        self.written[sw.name] = self.written.get(sw.name, 0) + len(updates) - failed
+
+
+class UpdateTemplate(object):
+    """
+    The serialized Update of a table entry, with blanks for its match and
+    action parameter values.
+
+    The template is built from an example entry; every exact or LPM match
+    value and every action parameter value is a blank, the prefix lengths,
+    ternary masks, priority and action stay those of the example. A value
+    is encoded on the bitwidth of its field, so filling the blanks never
+    changes the length of the nested messages and the bytes around the
+    blanks can be serialized once.
+    """
+
+    def __init__(self, p4info_helper, update_type, table_name, match_fields,
+                 action_name, action_params=None, priority=None):
+        """
+        :param p4info_helper: the P4Info helper
+        :param update_type: p4runtime_pb2.Update.INSERT, MODIFY or DELETE
+        :param table_name, match_fields, action_name, action_params, priority:
+            the example entry, as given to P4InfoHelper.buildTableEntry
+        """
+        update = p4runtime_pb2.Update()
+        update.type = update_type
+        entry = update.entity.table_entry
+        entry.CopyFrom(p4info_helper.buildTableEntry(
+            table_name=table_name, match_fields=match_fields, action_name=action_name,
+            action_params=action_params, priority=priority))
+        # the bytes fields holding the values, in the order of encode()
+        blanks = []
+        for field_match in entry.match:
+            kind = field_match.WhichOneof('field_match_type')
+            if kind in ('exact', 'lpm', 'ternary'):
+                blanks.append(getattr(field_match, kind))
+        blanks.extend(entry.action.action.params)
+        self.widths = [len(blank.value) for blank in blanks]
+        for blank in blanks:
+            blank.value = b'\x00' * len(blank.value)
+        zeros = update.SerializeToString()
+        self._parts = []
+        start = 0
+        for blank in blanks:
+            # the only bytes that differ are those of the blank
+            blank.value = b'\xff' * len(blank.value)
+            ones = update.SerializeToString()
+            blank.value = b'\x00' * len(blank.value)
+            offset = next(i for i in range(start, len(zeros)) if zeros[i] != ones[i])
+            self._parts.append(zeros[start:offset])
+            start = offset + len(blank.value)
+        self._parts.append(zeros[start:])
+
+    def encode(self, *values):
+        """
+        :param values: the bytes of the blanks, match values first, each of
+                       the width of its field
+        :return: the serialized Update
+        """
+        if len(values) != len(self.widths):
+            raise ValueError("Expected %d values, got %d" % (len(self.widths), len(values)))
+        parts = self._parts
+        out = [parts[0]]
+        for i, value in enumerate(values):
+            if len(value) != self.widths[i]:
+                raise ValueError("Value %d is %d bytes long, expected %d" % (
+                    i, len(value), self.widths[i]))
+            out.append(value)
+            out.append(parts[i + 1])
+        return b''.join(out)
+
+
+def printWriteSummary(writer, errors):
+    """
+    Prints the number of installed entries per switch, then the errors.
+
+    :param writer: the BatchWriter
+    :param errors: the list of UpdateError returned by writer.flush()
+    """
+    for sw_name, count in writer.written.items():
+        if writer.existing.get(sw_name):
+            print("Installed %d rules on %s (%d already installed)" % (
+                count, sw_name, writer.existing[sw_name]))
+        else:
+            print("Installed %d rules on %s" % (count, sw_name))
+    printWriteErrors(errors)
+
+
+def printWriteErrors(errors):
+    """
+    Prints the updates rejected by the switches, one per line.
+
+    :param errors: the list of UpdateError returned by BatchWriter.flush()
+    """
+    for err in errors:
+        print("%s: %s failed (%s): '%s' %s" % (
+            err.switch,
+            p4runtime_pb2.Update.Type.Name(err.update.type),
+            code_pb2.Code.Name(err.code),
+            err.message,
+            text_format.MessageToString(err.update.entity, as_one_line=True)))
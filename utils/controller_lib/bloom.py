@@ -0,0 +1,193 @@
+"""
+Offline model of the firewall Bloom filter.
+防火墙布隆过滤器的离线模拟：用 NumPy 逐位复现 BMv2 的 crc16/crc32 哈希，批量估算占用率与误判率
+
+firewall.p4 sets, for every outgoing SYN, bit crc16(key) % ENTRIES of
+bloom_filter_1 and bit crc32(key) % ENTRIES of bloom_filter_2, where key is
+(internal address, external address, internal port, external port,
+protocol), 13 bytes in network order. An incoming packet passes when both
+of its bits are set, so a packet of a connection that was never opened
+passes with the false positive rate of the pair of filters.
+
+The hashes are computed for all flows at once, one byte column at a time,
+with the same tables as BMv2: crc16 is CRC-16/ARC (BMv2's crc16) and
+crc32 is the CRC-32 of zlib. Since the position is the hash modulo the
+filter size, the hashes are computed once and reused for every size.
+crc16 is below 65536, so a bloom_filter_1 larger than that only ever uses
+its first 65536 bits.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# Size of the registers in firewall.p4
+DEFAULT_ENTRIES = 4096
+
+TCP_PROTOCOL = 6
+
+# Filter state after inserting `flows` connections into filters of `entries`
+# bits: occupancy1/2 is the fraction of set bits of bloom_filter_1/2,
+# false_positive the fraction of the probe flows that pass, expected the
+# rate predicted from the occupancies
+BloomResult = namedtuple('BloomResult', ['entries', 'flows', 'occupancy1', 'occupancy2',
+                                         'false_positive', 'expected'])
+
+
+def _crcTable(poly, width):
+    # table of the reflected algorithm, poly is the reflected polynomial
+    table = np.zeros(256, dtype=np.uint32)
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ poly if crc & 1 else crc >> 1
+        table[byte] = crc
+    return table & np.uint32((1 << width) - 1)
+
+
+_CRC16_TABLE = _crcTable(0xA001, 16)
+_CRC32_TABLE = _crcTable(0xEDB88320, 32)
+
+
+def _crc(table, keys, init, xor_out):
+    crc = np.full(len(keys), init, dtype=np.uint32)
+    for column in range(keys.shape[1]):
+        crc = table[(crc ^ keys[:, column]) & 0xff] ^ (crc >> 8)
+    return crc ^ np.uint32(xor_out)
+
+
+def crc16(keys):
+    """
+    :param keys: uint8 array of shape (flows, key length)
+    :return: uint32 array of the crc16 of every row, as computed by BMv2
+    """
+    return _crc(_CRC16_TABLE, keys, 0, 0)
+
+
+def crc32(keys):
+    """
+    :param keys: uint8 array of shape (flows, key length)
+    :return: uint32 array of the crc32 of every row, as computed by BMv2
+    """
+    return _crc(_CRC32_TABLE, keys, 0xffffffff, 0xffffffff)
+
+
+def flowKeys(addr1, addr2, port1, port2, protocol=TCP_PROTOCOL):
+    """
+    Builds the hash input of compute_hashes.
+
+    :param addr1, addr2: arrays of IPv4 addresses as integers, the internal
+                         host first (ipAddr1, ipAddr2 in firewall.p4)
+    :param port1, port2: arrays of the TCP ports, in the same order
+    :param protocol: the IP protocol, a scalar or an array
+    :return: uint8 array of shape (flows, 13)
+    """
+    keys = np.empty((len(addr1), 13), dtype=np.uint8)
+    for offset, values, size in ((0, addr1, 4), (4, addr2, 4), (8, port1, 2), (10, port2, 2)):
+        values = np.asarray(values, dtype=np.uint32)
+        for i in range(size):
+            keys[:, offset + i] = (values >> (8 * (size - 1 - i))) & 0xff
+    keys[:, 12] = protocol
+    return keys
+
+
+def syntheticFlows(count, rng, internal_net=0x0a000100, internal_hosts=254):
+    """
+    Random TCP connections from internal hosts to external servers.
+
+    :param count: the number of flows
+    :param rng: a numpy.random.Generator
+    :param internal_net: the internal network address, 10.0.1.0 by default
+    :param internal_hosts: the number of internal hosts
+    :return: the flow keys, as returned by flowKeys
+    """
+    internal = internal_net + rng.integers(1, internal_hosts + 1, count)
+    external = rng.integers(0x01000000, 0xe0000000, count)
+    sport = rng.integers(1024, 65536, count)
+    dport = rng.choice(np.array([80, 443, 22, 53, 8080], dtype=np.uint32), count)
+    return flowKeys(internal, external, sport, dport)
+
+
+class BloomFilterModel(object):
+    """
+    The two hashes of a set of flows, to simulate filters of any size.
+    """
+
+    def __init__(self, keys):
+        """
+        :param keys: the flow keys, as returned by flowKeys
+        """
+        self.keys = keys
+        self.hash1 = crc16(keys)
+        self.hash2 = crc32(keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def positions(self, entries=DEFAULT_ENTRIES, flows=None):
+        """
+        :return: the register indices (reg_pos_one, reg_pos_two) of the
+                 first `flows` flows in filters of `entries` bits
+        """
+        return self.hash1[:flows] % entries, self.hash2[:flows] % entries
+
+    def filters(self, entries=DEFAULT_ENTRIES, flows=None):
+        """
+        :return: the two filters, as boolean arrays, after inserting the
+                 first `flows` flows
+        """
+        pos1, pos2 = self.positions(entries, flows)
+        filter1 = np.zeros(entries, dtype=bool)
+        filter2 = np.zeros(entries, dtype=bool)
+        filter1[pos1] = True
+        filter2[pos2] = True
+        return filter1, filter2
+
+    def simulate(self, probes, sizes=(DEFAULT_ENTRIES,), counts=None):
+        """
+        Inserts the flows into filters of every size and counts the probe
+        flows that pass.
+
+        :param probes: a BloomFilterModel of flows that were never opened
+        :param sizes: the filter sizes, in bits
+        :param counts: the numbers of inserted flows (the first ones), all
+                       flows by default
+        :return: the list of BloomResult, by size then by count
+        """
+        if counts is None:
+            counts = [len(self)]
+        results = []
+        for entries in sizes:
+            probe1, probe2 = probes.positions(entries)
+            for flows in counts:
+                if flows > len(self):
+                    raise ValueError("Only %d flows to insert, not %d" % (len(self), flows))
+                filter1, filter2 = self.filters(entries, flows)
+                occupancy1 = filter1.mean()
+                occupancy2 = filter2.mean()
+                passed = filter1[probe1] & filter2[probe2]
+                results.append(BloomResult(entries, flows, float(occupancy1), float(occupancy2),
+                                           float(passed.mean()) if len(passed) else 0.0,
+                                           float(occupancy1 * occupancy2)))
+        return results
+
+
+def expectedFalsePositive(entries, flows):
+    """
+    :return: the false positive rate of two filters of `entries` bits with
+             one independent uniform hash each, after `flows` insertions
+    """
+    return (1.0 - np.exp(-float(flows) / entries)) ** 2
+
+
+def printBloomResults(results):
+    """
+    Prints one line per filter size and flow count.
+
+    :param results: the list of BloomResult returned by simulate()
+    """
+    print("%10s %10s %9s %9s %12s %12s %12s" % (
+        "entries", "flows", "occ1", "occ2", "false pos", "expected", "theory"))
+    for r in results:
+        print("%10d %10d %9.4f %9.4f %12.6f %12.6f %12.6f" % (
+            r.entries, r.flows, r.occupancy1, r.occupancy2, r.false_positive, r.expected,
+            expectedFalsePositive(r.entries, r.flows)))
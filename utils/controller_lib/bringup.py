@@ -0,0 +1,93 @@
+"""
+Concurrent switch bring-up.
+并发初始化交换机：同时对所有交换机完成主控仲裁并下发 P4 程序
+
+Arbitration and SetForwardingPipelineConfig block until the switch answers,
+so doing them switch after switch makes startup as slow as the sum of all
+switches. bringUpSwitches runs them on a thread pool instead, which makes
+startup about as slow as the slowest switch.
+
+The program is read and serialized once for all switches (see
+pipeline.PipelineArtifact). With skip_unchanged, a switch whose installed
+pipeline has the same cookie keeps its pipeline and its table entries.
+"""
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+from google.rpc import code_pb2
+
+from .pipeline import PipelineArtifact, getPipelineCookie
+
+# Outcome of bringing up one switch.
+# switch: the switch name, error: None on success, otherwise a description
+# of what failed, elapsed: seconds spent on this switch,
+# pushed: False if the switch already ran the program and was left alone
+BringUpResult = namedtuple('BringUpResult', ['switch', 'error', 'elapsed', 'pushed'])
+
+
+def bringUpSwitch(sw, artifact, skip_unchanged=False, arbitrate=True):
+    """
+    Makes this controller the master of sw and installs the P4 program on it.
+
+    :param sw: the switch connection
+    :param artifact: the PipelineArtifact of the program
+    :param skip_unchanged: do not install the program if the switch
+                           already runs a pipeline with the same cookie
+    :param arbitrate: False if this controller is already the master, e.g.
+                      through the stream of an aioruntime.SwitchRuntime
+    :return: a BringUpResult
+    """
+    start = time.time()
+    try:
+        response = sw.MasterArbitrationUpdate() if arbitrate else None
+        if response is not None and response.arbitration.status.code != code_pb2.OK:
+            return BringUpResult(sw.name, "not master: %s" % response.arbitration.status.message,
+                                 time.time() - start, False)
+        if skip_unchanged and getPipelineCookie(sw) == artifact.cookie:
+            return BringUpResult(sw.name, None, time.time() - start, False)
+        artifact.push(sw)
+    except grpc.RpcError as e:
+        return BringUpResult(sw.name, "%s (%s)" % (e.details(), e.code().name),
+                             time.time() - start, False)
+    return BringUpResult(sw.name, None, time.time() - start, True)
+
+
+def bringUpSwitches(switches, p4info, bmv2_json_file_path, skip_unchanged=False,
+                    max_workers=None):
+    """
+    Runs bringUpSwitch on all switches concurrently.
+
+    :param switches: the switch connections
+    :param p4info: the P4Info message of the program
+    :param bmv2_json_file_path: the BMv2 JSON file of the program
+    :param skip_unchanged: leave alone the switches that already run the program
+    :param max_workers: max number of switches brought up at the same time,
+                        defaults to all of them
+    :return: the list of BringUpResult, in the order of switches
+    """
+    if not switches:
+        return []
+    artifact = PipelineArtifact(p4info, bmv2_json_file_path)
+    with ThreadPoolExecutor(max_workers=max_workers or len(switches)) as pool:
+        return list(pool.map(lambda sw: bringUpSwitch(sw, artifact, skip_unchanged), switches))
+
+
+def printBringUpResults(results):
+    """
+    Prints one line per switch.
+
+    :param results: the list of BringUpResult returned by bringUpSwitches
+    :return: True if every switch was brought up
+    """
+    for result in results:
+        if result.error is None and not result.pushed:
+            print("P4 Program already installed on %s, skipped SetForwardingPipelineConfig (%.3fs)" % (
+                result.switch, result.elapsed))
+        elif result.error is None:
+            print("Installed P4 Program using SetForwardingPipelineConfig on %s (%.3fs)" % (
+                result.switch, result.elapsed))
+        else:
+            print("Failed to bring up %s: %s" % (result.switch, result.error))
+    return all(result.error is None for result in results)
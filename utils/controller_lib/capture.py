@@ -0,0 +1,233 @@
+"""
+Packet capture in bulk.
+批量抓包：读取 pcap 文件或从原始套接字收包到预分配的环形缓冲区，以 NumPy 批量访问各个包的字段
+
+PcapFile reads classic pcap files (not pcapng) of Ethernet captures, such
+as those written by tcpdump -w or by the BMv2 --pcap option. Only the
+record headers are walked in Python; header fields of all packets are then
+gathered with NumPy, see readField.
+
+RawCapture receives frames on a raw socket with recv_into into the rows of
+one preallocated array and hands every filled ring to a handler in the
+same (data, offsets, lengths) form as a PcapFile, so that the same decoders
+serve both.
+"""
+import select
+import socket
+import struct
+import time
+
+from collections import namedtuple
+
+import numpy as np
+
+# magic number read as little endian -> byte order of the file and
+# timestamp resolution
+_MAGICS = {
+    0xa1b2c3d4: ('<', 1e-6),
+    0xd4c3b2a1: ('>', 1e-6),
+    0xa1b23c4d: ('<', 1e-9),
+    0x4d3cb2a1: ('>', 1e-9),
+}
+_LINKTYPE_ETHERNET = 1
+ETH_P_IP = 0x0800
+_ETHERTYPE_IPV4 = 0x0800
+_TCP_PROTOCOL = 6
+_PROTOCOLS_WITH_PORTS = (6, 17)
+_TCP_SYN = 0x02
+_TCP_ACK = 0x10
+# Ethernet, IPv4 without options, and the TCP header up to its flags
+_MIN_LENGTH = 14 + 20 + 14
+# Ethernet and IPv4 without options
+_MIN_IPV4_LENGTH = 14 + 20
+
+# The IPv4 packets of a batch of frames, as aligned arrays: the index of the
+# frame in the batch, addresses, protocol, ports (0 when the protocol has
+# none or they were not captured), the tos byte and the IPv4 total length
+Ipv4Packets = namedtuple('Ipv4Packets', ['packet', 'src', 'dst', 'protocol', 'sport', 'dport',
+                                         'tos', 'length'])
+
+
+def readField(data, offsets, size):
+    """
+    Reads a big endian field of every packet.
+
+    :param data: uint8 array holding the packets
+    :param offsets: int64 array of the offset of the field in every packet
+    :param size: the size of the field in bytes, at most 4
+    :return: uint32 array of the values
+    """
+    value = np.zeros(len(offsets), dtype=np.uint32)
+    for i in range(size):
+        value = (value << 8) | data[offsets + i]
+    return value
+
+
+def decodeIpv4(data, offsets, lengths):
+    """
+    Decodes the IPv4 header, and the ports of TCP and UDP, of a batch of
+    Ethernet frames.
+
+    :param data: uint8 array holding the frames
+    :param offsets: int64 array of the offset of every frame in data
+    :param lengths: int64 array of the captured length of every frame
+    :return: the Ipv4Packets of the IPv4 frames
+    """
+    packets = np.arange(len(offsets))
+    keep = lengths >= _MIN_IPV4_LENGTH
+    packets, offsets, lengths = packets[keep], offsets[keep], lengths[keep]
+    keep = readField(data, offsets + 12, 2) == _ETHERTYPE_IPV4
+    packets, offsets, lengths = packets[keep], offsets[keep], lengths[keep]
+    ip = offsets + 14
+    keep = (data[ip] >> 4) == 4
+    packets, offsets, lengths, ip = packets[keep], offsets[keep], lengths[keep], ip[keep]
+    protocol = data[ip + 9]
+    l4 = ip + (data[ip] & 0x0f).astype(np.int64) * 4
+    ports = np.isin(protocol, _PROTOCOLS_WITH_PORTS) & (l4 + 4 <= offsets + lengths)
+    sport = np.zeros(len(ip), dtype=np.uint32)
+    dport = np.zeros(len(ip), dtype=np.uint32)
+    sport[ports] = readField(data, l4[ports], 2)
+    dport[ports] = readField(data, l4[ports] + 2, 2)
+    return Ipv4Packets(packets, readField(data, ip + 12, 4), readField(data, ip + 16, 4),
+                       protocol, sport, dport, data[ip + 1], readField(data, ip + 2, 2))
+
+
+class PcapFile(object):
+    """
+    The packets of a pcap file, as offsets into its content, with their
+    captured lengths and their timestamps in seconds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = np.frombuffer(f.read(), dtype=np.uint8)
+        if len(self.data) < 24:
+            raise ValueError("%s: not a pcap file" % path)
+        magic, = struct.unpack_from('<I', self.data, 0)
+        if magic not in _MAGICS:
+            raise ValueError("%s: not a pcap file (magic 0x%08x), pcapng is not supported"
+                             % (path, magic))
+        endian, resolution = _MAGICS[magic]
+        linktype, = struct.unpack_from(endian + 'I', self.data, 20)
+        if linktype != _LINKTYPE_ETHERNET:
+            raise ValueError("%s: link type %d, only Ethernet captures are supported"
+                             % (path, linktype))
+        offsets = []
+        lengths = []
+        seconds = []
+        fractions = []
+        record = struct.Struct(endian + 'IIII')
+        pos = 24
+        end = len(self.data)
+        while pos + 16 <= end:
+            ts_sec, ts_frac, caplen, _ = record.unpack_from(self.data, pos)
+            offsets.append(pos + 16)
+            lengths.append(caplen)
+            seconds.append(ts_sec)
+            fractions.append(ts_frac)
+            pos += 16 + caplen
+        if pos > end:
+            # the capture was cut in the middle of the last packet
+            offsets.pop()
+            lengths.pop()
+            seconds.pop()
+            fractions.pop()
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.lengths = np.array(lengths, dtype=np.int64)
+        self.times = (np.array(seconds, dtype=np.float64)
+                      + np.array(fractions, dtype=np.float64) * resolution)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def tcpSyns(self):
+        """
+        The connection openings of the capture: TCP packets with SYN set and
+        ACK clear, over IPv4 in untagged Ethernet frames.
+
+        :return: (src address, dst address, src port, dst port), arrays of
+                 the same length, one element per SYN
+        """
+        offsets = self.offsets[self.lengths >= _MIN_LENGTH]
+        lengths = self.lengths[self.lengths >= _MIN_LENGTH]
+        ipv4 = readField(self.data, offsets + 12, 2) == _ETHERTYPE_IPV4
+        offsets, lengths = offsets[ipv4], lengths[ipv4]
+        ip = offsets + 14
+        tcp = ip + (self.data[ip] & 0x0f).astype(np.int64) * 4
+        keep = ((self.data[ip + 9] == _TCP_PROTOCOL) & (tcp + 14 <= offsets + lengths))
+        ip, tcp = ip[keep], tcp[keep]
+        flags = self.data[tcp + 13]
+        syn = (flags & (_TCP_SYN | _TCP_ACK)) == _TCP_SYN
+        ip, tcp = ip[syn], tcp[syn]
+        return (readField(self.data, ip + 12, 4), readField(self.data, ip + 16, 4),
+                readField(self.data, tcp, 2), readField(self.data, tcp + 2, 2))
+
+
+class RawCapture(object):
+    """
+    Receives frames on a raw socket into a ring of preallocated buffers.
+    """
+
+    def __init__(self, iface, protocol=ETH_P_IP, slots=1024, slot_size=2048,
+                 rcvbuf=4 << 20):
+        """
+        :param iface: the interface to capture on, e.g. eth0
+        :param protocol: the ethertype to capture
+        :param slots: the number of frames handed to the handler together
+        :param slot_size: the largest frame, bigger frames are truncated
+        :param rcvbuf: the socket receive buffer size, which absorbs the
+                       bursts arriving while a ring is handled
+        """
+        self._ring = np.zeros((slots, slot_size), dtype=np.uint8)
+        self._data = self._ring.reshape(-1)
+        self._views = [memoryview(row) for row in self._ring]
+        self._offsets = np.arange(slots, dtype=np.int64) * slot_size
+        self._lengths = np.zeros(slots, dtype=np.int64)
+        self.received = 0
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(protocol))
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.bind((iface, 0))
+        self.sock.setblocking(False)
+
+    def close(self):
+        self.sock.close()
+
+    def poll(self, timeout, handler):
+        """
+        Waits up to timeout seconds for frames, then receives everything
+        the socket holds, a ring at a time, calling
+        handler(data, offsets, lengths, now) for every ring. The arrays are
+        reused by the next ring.
+
+        :return: the number of frames received
+        """
+        if not select.select([self.sock], [], [], timeout)[0]:
+            return 0
+        received = 0
+        while True:
+            filled = 0
+            for view in self._views:
+                try:
+                    self._lengths[filled] = self.sock.recv_into(view)
+                except BlockingIOError:
+                    break
+                filled += 1
+            handler(self._data, self._offsets[:filled], self._lengths[:filled], time.time())
+            received += filled
+            if filled < len(self._views):
+                break
+        self.received += received
+        return received
+
+    def run(self, handler, duration=None, report=None, interval=1.0):
+        """
+        Captures until duration seconds have passed (forever if None),
+        calling report() every interval seconds.
+        """
+        start = last_report = time.time()
+        while duration is None or time.time() - start < duration:
+            self.poll(min(interval, 0.1), handler)
+            if report is not None and time.time() - last_report >= interval:
+                report()
+                last_report = time.time()
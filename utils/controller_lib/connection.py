@@ -0,0 +1,165 @@
+"""
+Switch connection of the controllers.
+控制器使用的交换机连接：写请求只经由一条发送路径，election id 取自交换机实际接受的主控仲裁
+
+p4runtime_lib.switch.SwitchConnection puts election id 1 in every request
+and builds one WriteRequest per table entry. ControllerConnection keeps
+the election id of the arbitration the switch granted (aioruntime sets it
+from the arbitration response) and sends every WriteRequest of
+controller_lib through writeUpdates(), and every pipeline config through
+setPipelineConfig(). The updates are Update messages or their serialized
+bytes (e.g. from batch.UpdateTemplate), and the pipeline config is the
+encoded config field shared by all switches (pipeline.PipelineArtifact):
+such requests are serialized by concatenating their fields rather than by
+building the message.
+
+The proto dumps and the metrics see the requests through gRPC client
+interceptors, installed with addInterceptor(). The connection rebuilds its
+channel and stub from all of them in the order of their position, whatever
+the order in which they were added.
+"""
+import grpc
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+import p4runtime_lib.bmv2
+
+from .wire import WIRETYPE_LENGTH_DELIMITED, encodeVarint, fieldKey
+
+# (high, low), same as p4runtime_lib
+DEFAULT_ELECTION_ID = (0, 1)
+
+# positions of the interceptors of a connection, from the controller to the
+# switch: the dumps log every request, the timing is closest to the wire
+INTERCEPTOR_PROTO_DUMP = 10
+INTERCEPTOR_RPC_STATS = 20
+
+_WRITE_METHOD = '/p4.v1.P4Runtime/Write'
+_SET_PIPELINE_METHOD = '/p4.v1.P4Runtime/SetForwardingPipelineConfig'
+_UPDATES_KEY = encodeVarint(fieldKey(
+    p4runtime_pb2.WriteRequest.DESCRIPTOR.fields_by_name['updates'].number,
+    WIRETYPE_LENGTH_DELIMITED))
+
+
+class ControllerConnection(p4runtime_lib.bmv2.Bmv2SwitchConnection):
+    """
+    A Bmv2SwitchConnection whose requests carry the election id of its
+    arbitration.
+    """
+
+    def __init__(self, name, address, device_id, election_id=DEFAULT_ELECTION_ID):
+        """
+        :param name: the switch name
+        :param address: host:port of the P4Runtime server of the switch
+        :param device_id: the device id of the switch
+        :param election_id: (high, low) sent in the master arbitration
+        """
+        super(ControllerConnection, self).__init__(name=name, address=address,
+                                                   device_id=device_id, proto_dump_file=None)
+        self.election_id = tuple(election_id)
+        self._channel = self.channel
+        self._stream_open = True
+        # (position, interceptor)
+        self._interceptors = []
+
+    def addInterceptor(self, interceptor, position):
+        """
+        Passes the requests of this connection through a gRPC client
+        interceptor. The interceptors with a lower position see a request
+        first; those with the same position, in the order they were added.
+
+        :param interceptor: e.g. a grpc.UnaryUnaryClientInterceptor
+        :param position: e.g. INTERCEPTOR_PROTO_DUMP
+        """
+        self._interceptors.append((position, interceptor))
+        # sorted() is stable
+        interceptors = [i for _, i in sorted(self._interceptors, key=lambda item: item[0])]
+        self.channel = grpc.intercept_channel(self._channel, *interceptors)
+        self.client_stub = p4runtime_pb2_grpc.P4RuntimeStub(self.channel)
+
+    def closeStream(self):
+        """
+        Closes the StreamChannel opened by p4runtime_lib, once, e.g. when
+        the stream of the switch is handled by an aioruntime.SwitchRuntime.
+        """
+        if self._stream_open:
+            self._stream_open = False
+            super(ControllerConnection, self).shutdown()
+
+    def shutdown(self):
+        self.closeStream()
+
+    def setElectionId(self, message):
+        """
+        Sets the election id of this connection in a p4runtime Uint128.
+        """
+        message.high, message.low = self.election_id
+
+    def MasterArbitrationUpdate(self, dry_run=False, **kwargs):
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.arbitration.device_id = self.device_id
+        self.setElectionId(request.arbitration.election_id)
+        if dry_run:
+            print("P4Runtime MasterArbitrationUpdate: ", request)
+            return None
+        self.requests_stream.put(request)
+        for item in self.stream_msg_resp:
+            return item
+
+    def WriteTableEntry(self, table_entry, dry_run=False):
+        update = p4runtime_pb2.Update()
+        if table_entry.is_default_action:
+            update.type = p4runtime_pb2.Update.MODIFY
+        else:
+            update.type = p4runtime_pb2.Update.INSERT
+        update.entity.table_entry.CopyFrom(table_entry)
+        if dry_run:
+            print("P4Runtime Write:", update)
+            return
+        self.writeUpdates([update])
+
+    def writeUpdates(self, updates):
+        """
+        Sends one WriteRequest holding the updates, in their order.
+
+        :param updates: p4runtime Update messages, or their serialized bytes
+        :raises grpc.RpcError: as the Write RPC, e.g. with the per-update
+                               errors of a rejected batch in its details
+        """
+        request = p4runtime_pb2.WriteRequest()
+        request.device_id = self.device_id
+        self.setElectionId(request.election_id)
+        if not any(isinstance(update, bytes) for update in updates):
+            request.updates.extend(updates)
+            return self.client_stub.Write(request)
+        # a repeated field is encoded as one field per element, appended to
+        # the other fields of the request
+        parts = [request.SerializeToString()]
+        for update in updates:
+            if not isinstance(update, bytes):
+                update = update.SerializeToString()
+            parts.append(_UPDATES_KEY)
+            parts.append(encodeVarint(len(update)))
+            parts.append(update)
+        return self._callSerialized(_WRITE_METHOD, b''.join(parts),
+                                    p4runtime_pb2.WriteResponse)
+
+    def setPipelineConfig(self, config_field):
+        """
+        Sends a VERIFY_AND_COMMIT SetForwardingPipelineConfigRequest.
+
+        :param config_field: the config field of the request, encoded
+                             (PipelineArtifact.config_field)
+        """
+        request = p4runtime_pb2.SetForwardingPipelineConfigRequest()
+        request.device_id = self.device_id
+        self.setElectionId(request.election_id)
+        request.action = p4runtime_pb2.SetForwardingPipelineConfigRequest.VERIFY_AND_COMMIT
+        return self._callSerialized(_SET_PIPELINE_METHOD,
+                                    request.SerializeToString() + config_field,
+                                    p4runtime_pb2.SetForwardingPipelineConfigResponse)
+
+    def _callSerialized(self, method, data, response_type):
+        # no request_serializer: the bytes are sent as they are, through
+        # the interceptors of the channel like the stub's requests
+        call = self.channel.unary_unary(method, response_deserializer=response_type.FromString)
+        return call(data)
@@ -0,0 +1,204 @@
+"""
+Weighted ECMP groups.
+加权 ECMP 组管理：按权重把下一跳复制到多个选择槽位，成员变化时尽量保持原有流所在的槽位不变
+
+The load_balance program hashes the 5-tuple of a packet into
+[ecmp_base, ecmp_base + ecmp_count - 1] (ecmp_group table) and forwards it
+with the ecmp_nhop entry of that slot. EcmpManager gives every group a
+fixed number of slots, so the hash of a flow never changes, and fills the
+slots with the members of the group in proportion to their weights.
+
+When members or weights change, the slots of members that keep at least
+as many slots as before are left untouched; only the slots a member loses
+are handed to the members that gain some. sync() then writes only the
+ecmp_nhop entries whose slot changed, so the flows of the other slots keep
+their next hop.
+"""
+from collections import OrderedDict, namedtuple
+
+# One member of a group: the next hop MAC and IPv4 address written into the
+# packet and the egress port
+NextHop = namedtuple('NextHop', ['dmac', 'ipv4', 'port'])
+
+# Slots of a group when none is given
+DEFAULT_GROUP_SLOTS = 16
+# Size of the ecmp_nhop table in load_balance.p4
+DEFAULT_TABLE_SIZE = 1024
+
+
+def _quotas(weights, slots):
+    # largest remainder: every member gets the integer part of its share,
+    # the slots left go to the largest fractional parts, ties to the
+    # member added first
+    total = sum(weights.values())
+    quotas = OrderedDict()
+    remainders = []
+    for i, (member, weight) in enumerate(weights.items()):
+        share, remainder = divmod(weight * slots, total)
+        quotas[member] = share
+        remainders.append((-remainder, i, member))
+    remainders.sort()
+    for _, _, member in remainders[:slots - sum(quotas.values())]:
+        quotas[member] += 1
+    return quotas
+
+
+class EcmpGroup(object):
+    """
+    The slots [base, base + size - 1] of a switch and the weighted members
+    spread over them. A slot with no member drops packets.
+    """
+
+    def __init__(self, sw, dst_prefix, base, size):
+        self.sw = sw
+        self.dst_prefix = dst_prefix
+        self.base = base
+        self.size = size
+        # NextHop -> weight
+        self.weights = OrderedDict()
+        # NextHop (or None) per slot
+        self.slots = [None] * size
+        # the slots as last written by EcmpManager.sync(), None before
+        self.installed = None
+
+    def setMember(self, nhop, weight=1):
+        """
+        Adds a member, or changes its weight. A weight of 0 removes it.
+        """
+        if weight < 0:
+            raise ValueError("The weight of %s must not be negative, got %d" % (nhop, weight))
+        if weight == 0:
+            self.weights.pop(nhop, None)
+        else:
+            self.weights[nhop] = weight
+
+    def removeMember(self, nhop):
+        del self.weights[nhop]
+
+    def layout(self):
+        """
+        Assigns the slots to the members, moving as few slots as possible.
+
+        :return: the list of slot offsets whose member changed
+        """
+        previous = list(self.slots)
+        if not self.weights:
+            self.slots = [None] * self.size
+        else:
+            quotas = _quotas(self.weights, self.size)
+            kept = dict.fromkeys(quotas, 0)
+            free = []
+            for i, member in enumerate(self.slots):
+                if member in kept and kept[member] < quotas[member]:
+                    kept[member] += 1
+                else:
+                    free.append(i)
+            # the members whose quota grew take exactly the slots the others lost
+            free = iter(free)
+            for member, quota in quotas.items():
+                for _ in range(quota - kept[member]):
+                    self.slots[next(free)] = member
+        return [i for i in range(self.size) if self.slots[i] != previous[i]]
+
+
+class EcmpManager(object):
+    """
+    Keeps the ECMP groups of switches and writes their table entries.
+
+    Every group gets its own range of ecmp_nhop indices, allocated one after
+    the other on each switch.
+    """
+
+    def __init__(self, p4info_helper, table_size=DEFAULT_TABLE_SIZE):
+        """
+        :param p4info_helper: the P4Info helper
+        :param table_size: the size of the ecmp_nhop table
+        """
+        self.p4info_helper = p4info_helper
+        self.table_size = table_size
+        # (switch, dst_prefix) -> EcmpGroup
+        self.groups = OrderedDict()
+        # switch -> next free ecmp_nhop index
+        self._next_base = {}
+
+    def addGroup(self, sw, dst_prefix, slots=DEFAULT_GROUP_SLOTS):
+        """
+        :param sw: the switch connection
+        :param dst_prefix: the (ip, prefix length) the group forwards
+        :param slots: the number of slots, i.e. the resolution of the weights
+        :return: the EcmpGroup
+        :raises ValueError: if the ecmp_nhop table of sw is full
+        """
+        if (sw, dst_prefix) in self.groups:
+            raise ValueError("%s already has an ECMP group for %s/%d" % ((sw.name,) + dst_prefix))
+        base = self._next_base.get(sw, 0)
+        if base + slots > self.table_size:
+            raise ValueError("No room for %d more ECMP slots on %s, %d of %d are used" % (
+                slots, sw.name, base, self.table_size))
+        self._next_base[sw] = base + slots
+        group = EcmpGroup(sw, dst_prefix, base, slots)
+        self.groups[(sw, dst_prefix)] = group
+        return group
+
+    def group(self, sw, dst_prefix):
+        return self.groups[(sw, dst_prefix)]
+
+    def sync(self, writer):
+        """
+        Queues the updates that bring the switches to the current members
+        and weights: the ecmp_group entry and every slot of a new group, and
+        a MODIFY of the changed slots of the others.
+
+        :param writer: the BatchWriter (or, for the first sync, Reconciler)
+                       the updates are queued on
+        :return: the number of ecmp_nhop entries queued
+        """
+        queued = 0
+        for group in self.groups.values():
+            group.layout()
+            if group.installed is None:
+                writer.add(group.sw, self._groupEntry(group))
+                for i in range(group.size):
+                    writer.add(group.sw, self._slotEntry(group, i))
+                queued += group.size
+            else:
+                for i in range(group.size):
+                    if group.slots[i] != group.installed[i]:
+                        writer.modify(group.sw, self._slotEntry(group, i))
+                        queued += 1
+            group.installed = list(group.slots)
+        return queued
+
+    def _groupEntry(self, group):
+        return self.p4info_helper.buildTableEntry(
+            table_name="MyIngress.ecmp_group",
+            match_fields={
+                "hdr.ipv4.dstAddr": group.dst_prefix
+            },
+            action_name="MyIngress.set_ecmp_select",
+            action_params={
+                "ecmp_base": group.base,
+                "ecmp_count": group.size
+            })
+
+    def _slotEntry(self, group, i):
+        nhop = group.slots[i]
+        if nhop is None:
+            return self.p4info_helper.buildTableEntry(
+                table_name="MyIngress.ecmp_nhop",
+                match_fields={
+                    "meta.ecmp_select": group.base + i
+                },
+                action_name="MyIngress.drop",
+                action_params={})
+        return self.p4info_helper.buildTableEntry(
+            table_name="MyIngress.ecmp_nhop",
+            match_fields={
+                "meta.ecmp_select": group.base + i
+            },
+            action_name="MyIngress.set_nhop",
+            action_params={
+                "nhop_dmac": nhop.dmac,
+                "nhop_ipv4": nhop.ipv4,
+                "port": nhop.port
+            })
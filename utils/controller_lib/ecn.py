@@ -0,0 +1,212 @@
+"""
+ECN marking rate analysis.
+ECN 标记率分析：批量解析抓包中 IPv4 头部的 ECN 码点，按流和按目的网段统计滑动时间窗口内的 CE 比例，用于调整 ECN_THRESHOLD
+
+ecn.p4 sets the ECN field of an ECN-capable packet (ECT(0) or ECT(1)) to CE
+when the queue it leaves holds ECN_THRESHOLD packets or more. The share of
+CE among the ECN-capable packets received by a host tells how often the
+threshold is crossed on the way:
+
+    not-ECT  ecn = 0, never marked
+    ECT      ecn = 1 or 2
+    CE       ecn = 3
+
+EcnAnalyzer takes the codepoints and the flow fields of a batch of frames
+from capture.decodeIpv4. EcnWindows counts the codepoints per key in time
+buckets; the counts of a bounded number of keys are kept, the least
+recently seen key making room for a new one, so the memory used does not
+grow with the traffic.
+"""
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from .capture import decodeIpv4
+
+ECN_NOT_ECT = 0
+ECN_CE = 3
+
+_PROTOCOLS_WITH_PORTS = (6, 17)
+_PROTOCOL_NAMES = {1: 'icmp', 6: 'tcp', 17: 'udp'}
+
+# The codepoint counts of a key over the window; ce_ratio is the share of CE
+# among the ECN-capable packets, 0 if there are none
+EcnRatio = namedtuple('EcnRatio', ['packets', 'not_ect', 'ect', 'ce', 'ce_ratio'])
+
+
+class EcnWindows(object):
+    """
+    Codepoint counts per key over the last `buckets` time buckets of
+    `bucket` seconds, for at most `max_keys` keys.
+
+    The counts are one NumPy array of (key row, bucket, not-ECT/ECT/CE);
+    bucket t is column t % buckets, cleared when the window moves past it.
+    """
+
+    def __init__(self, bucket=1.0, buckets=10, max_keys=4096):
+        self.bucket = bucket
+        self.buckets = buckets
+        self.max_keys = max_keys
+        # key -> row, least recently seen first
+        self.keys = OrderedDict()
+        self.counts = np.zeros((max_keys, buckets, 3), dtype=np.int64)
+        # the newest bucket seen, None before the first packet
+        self.head = None
+        # packets not counted: older than the window, or of the keys left
+        # out of a batch holding more than max_keys keys
+        self.dropped = 0
+
+    def add(self, keys, times, ecn):
+        """
+        :param keys: int64 array of one row per packet, the columns of the key
+        :param times: float array of the packet times in seconds
+        :param ecn: the ECN codepoints of the packets
+        """
+        if not len(keys):
+            return
+        slots = np.floor(np.asarray(times) / self.bucket).astype(np.int64)
+        self._advance(int(slots.max()))
+        keep = slots > self.head - self.buckets
+        self.dropped += int(len(keep) - keep.sum())
+        keys, slots, ecn = keys[keep], slots[keep], np.asarray(ecn)[keep]
+        unique, inverse, sizes = np.unique(keys, axis=0, return_inverse=True,
+                                           return_counts=True)
+        inverse = inverse.reshape(-1)
+        if len(unique) > self.max_keys:
+            # the keys of the fewest packets are left out
+            kept = np.zeros(len(unique), dtype=bool)
+            kept[np.argsort(-sizes, kind='stable')[:self.max_keys]] = True
+            keep = kept[inverse]
+            self.dropped += int(len(keep) - keep.sum())
+            remap = np.cumsum(kept) - 1
+            unique, inverse, slots, ecn = (unique[kept], remap[inverse[keep]],
+                                           slots[keep], ecn[keep])
+        rows = np.array([self._row(tuple(int(v) for v in key)) for key in unique],
+                        dtype=np.int64)
+        # not-ECT 0, ECT 1, CE 2
+        kinds = (ecn != ECN_NOT_ECT).astype(np.int64) + (ecn == ECN_CE)
+        np.add.at(self.counts, (rows[inverse], slots % self.buckets, kinds), 1)
+
+    def _advance(self, newest):
+        if self.head is None:
+            self.head = newest
+            return
+        if newest <= self.head:
+            return
+        if newest - self.head >= self.buckets:
+            self.counts[:] = 0
+        else:
+            for slot in range(self.head + 1, newest + 1):
+                self.counts[:, slot % self.buckets] = 0
+        self.head = newest
+
+    def _row(self, key):
+        row = self.keys.get(key)
+        if row is not None:
+            self.keys.move_to_end(key)
+            return row
+        if len(self.keys) < self.max_keys:
+            row = len(self.keys)
+        else:
+            _, row = self.keys.popitem(last=False)
+            self.counts[row] = 0
+        self.keys[key] = row
+        return row
+
+    def ratios(self):
+        """
+        :return: OrderedDict of key -> EcnRatio over the window, the keys
+                 with the most packets first
+        """
+        totals = self.counts.sum(axis=1)
+        result = []
+        for key, row in self.keys.items():
+            not_ect, ect, ce = (int(v) for v in totals[row])
+            if not_ect + ect + ce == 0:
+                continue
+            capable = ect + ce
+            result.append((key, EcnRatio(not_ect + ect + ce, not_ect, ect, ce,
+                                         ce / float(capable) if capable else 0.0)))
+        result.sort(key=lambda item: -item[1].packets)
+        return OrderedDict(result)
+
+
+class EcnAnalyzer(object):
+    """
+    CE ratios per flow and per destination prefix, the egress path of the
+    packets, over sliding windows.
+    """
+
+    def __init__(self, bucket=1.0, buckets=10, max_flows=4096, max_paths=256,
+                 path_prefix=24):
+        """
+        :param bucket: the length of a time bucket in seconds
+        :param buckets: the number of buckets of a window
+        :param max_flows: the number of flows whose counts are kept
+        :param max_paths: the number of destination prefixes whose counts are kept
+        :param path_prefix: the length of the destination prefixes
+        """
+        if not 0 <= path_prefix <= 32:
+            raise ValueError("Expected a prefix length between 0 and 32, got %d" % path_prefix)
+        self.flows = EcnWindows(bucket, buckets, max_flows)
+        self.paths = EcnWindows(bucket, buckets, max_paths)
+        self.path_prefix = path_prefix
+        self._mask = (0xffffffff << (32 - path_prefix)) & 0xffffffff
+        # packets seen per codepoint since the start
+        self.codepoints = np.zeros(4, dtype=np.int64)
+
+    def add(self, data, offsets, lengths, times):
+        """
+        Classifies a batch of frames and counts them.
+
+        :param times: float array of the frame times in seconds, or one
+                      time for the whole batch
+        """
+        packets = decodeIpv4(data, offsets, lengths)
+        if not len(packets.packet):
+            return
+        ecn = packets.tos & 0x03
+        if np.ndim(times):
+            times = np.asarray(times)[packets.packet]
+        else:
+            times = np.full(len(packets.packet), times)
+        self.codepoints += np.bincount(ecn, minlength=4)
+        flows = np.stack([packets.src, packets.dst, packets.protocol, packets.sport,
+                          packets.dport], axis=1).astype(np.int64)
+        self.flows.add(flows, times, ecn)
+        paths = (packets.dst & self._mask).astype(np.int64).reshape(-1, 1)
+        self.paths.add(paths, times, ecn)
+
+
+def _address(value):
+    return '.'.join(str((value >> shift) & 0xff) for shift in (24, 16, 8, 0))
+
+
+def _formatFlow(key):
+    src, dst, protocol, sport, dport = key
+    name = _PROTOCOL_NAMES.get(protocol, str(protocol))
+    if protocol in _PROTOCOLS_WITH_PORTS:
+        return "%s:%d -> %s:%d %s" % (_address(src), sport, _address(dst), dport, name)
+    return "%s -> %s %s" % (_address(src), _address(dst), name)
+
+
+def printEcnRatios(analyzer, limit=10):
+    """
+    Prints the CE ratios of the paths, then of the busiest flows.
+
+    :param analyzer: the EcnAnalyzer
+    :param limit: the number of flows to print
+    """
+    windows = analyzer.flows
+    print("Window of %g s, codepoints since start: not-ECT %d, ECT %d, CE %d" % (
+        windows.bucket * windows.buckets, analyzer.codepoints[0],
+        analyzer.codepoints[1] + analyzer.codepoints[2], analyzer.codepoints[3]))
+    for (prefix,), r in analyzer.paths.ratios().items():
+        print("  %s/%d: CE %.2f%% of %d ECN-capable packets, %d not-ECT" % (
+            _address(prefix), analyzer.path_prefix, 100 * r.ce_ratio, r.ect + r.ce, r.not_ect))
+    flows = analyzer.flows.ratios()
+    for key, r in list(flows.items())[:limit]:
+        print("  %s: CE %.2f%% of %d ECN-capable packets, %d not-ECT" % (
+            _formatFlow(key), 100 * r.ce_ratio, r.ect + r.ce, r.not_ect))
+    if len(flows) > limit:
+        print("  ... %d more flows" % (len(flows) - limit))
@@ -0,0 +1,278 @@
+"""
+In-process stand-in P4Runtime switch.
+本地替身交换机：在进程内提供 P4Runtime gRPC 服务，不需要 Mininet 和 BMv2 也能运行、测量控制器的下发路径
+
+FakeSwitch answers the P4Runtime calls the controllers make: the master
+arbitration on the StreamChannel (this controller is always master),
+Set/GetForwardingPipelineConfig, and Write and Read of table, counter and
+register entries. It keeps the table entries keyed like a switch, by
+(table, match fields, priority), and rejects a batch with one error per
+update like BMv2 does:
+
+    switch = FakeSwitch(device_id=0)
+    address = switch.start()
+    sw = ControllerConnection(name='s1', address=address, device_id=0)
+
+With store=False the WriteRequests are not parsed: their updates are
+counted on the serialized request and always succeed, so that a benchmark
+running in the same process measures the controller rather than the
+decoding of its requests by the stand-in.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+from google.rpc import code_pb2, status_pb2
+from p4.v1 import p4data_pb2, p4runtime_pb2, p4runtime_pb2_grpc
+
+from .wire import WIRETYPE_LENGTH_DELIMITED, decodeVarint, fieldKey, skipField
+
+_WRITE_METHOD = '/p4.v1.P4Runtime/Write'
+# key of the repeated field WriteRequest.updates
+_UPDATES_KEY = fieldKey(
+    p4runtime_pb2.WriteRequest.DESCRIPTOR.fields_by_name['updates'].number,
+    WIRETYPE_LENGTH_DELIMITED)
+
+
+def _countUpdates(data):
+    count = 0
+    pos = 0
+    while pos < len(data):
+        key, pos = decodeVarint(data, pos)
+        if key == _UPDATES_KEY:
+            count += 1
+        pos = skipField(data, pos, key & 7)
+    return count
+
+
+def _entryKey(entry):
+    return (entry.table_id,
+            tuple(sorted(match.SerializeToString() for match in entry.match)),
+            entry.priority)
+
+
+class _CountingWrite(grpc.GenericRpcHandler):
+    """Handles Write with the raw request bytes, before the servicer."""
+
+    def __init__(self, switch):
+        # no deserializer and serializer, the handler gets and returns bytes
+        self._handler = grpc.unary_unary_rpc_method_handler(switch._countWrite)
+
+    def service(self, handler_call_details):
+        if handler_call_details.method == _WRITE_METHOD:
+            return self._handler
+        return None
+
+
+class FakeSwitch(p4runtime_pb2_grpc.P4RuntimeServicer):
+    """
+    A P4Runtime server holding table, counter and register entries in
+    memory.
+
+    The numbers of WriteRequests and updates received since the start or the
+    last reset() are kept in `writes` and `updates`.
+    """
+
+    def __init__(self, device_id=0, store=True):
+        """
+        :param device_id: the device id of the switch
+        :param store: keep and check the written entries; False only counts
+                      the updates
+        """
+        self.device_id = device_id
+        self.store = store
+        # (table id, match fields, priority) -> TableEntry
+        self.tables = {}
+        # counter id -> {index: (packets, bytes)}
+        self.counters = {}
+        # register id -> {index: P4Data}
+        self.registers = {}
+        self.config = None
+        self.writes = 0
+        self.updates = 0
+        self.address = None
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self, address='127.0.0.1:0', workers=8):
+        """
+        Starts serving. Every StreamChannel holds one worker while it is
+        open.
+
+        :param address: host:port to listen on, port 0 for any free port
+        :return: the address the switch is reachable at
+        """
+        self._server = grpc.server(ThreadPoolExecutor(max_workers=workers))
+        if not self.store:
+            self._server.add_generic_rpc_handlers((_CountingWrite(self),))
+        p4runtime_pb2_grpc.add_P4RuntimeServicer_to_server(self, self._server)
+        host = address.rsplit(':', 1)[0]
+        port = self._server.add_insecure_port(address)
+        self._server.start()
+        self.address = '%s:%d' % (host, port)
+        return self.address
+
+    def stop(self):
+        if self._server is not None:
+            self._server.stop(None)
+            self._server = None
+
+    def reset(self):
+        """
+        Forgets the table, counter and register entries, as after a
+        pipeline change, and the counts of requests and updates.
+        """
+        with self._lock:
+            self.tables.clear()
+            self.counters.clear()
+            self.registers.clear()
+            self.writes = 0
+            self.updates = 0
+
+    def setCounter(self, counter_id, index, packets, bytes):
+        with self._lock:
+            self.counters.setdefault(counter_id, {})[index] = (packets, bytes)
+
+    def _countWrite(self, data, context):
+        updates = _countUpdates(data)
+        with self._lock:
+            self.writes += 1
+            self.updates += updates
+        # an empty WriteResponse
+        return b''
+
+    def Write(self, request, context):
+        status = status_pb2.Status()
+        failed = False
+        with self._lock:
+            self.writes += 1
+            self.updates += len(request.updates)
+            for update in request.updates:
+                error = p4runtime_pb2.Error(canonical_code=code_pb2.OK)
+                message = self._apply(update)
+                if message is not None:
+                    error.canonical_code, error.message = message
+                    failed = True
+                status.details.add().Pack(error)
+        if failed:
+            status.code = code_pb2.UNKNOWN
+            status.message = "Write failure."
+            context.set_trailing_metadata(
+                (('grpc-status-details-bin', status.SerializeToString()),))
+            context.set_code(grpc.StatusCode.UNKNOWN)
+            context.set_details(status.message)
+        return p4runtime_pb2.WriteResponse()
+
+    def _apply(self, update):
+        """
+        :return: None, or (canonical code, message) of the error
+        """
+        kind = update.entity.WhichOneof('entity')
+        if kind == 'table_entry':
+            entry = update.entity.table_entry
+            if entry.is_default_action:
+                return None
+            key = _entryKey(entry)
+            if update.type == p4runtime_pb2.Update.INSERT:
+                if key in self.tables:
+                    return (code_pb2.ALREADY_EXISTS,
+                            "Match entry exists, use MODIFY if you wish to change action")
+                self.tables[key] = entry
+            elif update.type == p4runtime_pb2.Update.MODIFY:
+                if key not in self.tables:
+                    return code_pb2.NOT_FOUND, "Cannot find match entry"
+                self.tables[key] = entry
+            elif update.type == p4runtime_pb2.Update.DELETE:
+                if self.tables.pop(key, None) is None:
+                    return code_pb2.NOT_FOUND, "Cannot find match entry"
+        elif kind == 'counter_entry':
+            entry = update.entity.counter_entry
+            self.counters.setdefault(entry.counter_id, {})[entry.index.index] = (
+                entry.data.packet_count, entry.data.byte_count)
+        elif kind == 'register_entry':
+            entry = update.entity.register_entry
+            data = p4data_pb2.P4Data()
+            data.CopyFrom(entry.data)
+            self.registers.setdefault(entry.register_id, {})[entry.index.index] = data
+        return None
+
+    def Read(self, request, context):
+        response = p4runtime_pb2.ReadResponse()
+        with self._lock:
+            for entity in request.entities:
+                kind = entity.WhichOneof('entity')
+                if kind == 'table_entry':
+                    table_id = entity.table_entry.table_id
+                    for entry in self.tables.values():
+                        if table_id in (0, entry.table_id):
+                            response.entities.add().table_entry.CopyFrom(entry)
+                elif kind == 'counter_entry':
+                    self._readCounters(entity.counter_entry, response)
+                elif kind == 'register_entry':
+                    self._readRegisters(entity.register_entry, response)
+        yield response
+
+    def _readCounters(self, wanted, response):
+        for counter_id, values in sorted(self.counters.items()):
+            if wanted.counter_id not in (0, counter_id):
+                continue
+            for index, (packets, bytes) in sorted(values.items()):
+                if wanted.HasField('index') and wanted.index.index != index:
+                    continue
+                entry = response.entities.add().counter_entry
+                entry.counter_id = counter_id
+                entry.index.index = index
+                entry.data.packet_count = packets
+                entry.data.byte_count = bytes
+
+    def _readRegisters(self, wanted, response):
+        for register_id, values in sorted(self.registers.items()):
+            if wanted.register_id not in (0, register_id):
+                continue
+            for index, data in sorted(values.items()):
+                if wanted.HasField('index') and wanted.index.index != index:
+                    continue
+                entry = response.entities.add().register_entry
+                entry.register_id = register_id
+                entry.index.index = index
+                entry.data.CopyFrom(data)
+
+    def SetForwardingPipelineConfig(self, request, context):
+        with self._lock:
+            self.config = request.config
+            self.tables.clear()
+            self.counters.clear()
+            self.registers.clear()
+        return p4runtime_pb2.SetForwardingPipelineConfigResponse()
+
+    def GetForwardingPipelineConfig(self, request, context):
+        response = p4runtime_pb2.GetForwardingPipelineConfigResponse()
+        if self.config is not None:
+            cookie_only = p4runtime_pb2.GetForwardingPipelineConfigRequest.COOKIE_ONLY
+            if request.response_type == cookie_only:
+                response.config.cookie.CopyFrom(self.config.cookie)
+            else:
+                response.config.CopyFrom(self.config)
+        return response
+
+    def StreamChannel(self, request_iterator, context):
+        for request in request_iterator:
+            if request.WhichOneof('update') == 'arbitration':
+                response = p4runtime_pb2.StreamMessageResponse()
+                response.arbitration.CopyFrom(request.arbitration)
+                response.arbitration.status.code = code_pb2.OK
+                yield response
+
+
+def startFakeSwitches(count, store=True):
+    """
+    Starts count FakeSwitches with device ids 0 to count - 1, on free ports.
+
+    :return: the list of FakeSwitch; their `address` is set
+    """
+    switches = []
+    for device_id in range(count):
+        switch = FakeSwitch(device_id, store=store)
+        switch.start()
+        switches.append(switch)
+    return switches
@@ -0,0 +1,111 @@
+"""
+Latency histograms.
+延迟直方图：按对数分桶（HDR 风格）记录每台交换机、每种 P4Runtime 请求的耗时，按需给出 p50、p99 和最大值
+
+LatencyHistogram counts durations in microsecond buckets. Below 32 µs every
+microsecond has its bucket; above, every power of two is split into 16
+buckets of equal width, so a percentile is off by less than 1/16 of its
+value whatever the magnitude, and recording a duration is an index
+computation and an increment. Durations of 2^37 µs (38 hours) and more
+fall in a last bucket of their own, whose percentiles are the exact
+maximum, kept aside.
+"""
+import math
+
+SUB_BUCKET_BITS = 5
+MAX_SHIFT = 32
+
+_SUB = 1 << SUB_BUCKET_BITS
+_HALF = _SUB >> 1
+# the buckets of the powers of two up to 2^(MAX_SHIFT + SUB_BUCKET_BITS),
+# then the one of the longer durations
+_OVERFLOW = _SUB + MAX_SHIFT * _HALF
+_BUCKETS = _OVERFLOW + 1
+
+
+def _bucket(us):
+    if us < _SUB:
+        return us
+    shift = us.bit_length() - SUB_BUCKET_BITS
+    if shift > MAX_SHIFT:
+        return _OVERFLOW
+    # us >> shift is in [_HALF, _SUB)
+    return shift * _HALF + (us >> shift)
+
+
+def _highest(index):
+    """The highest number of microseconds counted in a bucket."""
+    if index < _SUB:
+        return index
+    shift = index // _HALF - 1
+    top = index % _HALF + _HALF
+    return ((top + 1) << shift) - 1
+
+
+class LatencyHistogram(object):
+    """
+    Durations in log-linear buckets, with their count, sum and maximum in
+    seconds.
+    """
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[_bucket(int(seconds * 1e6))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def copy(self):
+        histogram = LatencyHistogram()
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.total = self.total
+        histogram.max = self.max
+        return histogram
+
+    def merge(self, other):
+        """Adds the durations of another histogram to this one."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """
+        :param percent: e.g. 50 or 99
+        :return: the duration in seconds that percent of the recorded
+                 durations do not exceed, rounded up to its bucket
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(percent / 100.0 * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index == _OVERFLOW:
+                    return self.max
+                return min((_highest(index) + 1) * 1e-6, self.max)
+        return self.max
+
+
+def printLatencies(histograms):
+    """
+    Prints the number of requests, p50, p99 and max of every histogram.
+
+    :param histograms: dict of (switch name, method) -> LatencyHistogram
+    """
+    if not histograms:
+        return
+    print("%-8s %-28s %8s %10s %10s %10s" % ('switch', 'method', 'requests',
+                                             'p50 ms', 'p99 ms', 'max ms'))
+    for (switch, method), histogram in sorted(histograms.items()):
+        print("%-8s %-28s %8d %10.3f %10.3f %10.3f" % (
+            switch, method, histogram.count, histogram.percentile(50) * 1e3,
+            histogram.percentile(99) * 1e3, histogram.max * 1e3))
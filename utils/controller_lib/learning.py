@@ -0,0 +1,313 @@
+"""
+Reactive host learning.
+主机自学习：数据平面为未知的源主机发送 learn digest，控制器合并、去重后以批量写入为所有交换机下发到该主机的 ipv4_lpm 表项
+
+firewall.p4 looks up the source of every IPv4 packet that enters a switch
+on a host port (a port missing from its switch_ports table) in
+learned_hosts, keyed on (source address, ingress port). On a miss it sends
+a learn_t digest: source address, source MAC and ingress port. The switch
+itself groups the digests into lists and does not repeat one before the
+list holding it is acknowledged.
+
+HostLearner.add() only records the hosts of a digest list that the host
+table does not know yet, or knows at another place, so that the list is
+acknowledged at once. flush(), called periodically (or when pending() grows
+past a limit), adds them to the topology, computes the routes of every
+switch towards them only (RouteCompiler.routesTo) and sends all the
+updates with one BatchWriter: the ipv4_lpm entries of every switch
+(MODIFY for a host that moved) and the learned_hosts entry of its switch.
+The updates are spliced from UpdateTemplates rather than built as
+messages. Thousands of hosts per second then take a few WriteRequests per
+switch instead of one RPC per digest.
+
+A Reconciler deletes every entry it was not given, the learned ones too;
+restore(), registered with Reconciler.onInstalled(), finds the hosts
+learned before a restart in the entries the reconciler read, adds them to
+the topology and their entries to the desired ones.
+"""
+import socket
+from collections import OrderedDict
+
+from p4.v1 import p4runtime_pb2
+
+from .batch import DEFAULT_BATCH_SIZE, BatchWriter, UpdateTemplate, printWriteErrors
+from .metrics import Metric
+from .topology import Host, RouteCompiler
+
+DEFAULT_DIGEST = "learn_t"
+DEFAULT_LEARNED_TABLE = "MyIngress.learned_hosts"
+DEFAULT_SWITCH_PORTS_TABLE = "MyIngress.switch_ports"
+
+# Digest configuration of the switches: a list is sent when it holds
+# max_list_size digests or its first digest waited max_timeout_ns, and the
+# digests of a list are not sent again before it is acknowledged or
+# ack_timeout_ns passed
+DEFAULT_MAX_TIMEOUT_NS = 10 * 1000 * 1000
+DEFAULT_MAX_LIST_SIZE = 128
+DEFAULT_ACK_TIMEOUT_NS = 1000 * 1000 * 1000
+
+
+def _mac(data):
+    return ':'.join('%02x' % b for b in data.rjust(6, b'\x00'))
+
+
+class HostLearner(object):
+    """
+    Learns hosts from the learn digests of the switches and installs the
+    routes towards them.
+
+    The numbers of hosts learned, hosts that moved, digests of known hosts
+    and digests received on switch links (not learned) since the start are
+    kept in `learned`, `moved`, `duplicates` and `ignored`.
+    """
+
+    def __init__(self, p4info_helper, topo, switches, batch_size=DEFAULT_BATCH_SIZE,
+                 digest_name=DEFAULT_DIGEST, learned_table=DEFAULT_LEARNED_TABLE,
+                 switch_ports_table=DEFAULT_SWITCH_PORTS_TABLE):
+        """
+        :param p4info_helper: the P4Info helper
+        :param topo: the topology.Topology; its hosts are known from the start
+                     and the learned hosts are added to it
+        :param switches: dict of switch name -> switch connection
+        :param batch_size: max number of updates per WriteRequest
+        """
+        self.p4info_helper = p4info_helper
+        self.topo = topo
+        self.switches = switches
+        self.batch_size = batch_size
+        self.digest_id = p4info_helper.get('digests', name=digest_name).preamble.id
+        self.learned_table = learned_table
+        self.switch_ports_table = switch_ports_table
+        route = dict(table_name="MyIngress.ipv4_lpm",
+                     match_fields={"hdr.ipv4.dstAddr": ("0.0.0.0", 32)},
+                     action_name="MyIngress.ipv4_forward",
+                     action_params={"dstAddr": "00:00:00:00:00:00", "port": 0})
+        self._insert_route = UpdateTemplate(p4info_helper, p4runtime_pb2.Update.INSERT, **route)
+        self._modify_route = UpdateTemplate(p4info_helper, p4runtime_pb2.Update.MODIFY, **route)
+        self._insert_learned = UpdateTemplate(
+            p4info_helper, p4runtime_pb2.Update.INSERT, learned_table,
+            {"hdr.ipv4.srcAddr": "0.0.0.0", "standard_metadata.ingress_port": 0}, "NoAction")
+        self._port_width = self._insert_route.widths[2]
+        self.compiler = RouteCompiler(topo)
+        # An INSERT already installed before a controller restart is not an error
+        self.writer = BatchWriter(batch_size=batch_size, skip_existing=True)
+        # ip -> Host, the hosts of the topology and the learned ones
+        self.hosts = dict((host.ip, host) for host in topo.hosts.values())
+        # ip -> Host, learned but not installed yet
+        self._pending = OrderedDict()
+        self.learned = 0
+        self.moved = 0
+        self.duplicates = 0
+        self.ignored = 0
+
+    def queueKnown(self, writer):
+        """
+        Queues on writer the switch_ports entries of every switch and the
+        learned_hosts entries of the hosts of the topology, so that they
+        send no digest.
+
+        :param writer: the BatchWriter or Reconciler of the static rules
+        """
+        for name, ports in self.topo.ports.items():
+            for port in sorted(ports):
+                writer.add(self.switches[name], self.p4info_helper.buildTableEntry(
+                    table_name=self.switch_ports_table,
+                    match_fields={"standard_metadata.ingress_port": port},
+                    action_name="NoAction"))
+        for host in self.topo.hosts.values():
+            writer.add(self.switches[host.switch], self._learnedEntry(host))
+
+    def restore(self, installed, reconciler):
+        """
+        Adds to the topology and the host table the hosts learned by an
+        earlier run of the controller, and their entries to a Reconciler so
+        that it keeps them instead of deleting them: a learned_hosts entry
+        whose switch also routes its address to its port. A learned_hosts
+        entry without its route is left out; the Reconciler deletes it, so
+        the host sends a digest again. Registered with
+        reconciler.onInstalled(lambda installed: learner.restore(installed,
+        reconciler)).
+
+        :param installed: dict of switch connection -> list of its
+                          installed TableEntry, from the reconciler
+        :param reconciler: the Reconciler of the rules of the topology
+        :return: the list of Hosts restored
+        """
+        helper = self.p4info_helper
+        learned_id = helper.get('tables', name=self.learned_table).preamble.id
+        src_id = helper.get_match_field_id(self.learned_table, "hdr.ipv4.srcAddr")
+        port_id = helper.get_match_field_id(self.learned_table, "standard_metadata.ingress_port")
+        route_id = helper.get('tables', name="MyIngress.ipv4_lpm").preamble.id
+        forward_id = helper.get('actions', name="MyIngress.ipv4_forward").preamble.id
+        mac_id = helper.get_action_param_id("MyIngress.ipv4_forward", "dstAddr")
+        out_id = helper.get_action_param_id("MyIngress.ipv4_forward", "port")
+        restored = []
+        for name, sw in self.switches.items():
+            link_ports = self.topo.ports.get(name, ())
+            places = []
+            # ip -> (MAC, port) of the host routes of the switch
+            routes = {}
+            for entry in installed.get(sw, ()):
+                if entry.table_id == learned_id:
+                    match = dict((m.field_id, m.exact.value) for m in entry.match)
+                    port = int.from_bytes(match.get(port_id, b''), 'big')
+                    ip = socket.inet_ntoa(match.get(src_id, b'').rjust(4, b'\x00'))
+                    if ip not in self.hosts and port not in link_ports:
+                        places.append((ip, port))
+                elif entry.table_id == route_id:
+                    action = entry.action.action
+                    if (len(entry.match) != 1 or entry.match[0].lpm.prefix_len != 32
+                            or action.action_id != forward_id):
+                        continue
+                    params = dict((p.param_id, p.value) for p in action.params)
+                    ip = socket.inet_ntoa(entry.match[0].lpm.value.rjust(4, b'\x00'))
+                    routes[ip] = (_mac(params.get(mac_id, b'')),
+                                  int.from_bytes(params.get(out_id, b''), 'big'))
+            for ip, port in places:
+                route = routes.get(ip)
+                if route is None or route[1] != port or ip in self.hosts:
+                    continue
+                host = Host(ip, ip, route[0], name, port)
+                self.hosts[ip] = host
+                self.topo.addHost(host.name, host.ip, host.mac, host.switch, host.port)
+                reconciler.add(sw, self._learnedEntry(host))
+                restored.append(host)
+        for route in self.compiler.routesTo(restored):
+            reconciler.add(self.switches[route.switch], helper.buildTableEntry(
+                table_name="MyIngress.ipv4_lpm",
+                match_fields={"hdr.ipv4.dstAddr": route.dst_prefix},
+                action_name="MyIngress.ipv4_forward",
+                action_params={"dstAddr": route.dst_mac, "port": route.port}))
+        return restored
+
+    def enableDigests(self, max_timeout_ns=DEFAULT_MAX_TIMEOUT_NS,
+                      max_list_size=DEFAULT_MAX_LIST_SIZE,
+                      ack_timeout_ns=DEFAULT_ACK_TIMEOUT_NS):
+        """
+        Makes every switch send its learn digests to this controller.
+
+        :return: the list of UpdateError for the switches that rejected it
+        """
+        entry = p4runtime_pb2.DigestEntry()
+        entry.digest_id = self.digest_id
+        entry.config.max_timeout_ns = max_timeout_ns
+        entry.config.max_list_size = max_list_size
+        entry.config.ack_timeout_ns = ack_timeout_ns
+        for sw in self.switches.values():
+            self.writer.addUpdate(sw, p4runtime_pb2.Update.INSERT, digest_entry=entry)
+        return self.writer.flush()
+
+    def add(self, sw, digest_list):
+        """
+        Records the new hosts of a DigestList, to be installed by flush();
+        a handler of the 'digest' event of aioruntime.SwitchRuntime.
+
+        :param sw: the switch connection that sent the list
+        :param digest_list: the p4runtime DigestList
+        """
+        if digest_list.digest_id != self.digest_id:
+            return
+        link_ports = self.topo.ports.get(sw.name)
+        if link_ports is None:
+            self.ignored += len(digest_list.data)
+            return
+        hosts = self.hosts
+        pending = self._pending
+        for data in digest_list.data:
+            ip_data, mac_data, port_data = [m.bitstring for m in data.struct.members]
+            port = int.from_bytes(port_data, 'big')
+            if port in link_ports:
+                # a packet of a remote host reaching the switch over a link
+                # the switch_ports entry of which is not installed yet
+                self.ignored += 1
+                continue
+            ip = socket.inet_ntoa(ip_data.rjust(4, b'\x00'))
+            mac = _mac(mac_data)
+            host = pending.get(ip) or hosts.get(ip)
+            if host is not None and (host.mac, host.switch, host.port) == (mac, sw.name, port):
+                self.duplicates += 1
+                continue
+            # a host of the topology keeps its name when it moves
+            name = hosts[ip].name if ip in hosts else ip
+            pending[ip] = Host(name, ip, mac, sw.name, port)
+
+    def pending(self):
+        """Returns the number of learned hosts that are not installed yet."""
+        return len(self._pending)
+
+    def metrics(self):
+        """
+        The counters of the learner, for MetricsExporter.add().
+
+        :return: list of metrics.Metric
+        """
+        return [Metric('controller_learned_hosts_pending', 'gauge',
+                       'Learned hosts waiting to be installed', [((), len(self._pending))]),
+                Metric('controller_learned_hosts_total', 'counter', 'Hosts learned',
+                       [((), self.learned)]),
+                Metric('controller_moved_hosts_total', 'counter', 'Hosts that moved',
+                       [((), self.moved)]),
+                Metric('controller_learn_digests_total', 'counter',
+                       'Learn digests of known hosts or received on links',
+                       [((('kind', 'duplicate'),), self.duplicates),
+                        ((('kind', 'ignored'),), self.ignored)])]
+
+    def flush(self):
+        """
+        Installs the routes of every switch towards the hosts learned since
+        the last flush().
+
+        :return: (list of the Hosts installed, list of UpdateError)
+        """
+        if not self._pending:
+            return [], []
+        learned = list(self._pending.values())
+        self._pending.clear()
+        moved = set()
+        port_width = self._port_width
+        for host in learned:
+            previous = self.hosts.get(host.ip)
+            self.hosts[host.ip] = host
+            self.topo.addHost(host.name, host.ip, host.mac, host.switch, host.port)
+            if previous is not None:
+                moved.add(host.ip)
+                if (previous.switch, previous.port) == (host.switch, host.port):
+                    # only the MAC changed, learned_hosts already matches
+                    continue
+                # the old place no longer knows the host
+                self.writer.delete(self.switches[previous.switch], self._learnedEntry(previous))
+            self.writer.queueUpdate(self.switches[host.switch], self._insert_learned.encode(
+                socket.inet_aton(host.ip), host.port.to_bytes(port_width, 'big')))
+        for route in self.compiler.routesTo(learned):
+            ip = route.dst_prefix[0]
+            template = self._modify_route if ip in moved else self._insert_route
+            self.writer.queueUpdate(self.switches[route.switch], template.encode(
+                socket.inet_aton(ip), bytes.fromhex(route.dst_mac.replace(':', '')),
+                route.port.to_bytes(port_width, 'big')))
+        self.learned += len(learned) - len(moved)
+        self.moved += len(moved)
+        return learned, self.writer.flush()
+
+    def _learnedEntry(self, host):
+        return self.p4info_helper.buildTableEntry(
+            table_name=self.learned_table,
+            match_fields={"hdr.ipv4.srcAddr": host.ip,
+                          "standard_metadata.ingress_port": host.port},
+            action_name="NoAction")
+
+
+def printLearnedHosts(learner, hosts, errors):
+    """
+    Prints the hosts installed by a flush(), then the errors.
+
+    :param learner: the HostLearner
+    :param hosts, errors: the result of learner.flush()
+    """
+    for host in hosts[:10]:
+        print("Learned %s (%s) on %s port %d" % (host.ip, host.mac, host.switch, host.port))
+    if len(hosts) > 10:
+        print("... %d more hosts" % (len(hosts) - 10))
+    if hosts:
+        print("%d hosts learned, %d moved, %d duplicate digests, %d ignored" % (
+            learner.learned, learner.moved, learner.duplicates, learner.ignored))
+    printWriteErrors(errors)
@@ -0,0 +1,452 @@
+"""
+Prometheus metrics endpoint.
+指标导出：在本地 HTTP 端口以 Prometheus 文本格式发布计数器、寄存器、各表的表项数以及控制器自身的队列深度和 RPC 错误
+
+MetricsExporter serves http://127.0.0.1:PORT/metrics from a cached
+snapshot. A collector thread rebuilds the snapshot every `interval`
+seconds, so a scrape never waits on a switch and the controller never
+waits on a scrape. Each rebuild reads, with one ReadRequest per switch:
+
+    p4_table_entries{switch,table}               entries of every table
+    p4_register_value{switch,register,index}     the watched registers, e.g.
+                                                 byte_cnt_reg of link_monitor.p4
+
+and formats what the controller already keeps:
+
+    p4_counter_packets_total, p4_counter_bytes_total{switch,counter,index}
+        the last CounterPoller.poll() given to publishCounters()
+    p4runtime_requests_total{switch,method},
+    p4runtime_errors_total{switch,method,code},
+    p4runtime_request_seconds{switch,method,quantile} (summary, p50 and p99),
+    p4runtime_request_seconds_max{switch,method}
+        the rpclatency.RpcStats of every attached switch
+    controller_master, controller_stream_queue,
+    controller_stream_messages_total{switch,event}, controller_worker_backlog
+        the SwitchRuntime
+    controller_proto_dump_queue, controller_proto_dump_dropped_total{switch}
+        the ProtoDumps loggers
+
+plus the Metrics of the functions given to add(). The table entries are
+counted on the serialized ReadResponses, reading only the table id of
+every entry, rather than parsing thousands of messages per switch. The
+collector reads on channels of its own, so that its requests are neither
+counted in the p4runtime_* metrics nor written to the proto dumps.
+"""
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+from .rpclatency import RpcLatencies
+from .wire import decodeVarint, skipField
+
+DEFAULT_ADDRESS = '127.0.0.1'
+DEFAULT_INTERVAL = 5.0
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_READ_METHOD = '/p4.v1.P4Runtime/Read'
+
+# One metric family: name, type ('counter', 'gauge' or 'summary'), help
+# text and list of (labels, value), labels being a tuple of (name, value)
+# pairs, or of (suffix, labels, value) for e.g. the _sum of a summary
+Metric = namedtuple('Metric', ['name', 'type', 'help', 'samples'])
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatMetrics(metrics):
+    """
+    :param metrics: list of Metric
+    :return: the Prometheus text exposition of the metrics, as bytes
+    """
+    lines = []
+    for metric in metrics:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        for sample in metric.samples:
+            if len(sample) == 3:
+                suffix, labels, value = sample
+            else:
+                suffix = ''
+                labels, value = sample
+            name = metric.name + suffix
+            if labels:
+                name = '%s{%s}' % (name, ','.join(
+                    '%s="%s"' % (label, _escape(v)) for label, v in labels))
+            if isinstance(value, float):
+                lines.append('%s %r' % (name, value))
+            else:
+                lines.append('%s %d' % (name, value))
+    lines.append('')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def countTableEntries(data, counts):
+    """
+    Counts the table entries of a serialized ReadResponse per table id,
+    without parsing them.
+
+    :param data: the serialized ReadResponse
+    :param counts: dict of table id -> number of entries, updated
+    """
+    pos = 0
+    end = len(data)
+    while pos < end:
+        key, pos = decodeVarint(data, pos)
+        if key != 0x0a:
+            # not ReadResponse.entities
+            pos = skipField(data, pos, key & 7)
+            continue
+        length, pos = decodeVarint(data, pos)
+        entity_end = pos + length
+        while pos < entity_end:
+            key, pos = decodeVarint(data, pos)
+            if key != 0x12:
+                # not Entity.table_entry
+                pos = skipField(data, pos, key & 7)
+                continue
+            length, pos = decodeVarint(data, pos)
+            entry_end = pos + length
+            while pos < entry_end:
+                key, pos = decodeVarint(data, pos)
+                if key == 0x08:
+                    # TableEntry.table_id
+                    table_id, pos = decodeVarint(data, pos)
+                    counts[table_id] = counts.get(table_id, 0) + 1
+                    break
+                pos = skipField(data, pos, key & 7)
+            pos = entry_end
+        pos = entity_end
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.exporter.snapshot()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes are not worth a line on the console
+        pass
+
+
+class MetricsExporter(object):
+    """
+    Serves the metrics of the switches and of the controller over HTTP.
+
+    Does nothing when created with port 0, so that the controllers can call
+    it unconditionally.
+    """
+
+    def __init__(self, port=0, address=DEFAULT_ADDRESS, interval=DEFAULT_INTERVAL,
+                 registers=(), rpc_latencies=None):
+        """
+        :param port: the TCP port of the endpoint, 0 for no endpoint
+        :param address: the address the endpoint listens on
+        :param interval: seconds between two rebuilds of the snapshot
+        :param registers: names of the registers read at every rebuild
+        :param rpc_latencies: the rpclatency.RpcLatencies the switches are
+                              attached to, a new one by default
+        """
+        self.port = port
+        self.address = address
+        self.interval = interval
+        self.registers = list(registers)
+        self.enabled = bool(port)
+        self.rpc_latencies = RpcLatencies() if rpc_latencies is None else rpc_latencies
+        self.switches = []
+        self.collections = 0
+        # source -> number of failed collections
+        self.failures = {}
+        self._collectors = []
+        self._counters = {}
+        self._snapshot = b''
+        self._p4info_helper = None
+        self._register_ids = []
+        self._runtime = None
+        self._proto_dumps = None
+        # switch name -> (channel, P4RuntimeStub) of the collector
+        self._channels = {}
+        self._server = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def fromArgs(cls, args, rpc_latencies=None):
+        """
+        :param args: the arguments parsed with addMetricsArguments
+        :param rpc_latencies: see __init__
+        """
+        registers = [name.strip() for name in args.metrics_registers.split(',') if name.strip()]
+        return cls(args.metrics_port, args.metrics_address, args.metrics_interval, registers,
+                   rpc_latencies)
+
+    def attach(self, sw):
+        """
+        Counts and times the requests of a switch connection and reads its
+        tables and registers at every rebuild.
+
+        :return: the RpcStats, or None
+        """
+        if not self.enabled:
+            return None
+        self.switches.append(sw)
+        return self.rpc_latencies.attach(sw)
+
+    def add(self, collector):
+        """
+        Adds collector() -> list of Metric to every rebuild. It runs on the
+        collector thread and should only read the state of the controller.
+        """
+        self._collectors.append(collector)
+
+    def publishCounters(self, snapshots):
+        """
+        Exports the counters of a CounterPoller.poll() until the next call.
+
+        :param snapshots: dict of (switch name, counter name) -> CounterSnapshot
+        """
+        self._counters = snapshots
+
+    def start(self, p4info_helper, runtime=None, proto_dumps=None):
+        """
+        Starts the endpoint and the collector thread, if enabled.
+
+        :param p4info_helper: the P4Info helper of the attached switches
+        :param runtime: the aioruntime.SwitchRuntime, if any
+        :param proto_dumps: the protolog.ProtoDumps, if any
+        """
+        if not self.enabled or self._thread is not None:
+            return
+        self._p4info_helper = p4info_helper
+        for name in self.registers:
+            try:
+                self._register_ids.append(p4info_helper.get('registers', name=name).preamble.id)
+            except AttributeError:
+                raise ValueError("Register %s is not in the P4 program" % name)
+        self._runtime = runtime
+        self._proto_dumps = proto_dumps
+        try:
+            self._server = ThreadingHTTPServer((self.address, self.port), _Handler)
+        except OSError as e:
+            print("Cannot serve metrics on %s:%d: %s" % (self.address, self.port, e))
+            self.enabled = False
+            return
+        self._server.daemon_threads = True
+        self._server.exporter = self
+        for sw in self.switches:
+            channel = grpc.insecure_channel(sw.address)
+            self._channels[sw.name] = (channel, p4runtime_pb2_grpc.P4RuntimeStub(channel))
+        # a short poll interval, for close() not to hold the shutdown
+        threading.Thread(target=self._server.serve_forever, args=(0.1,), name='metrics http',
+                         daemon=True).start()
+        self._thread = threading.Thread(target=self._run, name='metrics collector', daemon=True)
+        self._thread.start()
+        print("Serving metrics on http://%s:%d/metrics" % self._server.server_address[:2])
+
+    def snapshot(self):
+        """
+        :return: the metrics of the last rebuild, in the text format
+        """
+        return self._snapshot
+
+    def collect(self):
+        """
+        Rebuilds the snapshot. A source that fails is left out of it and
+        counted in controller_metrics_failures_total.
+        """
+        start = time.time()
+        metrics = []
+        sources = [('tables', self._tableMetrics), ('counters', self._counterMetrics),
+                   ('rpcs', self._rpcMetrics), ('runtime', self._runtimeMetrics),
+                   ('proto_dumps', self._protoDumpMetrics)]
+        if self._register_ids:
+            sources.append(('registers', self._registerMetrics))
+        sources.extend(('custom', collector) for collector in self._collectors)
+        for source, collector in sources:
+            try:
+                metrics.extend(collector())
+            except Exception:
+                self.failures[source] = self.failures.get(source, 0) + 1
+        self.collections += 1
+        metrics.append(Metric('controller_metrics_collections_total', 'counter',
+                              'Rebuilds of the metrics snapshot', [((), self.collections)]))
+        metrics.append(Metric('controller_metrics_failures_total', 'counter',
+                              'Metric sources that failed during a rebuild',
+                              [((('source', source),), count)
+                               for source, count in sorted(self.failures.items())]))
+        metrics.append(Metric('controller_metrics_collect_seconds', 'gauge',
+                              'Duration of the last rebuild',
+                              [((), time.time() - start)]))
+        self._snapshot = formatMetrics(metrics)
+
+    def close(self):
+        """
+        Stops the collector thread and the endpoint.
+        """
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread = None
+            for channel, _ in self._channels.values():
+                channel.close()
+            self._channels.clear()
+
+    def wait(self):
+        """
+        Blocks until close() is called from another thread or the process
+        is interrupted, for a program that only serves metrics.
+        """
+        self._stopped.wait()
+
+    def _run(self):
+        while True:
+            self.collect()
+            if self._stopped.wait(self.interval):
+                return
+
+    def _tableMetrics(self):
+        tables = [(table.preamble.id, table.preamble.name)
+                  for table in self._p4info_helper.p4info.tables]
+        samples = []
+        for sw in self.switches:
+            request = p4runtime_pb2.ReadRequest()
+            request.device_id = sw.device_id
+            # wildcard read of all tables
+            request.entities.add().table_entry.table_id = 0
+            # the raw responses, counted without building the messages
+            read = self._channels[sw.name][0].unary_stream(
+                _READ_METHOD,
+                request_serializer=p4runtime_pb2.ReadRequest.SerializeToString)
+            counts = {}
+            for data in read(request):
+                countTableEntries(data, counts)
+            samples.extend(((('switch', sw.name), ('table', name)), counts.get(table_id, 0))
+                           for table_id, name in tables)
+        return [Metric('p4_table_entries', 'gauge', 'Entries installed in a table', samples)]
+
+    def _registerMetrics(self):
+        names = dict(zip(self._register_ids, self.registers))
+        samples = []
+        for sw in self.switches:
+            request = p4runtime_pb2.ReadRequest()
+            request.device_id = sw.device_id
+            for register_id in self._register_ids:
+                # wildcard read of the whole array
+                request.entities.add().register_entry.register_id = register_id
+            for response in self._channels[sw.name][1].Read(request):
+                for entity in response.entities:
+                    entry = entity.register_entry
+                    samples.append(((('switch', sw.name), ('register', names[entry.register_id]),
+                                     ('index', entry.index.index)),
+                                    int.from_bytes(entry.data.bitstring, 'big')))
+        return [Metric('p4_register_value', 'gauge', 'Value of a register cell', samples)]
+
+    def _counterMetrics(self):
+        packets = []
+        bytes = []
+        for (sw_name, counter_name), snapshot in sorted(self._counters.items()):
+            for index, packet_count, byte_count in zip(snapshot.indices.tolist(),
+                                                       snapshot.packets.tolist(),
+                                                       snapshot.bytes.tolist()):
+                labels = (('switch', sw_name), ('counter', counter_name), ('index', index))
+                packets.append((labels, packet_count))
+                bytes.append((labels, byte_count))
+        if not packets:
+            return []
+        return [Metric('p4_counter_packets_total', 'counter', 'Packets counted by a counter cell',
+                       packets),
+                Metric('p4_counter_bytes_total', 'counter', 'Bytes counted by a counter cell',
+                       bytes)]
+
+    def _rpcMetrics(self):
+        requests = []
+        errors = []
+        latency = []
+        latency_max = []
+        for name, stats in sorted(self.rpc_latencies.stats.items()):
+            counts, failed, latencies = stats.snapshot()
+            requests.extend(((('switch', name), ('method', method)), count)
+                            for method, count in sorted(counts.items()))
+            errors.extend(((('switch', name), ('method', method), ('code', code)), count)
+                          for (method, code), count in sorted(failed.items()))
+            for method, histogram in sorted(latencies.items()):
+                labels = (('switch', name), ('method', method))
+                for quantile in (0.5, 0.99):
+                    latency.append((labels + (('quantile', quantile),),
+                                    histogram.percentile(quantile * 100)))
+                latency.append(('_sum', labels, histogram.total))
+                latency.append(('_count', labels, histogram.count))
+                latency_max.append((labels, histogram.max))
+        return [Metric('p4runtime_requests_total', 'counter', 'P4Runtime requests sent',
+                       requests),
+                Metric('p4runtime_errors_total', 'counter', 'P4Runtime requests that failed',
+                       errors),
+                Metric('p4runtime_request_seconds', 'summary',
+                       'Latency of the P4Runtime requests', latency),
+                Metric('p4runtime_request_seconds_max', 'gauge',
+                       'Longest P4Runtime request', latency_max)]
+
+    def _runtimeMetrics(self):
+        runtime = self._runtime
+        if runtime is None:
+            return []
+        master = [((('switch', name),), int(value))
+                  for name, value in sorted(runtime.master.items())]
+        queues = [((('switch', sw.name),), runtime.queueDepth(sw))
+                  for sw in sorted(runtime.switches, key=lambda sw: sw.name)]
+        messages = [((('switch', name), ('event', event)), count)
+                    for (name, event), count in sorted(runtime.received.items())]
+        return [Metric('controller_master', 'gauge', 'Whether the controller is master',
+                       master),
+                Metric('controller_stream_queue', 'gauge',
+                       'StreamChannel messages waiting to be sent', queues),
+                Metric('controller_stream_messages_total', 'counter',
+                       'StreamChannel messages received', messages),
+                Metric('controller_worker_backlog', 'gauge',
+                       'Handlers and tasks waiting for or running on the worker thread',
+                       [((), runtime.backlog)])]
+
+    def _protoDumpMetrics(self):
+        proto_dumps = self._proto_dumps
+        if proto_dumps is None or not proto_dumps.loggers:
+            return []
+        loggers = sorted(proto_dumps.loggers.items())
+        return [Metric('controller_proto_dump_queue', 'gauge',
+                       'Requests waiting to be written to the dump file',
+                       [((('switch', name),), logger.queueDepth()) for name, logger in loggers]),
+                Metric('controller_proto_dump_dropped_total', 'counter',
+                       'Requests not dumped because the queue was full',
+                       [((('switch', name),), logger.dropped) for name, logger in loggers])]
+
+
+def addMetricsArguments(parser):
+    """
+    Adds --metrics-port, --metrics-address, --metrics-interval and
+    --metrics-registers.
+    """
+    parser.add_argument('--metrics-port',
+                        help='port of the Prometheus metrics endpoint, 0 for none',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--metrics-address', help='address the metrics endpoint listens on',
+                        type=str, action="store", required=False, default=DEFAULT_ADDRESS)
+    parser.add_argument('--metrics-interval', help='seconds between two metrics collections',
+                        type=float, action="store", required=False, default=DEFAULT_INTERVAL)
+    parser.add_argument('--metrics-registers',
+                        help='comma separated names of the registers exported, '
+                             'e.g. MyEgress.byte_cnt_reg',
+                        type=str, action="store", required=False, default='')
@@ -0,0 +1,157 @@
+"""
+MRI telemetry ingestion.
+MRI 遥测数据处理：从抓包中批量解析 IPv4 选项里的 swtrace，按交换机与跳数维护队列深度滑动窗口并计算分位数
+
+mri.p4 appends to the IPv4 options of the packets it sees
+
+    ipv4_option_t  copyFlag (1), optClass (2), option = 31 (5), optionLength (8)
+    mri_t          count (16)
+    switch_t       x count, the last hop first: swid (32), qdepth (32)
+
+decodeMri extracts the switch traces of a batch of frames at once with
+NumPy, from a capture.PcapFile or from the ring of a capture.RawCapture.
+QueueDepthWindows keeps, per switch and hop, the last samples in a fixed
+size ring, so that percentiles over a rolling window are available without
+storing the packets.
+"""
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from .capture import readField
+
+IPV4_OPTION_MRI = 31
+MAX_HOPS = 9
+
+_ETHERTYPE_IPV4 = 0x0800
+# Ethernet, IPv4 without options, and the option, length and count fields
+_MIN_LENGTH = 14 + 20 + 4
+
+# The switch traces of a batch of frames, as aligned arrays: the index of
+# the frame in the batch, the hop number counted from the sender (0 is the
+# first switch), swid and qdepth
+MriSamples = namedtuple('MriSamples', ['packet', 'hop', 'swid', 'qdepth'])
+
+
+def decodeMri(data, offsets, lengths):
+    """
+    Decodes the MRI option of a batch of Ethernet frames.
+
+    :param data: uint8 array holding the frames
+    :param offsets: int64 array of the offset of every frame in data
+    :param lengths: int64 array of the captured length of every frame
+    :return: the MriSamples of all frames; frames without the MRI option
+             give no sample
+    """
+    packets = np.arange(len(offsets))
+    keep = lengths >= _MIN_LENGTH
+    packets, offsets, lengths = packets[keep], offsets[keep], lengths[keep]
+    keep = readField(data, offsets + 12, 2) == _ETHERTYPE_IPV4
+    packets, offsets, lengths = packets[keep], offsets[keep], lengths[keep]
+    ip = offsets + 14
+    ihl = (data[ip] & 0x0f).astype(np.int64)
+    keep = (ihl > 5) & ((data[ip + 20] & 0x1f) == IPV4_OPTION_MRI)
+    packets, offsets, lengths, ip, ihl = (packets[keep], offsets[keep], lengths[keep],
+                                          ip[keep], ihl[keep])
+    count = readField(data, ip + 22, 2).astype(np.int64)
+    # never read past the option, the IPv4 header or the captured bytes
+    count = np.minimum(count, (data[ip + 21].astype(np.int64) - 4) // 8)
+    count = np.minimum(count, (ihl * 4 - 24) // 8)
+    count = np.minimum(count, (offsets + lengths - ip - 24) // 8)
+    count = np.clip(count, 0, MAX_HOPS)
+    columns = ([], [], [], [])
+    for k in range(MAX_HOPS):
+        has = count > k
+        if not has.any():
+            break
+        trace = ip[has] + 24 + 8 * k
+        columns[0].append(packets[has])
+        # swtraces[0] is the last switch
+        columns[1].append(count[has] - 1 - k)
+        columns[2].append(readField(data, trace, 4))
+        columns[3].append(readField(data, trace + 4, 4))
+    if not columns[0]:
+        empty = np.zeros(0, dtype=np.int64)
+        return MriSamples(empty, empty, empty.astype(np.uint32), empty.astype(np.uint32))
+    return MriSamples(*[np.concatenate(column) for column in columns])
+
+
+class QueueDepthWindows(object):
+    """
+    The last `window` queue depths of every (swid, hop), in one NumPy array
+    of one ring per row.
+    """
+
+    def __init__(self, window=4096, keys=64):
+        self.window = window
+        # (swid, hop) -> row
+        self.keys = OrderedDict()
+        self.samples = np.zeros((keys, window), dtype=np.uint32)
+        # number of samples written per row, the next slot is count % window
+        self.counts = np.zeros(keys, dtype=np.int64)
+
+    def add(self, samples):
+        """
+        :param samples: the MriSamples to record
+        """
+        if not len(samples.swid):
+            return
+        pairs = np.stack([samples.swid.astype(np.int64), samples.hop.astype(np.int64)], axis=1)
+        unique, inverse = np.unique(pairs, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(unique) + 1))
+        qdepth = samples.qdepth[order]
+        for i, (swid, hop) in enumerate(unique):
+            self._append(self._row(int(swid), int(hop)), qdepth[bounds[i]:bounds[i + 1]])
+
+    def _row(self, swid, hop):
+        row = self.keys.get((swid, hop))
+        if row is None:
+            row = self.keys[(swid, hop)] = len(self.keys)
+            if row == len(self.counts):
+                rows = len(self.counts)
+                self.samples = np.concatenate(
+                    [self.samples, np.zeros((rows, self.window), dtype=np.uint32)])
+                self.counts = np.concatenate([self.counts, np.zeros(rows, dtype=np.int64)])
+        return row
+
+    def _append(self, row, values):
+        # only the last window values can stay in the ring
+        values = values[-self.window:]
+        start = self.counts[row] % self.window
+        first = min(len(values), self.window - start)
+        self.samples[row, start:start + first] = values[:first]
+        self.samples[row, :len(values) - first] = values[first:]
+        self.counts[row] += len(values)
+
+    def samplesOf(self, swid, hop):
+        """
+        :return: the samples of the window of (swid, hop), in no particular order
+        """
+        row = self.keys[(swid, hop)]
+        return self.samples[row, :min(self.counts[row], self.window)]
+
+    def percentiles(self, q=(50, 90, 99)):
+        """
+        :param q: the percentiles to compute
+        :return: OrderedDict of (swid, hop) -> array of the percentiles of
+                 its window, sorted by swid then hop
+        """
+        result = OrderedDict()
+        for key in sorted(self.keys):
+            result[key] = np.percentile(self.samplesOf(*key), q)
+        return result
+
+
+def printQueueDepths(windows, q=(50, 90, 99)):
+    """
+    Prints one line per switch and hop.
+
+    :param windows: the QueueDepthWindows
+    :param q: the percentiles to print
+    """
+    for (swid, hop), values in windows.percentiles(q).items():
+        print("Switch %d (hop %d): %s, %d samples" % (
+            swid, hop, ', '.join('p%g %.1f' % (p, v) for p, v in zip(q, values)),
+            min(windows.counts[windows.keys[(swid, hop)]], windows.window)))
@@ -0,0 +1,215 @@
+"""
+Precomputed P4Info lookups.
+预先建立 P4Info 的 ID/名称索引，查找由线性扫描变为字典查找；解析后的 P4Info 以二进制缓存，重启控制器时无需再解析文本
+
+P4InfoHelper scans the P4Info lists on every ID <-> name translation, and
+buildTableEntry does several of those per entry and per field. P4InfoIndex
+builds read-only dicts once; IndexedP4InfoHelper is a P4InfoHelper whose
+lookups go through such an index, so buildTableEntry, get_tables_name, etc.
+keep working unchanged.
+
+Parsing the text format p4info written by p4c is the slowest part of
+building a helper. loadP4Info keeps the parsed message as binary protobuf
+in a cache directory, under the SHA-256 of the text file, so the next start
+with the same file only reads the binary form; a changed file has another
+hash and is parsed again.
+"""
+import hashlib
+import os
+import tempfile
+from types import MappingProxyType
+
+import google.protobuf.text_format
+from google.protobuf.message import DecodeError
+from p4.config.v1 import p4info_pb2
+
+from p4runtime_lib.helper import P4InfoHelper
+
+# The P4Info fields holding entities with a preamble; 'externs' is not one,
+# an Extern only groups instances
+ENTITY_TYPES = ('tables', 'actions', 'action_profiles', 'counters',
+                'direct_counters', 'meters', 'direct_meters',
+                'controller_packet_metadata', 'value_sets', 'registers',
+                'digests')
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'p4info')
+
+
+def loadP4Info(p4info_file_path, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Reads a text format p4info file, through the binary cache.
+
+    :param p4info_file_path: the p4info file written by p4c
+    :param cache_dir: the cache directory, None to always parse the text;
+                      a directory that cannot be written only disables
+                      storing new entries
+    :return: the P4Info message
+    """
+    with open(p4info_file_path, 'rb') as f:
+        text = f.read()
+    p4info = p4info_pb2.P4Info()
+    if cache_dir is None:
+        google.protobuf.text_format.Merge(text.decode('utf-8'), p4info)
+        return p4info
+    cache_path = os.path.join(cache_dir, hashlib.sha256(text).hexdigest() + '.bin')
+    try:
+        with open(cache_path, 'rb') as f:
+            p4info.ParseFromString(f.read())
+        return p4info
+    except (OSError, DecodeError):
+        p4info.Clear()
+    google.protobuf.text_format.Merge(text.decode('utf-8'), p4info)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write then rename, so a controller starting at the same time never
+        # reads half of the file
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(p4info.SerializeToString())
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return p4info
+
+
+def _freeze(d):
+    return MappingProxyType(d)
+
+
+class P4InfoIndex(object):
+    """
+    Read-only ID <-> name index of a P4Info message.
+    """
+
+    def __init__(self, p4info):
+        by_name = {}
+        by_id = {}
+        for entity_type in ENTITY_TYPES:
+            if entity_type not in p4info.DESCRIPTOR.fields_by_name:
+                continue
+            names = {}
+            ids = {}
+            for o in getattr(p4info, entity_type):
+                if not o.HasField('preamble'):
+                    continue
+                ids[o.preamble.id] = o
+                names[o.preamble.name] = o
+            # aliases resolve too, but never shadow a full name
+            for o in getattr(p4info, entity_type):
+                if o.HasField('preamble') and o.preamble.alias:
+                    names.setdefault(o.preamble.alias, o)
+            by_name[entity_type] = _freeze(names)
+            by_id[entity_type] = _freeze(ids)
+        self._by_name = _freeze(by_name)
+        self._by_id = _freeze(by_id)
+
+        match_fields = {}
+        for t in p4info.tables:
+            fields = (_freeze({mf.name: mf for mf in t.match_fields}),
+                      _freeze({mf.id: mf for mf in t.match_fields}))
+            match_fields[t.preamble.name] = fields
+            match_fields.setdefault(t.preamble.alias, fields)
+        self._match_fields = _freeze(match_fields)
+
+        params = {}
+        for a in p4info.actions:
+            action_params = (_freeze({p.name: p for p in a.params}),
+                             _freeze({p.id: p for p in a.params}))
+            params[a.preamble.name] = action_params
+            params.setdefault(a.preamble.alias, action_params)
+        self._params = _freeze(params)
+
+    def entity(self, entity_type, name=None, id=None):
+        """
+        Same as P4InfoHelper.get: returns the P4Info message of the entity of
+        type entity_type (e.g. 'tables') with the given name or id.
+        """
+        if name is not None and id is not None:
+            raise AssertionError("name or id must be None")
+        try:
+            if name is not None:
+                return self._by_name[entity_type][name]
+            return self._by_id[entity_type][id]
+        except KeyError:
+            if name:
+                raise AttributeError("Could not find %r of type %s" % (name, entity_type))
+            raise AttributeError("Could not find id %r of type %s" % (id, entity_type))
+
+    def match_field(self, table_name, name=None, id=None):
+        """Same as P4InfoHelper.get_match_field."""
+        try:
+            by_name, by_id = self._match_fields[table_name]
+            if name is not None:
+                return by_name[name]
+            return by_id[id]
+        except KeyError:
+            raise AttributeError("%r has no attribute %r" % (
+                table_name, name if name is not None else id))
+
+    def action_param(self, action_name, name=None, id=None):
+        """Same as P4InfoHelper.get_action_param."""
+        try:
+            by_name, by_id = self._params[action_name]
+            if name is not None:
+                return by_name[name]
+            return by_id[id]
+        except KeyError:
+            raise AttributeError("action %r has no param %r" % (
+                action_name, name if name is not None else id))
+
+    def decodeTableEntry(self, entry):
+        """
+        Translates the IDs of a TableEntry read from a switch to names.
+
+        :param entry: the p4runtime TableEntry
+        :return: (table name, [(match field name, value)], action name,
+                 [(param name, value)]), with the values in the form returned
+                 by P4InfoHelper.get_match_field_value; the action name is
+                 None if the entry has no direct action
+        """
+        table_name = self.entity('tables', id=entry.table_id).preamble.name
+        by_id = self._match_fields[table_name][1]
+        match = []
+        for m in entry.match:
+            match_type = m.WhichOneof("field_match_type")
+            if match_type == 'exact':
+                value = m.exact.value
+            elif match_type == 'lpm':
+                value = (m.lpm.value, m.lpm.prefix_len)
+            elif match_type == 'ternary':
+                value = (m.ternary.value, m.ternary.mask)
+            elif match_type == 'range':
+                value = (m.range.low, m.range.high)
+            elif match_type == 'optional':
+                value = m.optional.value
+            else:
+                raise Exception("Unsupported match type with type %r" % match_type)
+            match.append((by_id[m.field_id].name, value))
+        if entry.action.WhichOneof('type') != 'action':
+            return table_name, match, None, []
+        action = entry.action.action
+        action_name = self.entity('actions', id=action.action_id).preamble.name
+        param_by_id = self._params[action_name][1]
+        params = [(param_by_id[p.param_id].name, p.value) for p in action.params]
+        return table_name, match, action_name, params
+
+
+class IndexedP4InfoHelper(P4InfoHelper):
+    """
+    P4InfoHelper whose lookups use a P4InfoIndex built once from the file,
+    read through the binary cache of loadP4Info.
+    """
+
+    def __init__(self, p4_info_filepath, cache_dir=DEFAULT_CACHE_DIR):
+        # P4InfoHelper.__init__ only parses the file into self.p4info
+        self.p4info = loadP4Info(p4_info_filepath, cache_dir)
+        self.index = P4InfoIndex(self.p4info)
+
+    def get(self, entity_type, name=None, id=None):
+        return self.index.entity(entity_type, name=name, id=id)
+
+    def get_match_field(self, table_name, name=None, id=None):
+        return self.index.match_field(table_name, name=name, id=id)
+
+    def get_action_param(self, action_name, name=None, id=None):
+        return self.index.action_param(action_name, name=name, id=id)
@@ -0,0 +1,80 @@
+"""
+Firewall port roles.
+防火墙端口角色：由每台交换机的内部/外部端口声明自动生成 check_ports 方向表
+
+A firewall switch declares its ports in topology.json:
+
+    "switches": {
+        "s1": {"firewall": {"internal": [1, 2], "external": ["3-4"]}},
+        ...
+    }
+
+A port is a number or a "first-last" range. check_ports then needs one
+entry per (ingress port, egress port) pair crossing the border: direction 0
+from an internal to an external port, 1 the other way. Packets between two
+ports of the same side miss the table and are not filtered.
+"""
+from collections import namedtuple
+
+# The ports of a firewall switch, as sorted lists of port numbers
+PortRoles = namedtuple('PortRoles', ['switch', 'internal', 'external'])
+
+# set_direction values of firewall.p4
+DIRECTION_OUTGOING = 0
+DIRECTION_INCOMING = 1
+
+
+def parsePorts(spec):
+    """
+    :param spec: list of port numbers and "first-last" ranges
+    :return: the sorted list of port numbers
+    """
+    ports = set()
+    for item in spec:
+        if isinstance(item, int):
+            ports.add(item)
+            continue
+        first, sep, last = str(item).partition('-')
+        try:
+            if sep:
+                ports.update(range(int(first), int(last) + 1))
+            else:
+                ports.add(int(first))
+        except ValueError:
+            raise ValueError("Expected a port or a port range like 1-24, got %r" % (item,))
+    return sorted(ports)
+
+
+def portRoles(topo):
+    """
+    :param topo: the topology.Topology
+    :return: the list of PortRoles of the switches with a "firewall"
+             declaration, in topology order
+    """
+    roles = []
+    for name, params in topo.switches.items():
+        declaration = params.get('firewall')
+        if declaration is None:
+            continue
+        internal = parsePorts(declaration.get('internal', ()))
+        external = parsePorts(declaration.get('external', ()))
+        both = set(internal) & set(external)
+        if both:
+            raise ValueError("Ports %s of %s are both internal and external" % (
+                sorted(both), name))
+        roles.append(PortRoles(name, internal, external))
+    return roles
+
+
+def directionRules(roles):
+    """
+    :param roles: the PortRoles of a switch
+    :return: the list of (ingress port, egress port, direction) of its
+             check_ports entries
+    """
+    rules = []
+    for internal in roles.internal:
+        for external in roles.external:
+            rules.append((internal, external, DIRECTION_OUTGOING))
+            rules.append((external, internal, DIRECTION_INCOMING))
+    return rules
@@ -0,0 +1,209 @@
+"""
+link_monitor probe collector.
+链路监控探针收集：原始套接字收包到预分配的环形缓冲区，原地解析 probe_data 头部栈，按链路记录利用率时间序列
+
+A probe of link_monitor.p4 is an Ethernet frame of type 0x812 carrying
+
+    probe_t       hop_cnt (8 bits)
+    probe_data_t  x hop_cnt, the last hop first, the first one has bos = 1:
+                  bos (1), swid (7), port (8), byte_cnt (32),
+                  last_time (48), cur_time (48)
+    probe_fwd_t   egress_spec (8 bits) per remaining hop
+
+Every probe_data is one link: byte_cnt bytes left switch swid through
+port between last_time and cur_time (microseconds).
+
+ProbeCollector receives the frames with recv_into into the slots of one
+preallocated buffer and parses them in place with struct.unpack_from, so
+no bytes object is created per packet. LinkSeries keeps the utilization of
+every link in NumPy arrays used as rings.
+"""
+import select
+import socket
+import struct
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+ETHERTYPE_PROBE = 0x812
+MAX_HOPS = 10
+
+_ETHERNET_LENGTH = 14
+# bos/swid, port, byte_cnt, last_time (high 16 bits, low 32 bits), cur_time
+_PROBE_DATA = struct.Struct('!BBIHIHI')
+_ETHERTYPE = struct.Struct('!H')
+
+
+class LinkSeries(object):
+    """
+    Utilization samples of every link, the last `history` per link.
+
+    Links are numbered in the order they are first seen; `links` maps
+    (swid, port) to that number, which is the row of `times` (seconds, from
+    the switch timestamps) and `rates` (bytes/s).
+    """
+
+    def __init__(self, history=1024, links=64):
+        self.history = history
+        self.links = OrderedDict()
+        self.times = np.zeros((links, history))
+        self.rates = np.zeros((links, history))
+        # number of samples written per link, the next slot is count % history
+        self.counts = np.zeros(links, dtype=np.int64)
+
+    def add(self, swid, port, byte_cnt, last_time, cur_time):
+        """
+        Records one probe_data. A probe that finds the port for the first
+        time (last_time 0) or no time elapsed gives no sample.
+        """
+        if last_time == 0 or cur_time <= last_time:
+            return
+        row = self.links.get((swid, port))
+        if row is None:
+            row = self.links[(swid, port)] = len(self.links)
+            if row == len(self.counts):
+                self._grow()
+        slot = self.counts[row] % self.history
+        self.times[row, slot] = cur_time * 1e-6
+        self.rates[row, slot] = byte_cnt * 1e6 / (cur_time - last_time)
+        self.counts[row] += 1
+
+    def _grow(self):
+        rows = len(self.counts)
+        self.times = np.concatenate([self.times, np.zeros((rows, self.history))])
+        self.rates = np.concatenate([self.rates, np.zeros((rows, self.history))])
+        self.counts = np.concatenate([self.counts, np.zeros(rows, dtype=np.int64)])
+
+    def series(self, swid, port):
+        """
+        :return: (times, rates) of the link, oldest sample first
+        """
+        row = self.links[(swid, port)]
+        count = self.counts[row]
+        if count <= self.history:
+            return self.times[row, :count].copy(), self.rates[row, :count].copy()
+        order = np.roll(np.arange(self.history), -(count % self.history))
+        return self.times[row, order], self.rates[row, order]
+
+    def latest(self):
+        """
+        :return: OrderedDict of (swid, port) -> last rate in bytes/s
+        """
+        rows = np.arange(len(self.links))
+        slots = (self.counts[rows] - 1) % self.history
+        rates = self.rates[rows, slots]
+        return OrderedDict((link, float(rate)) for link, rate in zip(self.links, rates))
+
+    def mean(self, window):
+        """
+        :param window: the number of last samples to average
+        :return: OrderedDict of (swid, port) -> mean rate in bytes/s
+        """
+        means = OrderedDict()
+        for link, row in self.links.items():
+            count = min(self.counts[row], window, self.history)
+            slots = (self.counts[row] - 1 - np.arange(count)) % self.history
+            means[link] = float(self.rates[row, slots].mean())
+        return means
+
+
+def parseProbe(buf, length, series):
+    """
+    Parses one probe frame in place and records its hops.
+
+    :param buf: a memoryview (or bytes-like) holding the frame
+    :param length: the length of the frame in buf
+    :param series: the LinkSeries to record into
+    :return: the number of hops recorded, or -1 if the frame is not a
+             valid probe
+    """
+    if length < _ETHERNET_LENGTH + 1 or _ETHERTYPE.unpack_from(buf, 12)[0] != ETHERTYPE_PROBE:
+        return -1
+    hop_cnt = buf[_ETHERNET_LENGTH]
+    offset = _ETHERNET_LENGTH + 1
+    hops = 0
+    # one probe_data per hop, the stack ends with bos = 1
+    while hops < min(hop_cnt, MAX_HOPS):
+        if offset + _PROBE_DATA.size > length:
+            return -1
+        (bos_swid, port, byte_cnt, last_high, last_low,
+         cur_high, cur_low) = _PROBE_DATA.unpack_from(buf, offset)
+        series.add(bos_swid & 0x7f, port, byte_cnt,
+                   (last_high << 32) | last_low, (cur_high << 32) | cur_low)
+        offset += _PROBE_DATA.size
+        hops += 1
+        if bos_swid & 0x80:
+            break
+    return hops
+
+
+class ProbeCollector(object):
+    """
+    Receives probes on a raw socket into a ring of preallocated buffers.
+    """
+
+    def __init__(self, iface, series, slots=256, slot_size=2048, rcvbuf=4 << 20):
+        """
+        :param iface: the interface to capture on, e.g. eth0
+        :param series: the LinkSeries the probes are recorded into
+        :param slots: the number of frames received before parsing
+        :param slot_size: the largest frame, bigger frames are truncated
+        :param rcvbuf: the socket receive buffer size, which absorbs the
+                       bursts of probes arriving while a ring is parsed
+        """
+        self.series = series
+        self.slot_size = slot_size
+        self._buffer = bytearray(slots * slot_size)
+        view = memoryview(self._buffer)
+        self._slots = [view[i * slot_size:(i + 1) * slot_size] for i in range(slots)]
+        self._lengths = [0] * slots
+        self.received = 0
+        self.invalid = 0
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                                  socket.htons(ETHERTYPE_PROBE))
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.bind((iface, 0))
+        self.sock.setblocking(False)
+
+    def close(self):
+        self.sock.close()
+
+    def poll(self, timeout):
+        """
+        Waits up to timeout seconds for probes, then receives and parses
+        everything the socket holds, a ring at a time.
+
+        :return: the number of probes received
+        """
+        received = 0
+        if not select.select([self.sock], [], [], timeout)[0]:
+            return 0
+        while True:
+            filled = 0
+            for i, slot in enumerate(self._slots):
+                try:
+                    self._lengths[i] = self.sock.recv_into(slot)
+                except BlockingIOError:
+                    break
+                filled += 1
+            for i in range(filled):
+                if parseProbe(self._slots[i], self._lengths[i], self.series) < 0:
+                    self.invalid += 1
+            received += filled
+            if filled < len(self._slots):
+                break
+        self.received += received
+        return received
+
+    def run(self, duration=None, report=None, interval=1.0):
+        """
+        Collects probes until duration seconds have passed (forever if
+        None), calling report(series) every interval seconds.
+        """
+        start = last_report = time.time()
+        while duration is None or time.time() - start < duration:
+            self.poll(min(interval, 0.1))
+            if report is not None and time.time() - last_report >= interval:
+                report(self.series)
+                last_report = time.time()
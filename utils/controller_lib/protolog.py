@@ -0,0 +1,283 @@
+"""
+Background proto dump logging.
+后台 P4Runtime 消息转存：请求放入有界队列由后台线程批量写入，支持紧凑的二进制格式、按大小轮转，并可按交换机开关
+
+p4runtime_lib writes every request to logs/sN-p4runtime-requests.txt as
+text, opening the file and formatting the message in the calling thread
+before the RPC is sent. ProtoDumpLogger is a gRPC client interceptor that
+only serializes the request and puts the bytes on a bounded queue, so the
+caller is free to reuse the message; a writer thread formats and writes
+whatever the queue holds in one go. When the queue is full the request is
+counted in `dropped` instead of slowing the controller down.
+
+Two formats:
+
+    text    the format of p4runtime_lib, messages of 1024 characters or
+            more are replaced by their size; the queued bytes are parsed
+            back into the request message of the method to be formatted
+    binary  one record per request: time (double), length of the method
+            name (uint16), length of the message (uint32), all big endian,
+            then the method name and the serialized message;
+            readProtoDump reads them back
+
+When a file would grow past max_bytes it is renamed to file.1 (file.1 to
+file.2, etc., keeping `backups` of them) and a new file is started.
+"""
+import atexit
+import os
+import struct
+import threading
+import time
+from queue import Empty, Full, Queue
+
+import grpc
+from p4.v1 import p4runtime_pb2
+
+from .connection import INTERCEPTOR_PROTO_DUMP
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_MAX_BYTES = 64 << 20
+DEFAULT_BACKUPS = 3
+# same limit as p4runtime_lib.switch
+MSG_LOG_MAX_LEN = 1024
+
+_RECORD = struct.Struct('!dHI')
+_STOP = object()
+
+
+def _serialize(body):
+    if isinstance(body, bytes):
+        return body
+    return body.SerializeToString()
+
+
+def _parse(method, data):
+    # the request message of the method, or the bytes for an unknown method
+    request_type = getattr(p4runtime_pb2, method.rsplit('/', 1)[-1] + 'Request', None)
+    if request_type is None:
+        return data
+    return request_type.FromString(data)
+
+
+def _formatText(timestamp, method, data):
+    ts = '%s.%03d' % (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp)),
+                      int(timestamp * 1000) % 1000)
+    msg = str(_parse(method, data))
+    if len(msg) < MSG_LOG_MAX_LEN:
+        text = msg
+    else:
+        text = "Message too long (%d bytes)! Skipping log...\n" % len(msg)
+    return ("\n[%s] %s\n---\n%s---\n" % (ts, method, text)).encode('utf-8')
+
+
+def _formatBinary(timestamp, method, data):
+    method = method.encode('utf-8')
+    return _RECORD.pack(timestamp, len(method), len(data)) + method + data
+
+
+class ProtoDumpLogger(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+    """
+    Logs the requests of a channel to a file from a background thread.
+    """
+
+    def __init__(self, path, binary=False, max_bytes=DEFAULT_MAX_BYTES,
+                 backups=DEFAULT_BACKUPS, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        :param path: the dump file, truncated
+        :param binary: write length-prefixed binary records instead of text
+        :param max_bytes: the size at which the file is rotated, 0 for never
+        :param backups: the number of rotated files kept
+        :param queue_size: the number of requests waiting to be written
+                           beyond which requests are dropped
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self.written = 0
+        self._format = _formatBinary if binary else _formatText
+        self._queue = Queue(maxsize=queue_size)
+        self._file = open(path, 'wb')
+        self._size = 0
+        self._thread = threading.Thread(target=self._run, name='proto-dump %s' % path)
+        self._thread.daemon = True
+        self._thread.start()
+        # write what is still queued when the controller exits
+        atexit.register(self.close)
+
+    def log(self, method, body):
+        """
+        Queues one request, serialized in the calling thread.
+
+        :param method: the full method name, e.g. /p4.v1.P4Runtime/Write
+        :param body: the request message, or its serialized bytes
+        """
+        if self._queue.full():
+            # not worth serializing
+            self.dropped += 1
+            return
+        try:
+            self._queue.put_nowait((time.time(), method, _serialize(body)))
+        except Full:
+            self.dropped += 1
+
+    def queueDepth(self):
+        """
+        :return: the number of requests waiting to be written
+        """
+        return self._queue.qsize()
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        self.log(client_call_details.method, request)
+        return continuation(client_call_details, request)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        self.log(client_call_details.method, request)
+        return continuation(client_call_details, request)
+
+    def close(self):
+        """
+        Writes the queued requests and closes the file.
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if not self._file.closed:
+            self._file.close()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # everything queued meanwhile is written with the same flush
+            try:
+                while len(items) < 1024:
+                    items.append(self._queue.get_nowait())
+            except Empty:
+                pass
+            stop = False
+            for item in items:
+                if item is _STOP:
+                    stop = True
+                    continue
+                self._write(self._format(*item))
+            self._file.flush()
+            if stop:
+                return
+
+    def _write(self, record):
+        if self.max_bytes and self._size and self._size + len(record) > self.max_bytes:
+            self._rotate()
+        self._file.write(record)
+        self._size += len(record)
+        self.written += 1
+
+    def _rotate(self):
+        self._file.close()
+        if self.backups:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists('%s.%d' % (self.path, i)):
+                    os.replace('%s.%d' % (self.path, i), '%s.%d' % (self.path, i + 1))
+            os.replace(self.path, self.path + '.1')
+        self._file = open(self.path, 'wb')
+        self._size = 0
+
+
+def readProtoDump(path):
+    """
+    Reads a binary dump.
+
+    :return: generator of (time, method, serialized message)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    pos = 0
+    while pos + _RECORD.size <= len(data):
+        timestamp, method_length, data_length = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        method = data[pos:pos + method_length].decode('utf-8')
+        pos += method_length
+        yield timestamp, method, data[pos:pos + data_length]
+        pos += data_length
+
+
+class ProtoDumps(object):
+    """
+    The proto dump loggers of the switches of a controller.
+    """
+
+    def __init__(self, switches='all', binary=False, max_bytes=DEFAULT_MAX_BYTES,
+                 backups=DEFAULT_BACKUPS, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        :param switches: "all", "none", or the comma separated names of the
+                         switches whose requests are dumped
+        :param binary, max_bytes, backups, queue_size: see ProtoDumpLogger
+        """
+        if switches in ('all', 'none'):
+            self._switches = switches
+        else:
+            self._switches = set(name.strip() for name in switches.split(',') if name.strip())
+        self.binary = binary
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue_size = queue_size
+        # switch name -> ProtoDumpLogger
+        self.loggers = {}
+
+    @classmethod
+    def fromArgs(cls, args):
+        """
+        :param args: the arguments parsed with addProtoDumpArguments
+        """
+        return cls(args.proto_dump, args.proto_dump_format == 'binary',
+                   int(args.proto_dump_max_mb * (1 << 20)))
+
+    def enabled(self, name):
+        if self._switches == 'all':
+            return True
+        if self._switches == 'none':
+            return False
+        return name in self._switches
+
+    def attach(self, sw, path):
+        """
+        Logs the requests of a switch connection created without
+        proto_dump_file, if dumping is enabled for it.
+
+        :param sw: the switch connection, a ControllerConnection
+        :param path: the dump file; with the binary format a .txt suffix
+                     becomes .bin
+        :return: the ProtoDumpLogger, or None
+        """
+        if not self.enabled(sw.name):
+            return None
+        if self.binary and path.endswith('.txt'):
+            path = path[:-len('.txt')] + '.bin'
+        logger = ProtoDumpLogger(path, self.binary, self.max_bytes, self.backups, self.queue_size)
+        sw.addInterceptor(logger, INTERCEPTOR_PROTO_DUMP)
+        sw.proto_dump_file = path
+        self.loggers[sw.name] = logger
+        return logger
+
+    def close(self):
+        """
+        Writes the queued requests of every switch and closes the files.
+        """
+        for logger in self.loggers.values():
+            logger.close()
+
+
+def addProtoDumpArguments(parser):
+    """
+    Adds --proto-dump, --proto-dump-format and --proto-dump-max-mb.
+    """
+    parser.add_argument('--proto-dump',
+                        help='switches whose P4Runtime requests are dumped to logs/: '
+                             'all, none or comma separated names',
+                        type=str, action="store", required=False, default='all')
+    parser.add_argument('--proto-dump-format', help='format of the dump files',
+                        type=str, action="store", required=False, default='text',
+                        choices=['text', 'binary'])
+    parser.add_argument('--proto-dump-max-mb',
+                        help='size in MiB at which a dump file is rotated, 0 for never',
+                        type=float, action="store", required=False,
+                        default=DEFAULT_MAX_BYTES / float(1 << 20))
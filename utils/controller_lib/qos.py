@@ -0,0 +1,200 @@
+"""
+DSCP class policy.
+QoS 策略：把目的网段到流量等级的声明编译成 qos.p4 的 ipv4_lpm 表项，并按 DSCP 统计抓包中各等级的吞吐量
+
+A policy file maps destination prefixes to traffic classes:
+
+    {
+        "classes": {
+            "10.0.3.0/24": "expedited",
+            "10.0.2.22/32": "voice"
+        }
+    }
+
+qos.p4 marks UDP as expedited forwarding and TCP as voice admit; an
+ipv4_lpm entry with the expedited_forwarding or voice_admit action forwards
+the packet like ipv4_forward and sets the DSCP of its class whatever the
+protocol. A packet takes the class of the longest policy prefix containing
+its destination. When a policy prefix is more specific than the routes of a
+switch, compilePolicy adds an entry for it with the next hop of the longest
+route covering it, so the class never changes where packets go.
+
+classThroughput computes the packets and bytes per DSCP of a capture in
+fixed intervals with NumPy, from capture.decodeIpv4; NumPy is only imported
+when it is called.
+"""
+import json
+import socket
+import struct
+from collections import OrderedDict, namedtuple
+
+from .topology import Route
+
+# One traffic class: the ipv4_lpm action of its entries and the DSCP it
+# sets, None when the protocol decides
+TrafficClass = namedtuple('TrafficClass', ['name', 'action', 'dscp'])
+
+BEST_EFFORT = TrafficClass('best_effort', 'MyIngress.ipv4_forward', None)
+EXPEDITED = TrafficClass('expedited', 'MyIngress.expedited_forwarding', 46)
+VOICE = TrafficClass('voice', 'MyIngress.voice_admit', 44)
+TRAFFIC_CLASSES = OrderedDict((c.name, c) for c in (BEST_EFFORT, EXPEDITED, VOICE))
+
+# Packets and bytes of one DSCP over a capture; the rates are in bytes/s,
+# peak_rate is that of the busiest interval
+ClassThroughput = namedtuple('ClassThroughput', ['dscp', 'name', 'packets', 'bytes',
+                                                 'mean_rate', 'peak_rate'])
+
+_DSCP_NAMES = dict((c.dscp, c.name) for c in TRAFFIC_CLASSES.values() if c.dscp is not None)
+
+
+def _address(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def _mask(length):
+    return (0xffffffff << (32 - length)) & 0xffffffff
+
+
+def parsePrefix(spec):
+    """
+    :param spec: "a.b.c.d/len", or an address for a /32
+    :return: the (ip, prefix length) tuple of the prefix, host bits cleared
+    """
+    ip, sep, length = spec.partition('/')
+    try:
+        network = _address(ip)
+        length = int(length) if sep else 32
+    except (OSError, ValueError):
+        raise ValueError("Expected a prefix like 10.0.1.0/24, got %r" % (spec,))
+    if not 0 <= length <= 32:
+        raise ValueError("Prefix length of %r is not between 0 and 32" % (spec,))
+    network &= _mask(length)
+    return socket.inet_ntoa(struct.pack('!I', network)), length
+
+
+class QosPolicy(object):
+    """
+    Destination prefixes and their traffic classes.
+    """
+
+    def __init__(self, classes=None):
+        """
+        :param classes: dict of prefix ("a.b.c.d/len") -> class name
+        """
+        # (network, length, TrafficClass), longest prefix first
+        self._prefixes = []
+        for spec, name in (classes or {}).items():
+            if name not in TRAFFIC_CLASSES:
+                raise ValueError("Unknown traffic class %r for %s, expected one of %s" % (
+                    name, spec, ', '.join(TRAFFIC_CLASSES)))
+            ip, length = parsePrefix(spec)
+            self._prefixes.append((_address(ip), length, TRAFFIC_CLASSES[name]))
+        self._prefixes.sort(key=lambda prefix: -prefix[1])
+
+    @classmethod
+    def fromFile(cls, path):
+        with open(path) as f:
+            return cls(json.load(f).get('classes', {}))
+
+    def prefixes(self):
+        """
+        :return: the list of (ip, prefix length) of the policy, longest first
+        """
+        return [(socket.inet_ntoa(struct.pack('!I', network)), length)
+                for network, length, _ in self._prefixes]
+
+    def classOf(self, dst_prefix):
+        """
+        :param dst_prefix: an (ip, prefix length) tuple
+        :return: the TrafficClass of the longest policy prefix containing
+                 dst_prefix, BEST_EFFORT if there is none
+        """
+        ip, length = dst_prefix
+        address = _address(ip)
+        for network, policy_length, traffic_class in self._prefixes:
+            if policy_length <= length and address & _mask(policy_length) == network:
+                return traffic_class
+        return BEST_EFFORT
+
+
+def compilePolicy(routes, policy):
+    """
+    :param routes: list of topology.Route
+    :param policy: the QosPolicy
+    :return: list of (Route, TrafficClass), the routes followed by the
+             entries added for the policy prefixes more specific than them
+    """
+    classified = [(route, policy.classOf(route.dst_prefix)) for route in routes]
+    by_switch = OrderedDict()
+    for route in routes:
+        ip, length = route.dst_prefix
+        by_switch.setdefault(route.switch, {})[(_address(ip) & _mask(length), length)] = route
+    for switch, table in by_switch.items():
+        # the longest route first
+        ordered = sorted(table.items(), key=lambda item: -item[0][1])
+        for ip, length in policy.prefixes():
+            network = _address(ip)
+            if (network, length) in table:
+                continue
+            for (route_network, route_length), route in ordered:
+                if route_length < length and network & _mask(route_length) == route_network:
+                    prefix = (ip, length)
+                    classified.append((Route(switch, prefix, route.dst_mac, route.port),
+                                       policy.classOf(prefix)))
+                    break
+    return classified
+
+
+def buildQosEntry(p4info_helper, route, traffic_class):
+    """
+    :return: the ipv4_lpm TableEntry of route in traffic_class
+    """
+    return p4info_helper.buildTableEntry(
+        table_name="MyIngress.ipv4_lpm",
+        match_fields={"hdr.ipv4.dstAddr": route.dst_prefix},
+        action_name=traffic_class.action,
+        action_params={"dstAddr": route.dst_mac, "port": route.port})
+
+
+def classThroughput(packets, times, interval=1.0):
+    """
+    :param packets: the capture.Ipv4Packets of a capture
+    :param times: float array of the frame times in seconds, indexed like
+                  the frames of the capture
+    :param interval: the length in seconds of the intervals of peak_rate
+    :return: list of ClassThroughput, one per DSCP seen, by DSCP
+    """
+    # imported here so that the controller, which only compiles policies,
+    # starts without loading NumPy
+    import numpy as np
+
+    if not len(packets.packet):
+        return []
+    times = np.asarray(times)[packets.packet]
+    start = times.min()
+    duration = max(times.max() - start, interval)
+    slots = np.floor((times - start) / interval).astype(np.int64)
+    dscp = (packets.tos >> 2).astype(np.int64)
+    classes, inverse = np.unique(dscp, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    per_interval = np.zeros((len(classes), slots.max() + 1), dtype=np.int64)
+    np.add.at(per_interval, (inverse, slots), packets.length.astype(np.int64))
+    counts = np.bincount(inverse, minlength=len(classes))
+    result = []
+    for i, value in enumerate(classes):
+        total = int(per_interval[i].sum())
+        result.append(ClassThroughput(int(value), _DSCP_NAMES.get(int(value), ''),
+                                      int(counts[i]), total, total / duration,
+                                      per_interval[i].max() / float(interval)))
+    return result
+
+
+def printClassThroughput(throughputs):
+    """
+    Prints one line per DSCP.
+
+    :param throughputs: the list of ClassThroughput
+    """
+    for t in throughputs:
+        print("DSCP %2d %-12s %9d packets %12d bytes, mean %.3f Mbit/s, peak %.3f Mbit/s" % (
+            t.dscp, t.name, t.packets, t.bytes, t.mean_rate * 8e-6, t.peak_rate * 8e-6))
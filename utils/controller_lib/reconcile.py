@@ -0,0 +1,183 @@
+"""
+Incremental table reconciliation.
+增量同步：读取交换机上已安装的表项，与期望的规则集合比较，只下发差异部分
+
+Reconciler takes the desired table entries the same way as BatchWriter
+(add(sw, table_entry)). flush() reads the entries installed on each switch
+with ReadTableEntries, matches them with the desired ones on (table, match,
+priority) and queues only the updates that make the switch converge:
+INSERT for missing entries, MODIFY for entries whose action differs and
+DELETE for installed entries that are no longer desired.
+
+Every switch given to add() or manage() is owned by the reconciler: all
+its table entries that were not added are deleted. Default action entries
+are not returned by wildcard reads, so they are always sent as MODIFY,
+which is idempotent.
+
+State that only the switches hold, e.g. the hosts learned by an earlier
+run of the controller, is recovered with onInstalled(): the callbacks see
+the entries read from every switch before they are compared, and add()
+the entries to keep.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from p4.v1 import p4runtime_pb2
+
+from .batch import DEFAULT_BATCH_SIZE, BatchWriter, printWriteErrors
+
+
+def _canonical(value):
+    # P4Runtime servers may return values without their leading zero bytes,
+    # while p4runtime_lib.convert pads them to the field width
+    return value.lstrip(b'\x00') or b'\x00'
+
+
+def _matchKey(table_entry):
+    fields = []
+    for m in table_entry.match:
+        match_type = m.WhichOneof('field_match_type')
+        if match_type == 'exact':
+            value = (_canonical(m.exact.value),)
+        elif match_type == 'lpm':
+            value = (_canonical(m.lpm.value), m.lpm.prefix_len)
+        elif match_type == 'ternary':
+            value = (_canonical(m.ternary.value), _canonical(m.ternary.mask))
+        elif match_type == 'range':
+            value = (_canonical(m.range.low), _canonical(m.range.high))
+        else:
+            value = (m.SerializeToString(deterministic=True),)
+        fields.append((m.field_id, match_type) + value)
+    fields.sort()
+    return table_entry.table_id, tuple(fields), table_entry.priority
+
+
+def _actionKey(table_entry):
+    action_type = table_entry.action.WhichOneof('type')
+    if action_type == 'action':
+        action = table_entry.action.action
+        return (action.action_id,
+                tuple(sorted((p.param_id, _canonical(p.value)) for p in action.params)))
+    if action_type is None:
+        return None
+    return (action_type, table_entry.action.SerializeToString(deterministic=True))
+
+
+class Reconciler(object):
+    """
+    Makes the table entries of switches converge to a desired set, with as
+    few updates as possible.
+
+    The counts of the last flush() are kept per switch name in `inserted`,
+    `modified`, `deleted` and `unchanged`.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.writer = BatchWriter(batch_size=batch_size)
+        self.inserted = OrderedDict()
+        self.modified = OrderedDict()
+        self.deleted = OrderedDict()
+        self.unchanged = OrderedDict()
+        # switch -> OrderedDict of entry key -> desired TableEntry
+        self._desired = OrderedDict()
+        self._defaults = OrderedDict()
+        self._callbacks = []
+
+    def manage(self, sw):
+        """
+        Owns sw even if no entry is added for it, so that flush() deletes
+        all its entries.
+        """
+        self._desired.setdefault(sw, OrderedDict())
+        self._defaults.setdefault(sw, [])
+
+    def add(self, sw, table_entry):
+        """
+        Adds a desired table entry of sw.
+
+        :param sw: the switch connection
+        :param table_entry: the TableEntry built by P4InfoHelper.buildTableEntry
+        """
+        self.manage(sw)
+        if table_entry.is_default_action:
+            self._defaults[sw].append(table_entry)
+        else:
+            self._desired[sw][_matchKey(table_entry)] = table_entry
+
+    def onInstalled(self, callback):
+        """
+        Calls callback(installed) in every flush(), once the switches are
+        read and before they are compared; installed is a dict of switch
+        connection -> list of the TableEntry installed on it. The callback
+        may add() desired entries, of the switches already managed.
+        """
+        self._callbacks.append(callback)
+
+    def flush(self):
+        """
+        Reads the switches, then sends the updates that make them converge.
+
+        :return: the list of UpdateError for the updates rejected by the
+                 switches, as returned by BatchWriter.flush()
+        """
+        switches = list(self._desired)
+        if not switches:
+            return []
+        with ThreadPoolExecutor(max_workers=len(switches)) as pool:
+            installed = list(pool.map(self._readInstalled, switches))
+        for callback in self._callbacks:
+            callback(OrderedDict((sw, list(current.values()))
+                                 for sw, current in zip(switches, installed)))
+        for sw, current in zip(switches, installed):
+            self._diff(sw, self._desired[sw], current)
+            for table_entry in self._defaults[sw]:
+                self.writer.modify(sw, table_entry)
+        self._desired.clear()
+        self._defaults.clear()
+        return self.writer.flush()
+
+    @staticmethod
+    def _readInstalled(sw):
+        current = {}
+        for response in sw.ReadTableEntries():
+            for entity in response.entities:
+                current[_matchKey(entity.table_entry)] = entity.table_entry
+        return current
+
+    def _diff(self, sw, desired, current):
+        inserted = modified = unchanged = 0
+        for key, table_entry in desired.items():
+            installed = current.pop(key, None)
+            if installed is None:
+                self.writer.insert(sw, table_entry)
+                inserted += 1
+            elif _actionKey(installed) != _actionKey(table_entry):
+                self.writer.modify(sw, table_entry)
+                modified += 1
+            else:
+                unchanged += 1
+        for installed in current.values():
+            # the match key is enough to delete an entry
+            table_entry = p4runtime_pb2.TableEntry()
+            table_entry.table_id = installed.table_id
+            table_entry.match.extend(installed.match)
+            table_entry.priority = installed.priority
+            self.writer.delete(sw, table_entry)
+        self.inserted[sw.name] = inserted
+        self.modified[sw.name] = modified
+        self.deleted[sw.name] = len(current)
+        self.unchanged[sw.name] = unchanged
+
+
+def printReconcileSummary(reconciler, errors):
+    """
+    Prints the updates sent per switch, then the errors.
+
+    :param reconciler: the Reconciler
+    :param errors: the list of UpdateError returned by reconciler.flush()
+    """
+    for sw_name in reconciler.unchanged:
+        print("Reconciled %s: %d inserted, %d modified, %d deleted, %d unchanged" % (
+            sw_name, reconciler.inserted[sw_name], reconciler.modified[sw_name],
+            reconciler.deleted[sw_name], reconciler.unchanged[sw_name]))
+    printWriteErrors(errors)
@@ -0,0 +1,198 @@
+"""
+P4Runtime request latency.
+P4Runtime 请求统计：按交换机和请求类型计数、记录失败与延迟，无需 Prometheus 端点即可打印 p50、p99 和最大值
+
+RpcStats is a gRPC client interceptor installed on a switch connection
+(connection.ControllerConnection.addInterceptor). It counts the requests
+per method, the failed ones per method and status code, and records the
+latency of each in a latency.LatencyHistogram. RpcLatencies holds the
+RpcStats of every switch of a controller and reports them on demand
+(summary(), printReport()) or at close() with --rpc-latency:
+
+    latencies = RpcLatencies(print_at_close=True)
+    latencies.attach(s1)
+    ...
+    latencies.close()
+
+metrics.MetricsExporter publishes the RpcStats of an RpcLatencies as the
+p4runtime_* metrics; the two can be used together or apart.
+"""
+import threading
+import time
+from collections import namedtuple
+
+import grpc
+
+from .connection import INTERCEPTOR_RPC_STATS
+from .latency import LatencyHistogram, printLatencies
+
+# One line of the report, durations in seconds
+LatencySummary = namedtuple('LatencySummary', ['switch', 'method', 'requests', 'errors',
+                                               'p50', 'p99', 'max'])
+
+
+def _methodName(method, request):
+    method = method.rsplit('/', 1)[-1]
+    if method == 'Read' and not isinstance(request, bytes) and request.entities:
+        # ReadTableEntries and ReadCounters are told apart by what they read
+        method = 'Read/%s' % request.entities[0].WhichOneof('entity')
+    return method
+
+
+class RpcStats(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+    """
+    Counts the requests of a channel per method, and the failed ones per
+    method and status code, and records their latency per method. The Read
+    requests are told apart by the type of their first entity, e.g.
+    Read/table_entry and Read/counter_entry.
+    """
+
+    def __init__(self):
+        # method -> number of requests
+        self.requests = {}
+        # (method, status code name) -> number of failed requests
+        self.errors = {}
+        # method -> LatencyHistogram, from the request to the status of the
+        # response (the last response of a stream)
+        self.latencies = {}
+        self._lock = threading.Lock()
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        return self._track(_methodName(client_call_details.method, request),
+                           time.perf_counter(), continuation(client_call_details, request))
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        return self._track(_methodName(client_call_details.method, request),
+                           time.perf_counter(), continuation(client_call_details, request))
+
+    def _track(self, method, start, call):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+        # called at once for a blocking request, at the end of the
+        # responses for a stream
+        call.add_done_callback(lambda call: self._done(method, start, call))
+        return call
+
+    def _done(self, method, start, call):
+        elapsed = time.perf_counter() - start
+        code = call.code()
+        with self._lock:
+            histogram = self.latencies.get(method)
+            if histogram is None:
+                histogram = self.latencies[method] = LatencyHistogram()
+            histogram.record(elapsed)
+            if code is not None and code != grpc.StatusCode.OK:
+                key = (method, code.name)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def reset(self):
+        """Forgets the requests counted so far."""
+        with self._lock:
+            self.requests.clear()
+            self.errors.clear()
+            self.latencies.clear()
+
+    def snapshot(self):
+        """
+        :return: (copy of requests, copy of errors, copy of latencies)
+        """
+        with self._lock:
+            return (dict(self.requests), dict(self.errors),
+                    dict((method, histogram.copy())
+                         for method, histogram in self.latencies.items()))
+
+
+def instrumentSwitch(sw):
+    """
+    Counts and times the requests of a switch connection.
+
+    :param sw: the switch connection, a ControllerConnection
+    :return: the RpcStats
+    """
+    stats = RpcStats()
+    sw.addInterceptor(stats, INTERCEPTOR_RPC_STATS)
+    return stats
+
+
+class RpcLatencies(object):
+    """
+    The RpcStats of the switches of a controller.
+    """
+
+    def __init__(self, print_at_close=False):
+        """
+        :param print_at_close: print the report at close()
+        """
+        self.print_at_close = print_at_close
+        # switch name -> RpcStats
+        self.stats = {}
+
+    @classmethod
+    def fromArgs(cls, args):
+        """
+        :param args: the arguments parsed with addRpcLatencyArguments
+        """
+        return cls(args.rpc_latency)
+
+    def attach(self, sw):
+        """
+        Counts and times the requests of a switch connection, once however
+        many times it is attached.
+
+        :return: the RpcStats of the switch
+        """
+        stats = self.stats.get(sw.name)
+        if stats is None:
+            stats = self.stats[sw.name] = instrumentSwitch(sw)
+        return stats
+
+    def latencies(self):
+        """
+        :return: dict of (switch name, method) -> LatencyHistogram, a copy
+                 of the latencies recorded so far
+        """
+        histograms = {}
+        for name, stats in self.stats.items():
+            for method, histogram in stats.snapshot()[2].items():
+                histograms[(name, method)] = histogram
+        return histograms
+
+    def summary(self):
+        """
+        :return: list of LatencySummary, by switch and method
+        """
+        lines = []
+        for name, stats in sorted(self.stats.items()):
+            requests, errors, latencies = stats.snapshot()
+            for method, histogram in sorted(latencies.items()):
+                failed = sum(count for (m, _), count in errors.items() if m == method)
+                lines.append(LatencySummary(name, method, requests.get(method, 0), failed,
+                                            histogram.percentile(50), histogram.percentile(99),
+                                            histogram.max))
+        return lines
+
+    def printReport(self):
+        """
+        Prints the number of requests, p50, p99 and max per switch and
+        method.
+        """
+        print('\n----- P4Runtime request latency -----')
+        printLatencies(self.latencies())
+
+    def close(self):
+        """
+        Prints the report, once, if asked to at creation.
+        """
+        if self.print_at_close:
+            self.print_at_close = False
+            self.printReport()
+
+
+def addRpcLatencyArguments(parser):
+    """
+    Adds --rpc-latency.
+    """
+    parser.add_argument('--rpc-latency',
+                        help='print p50, p99 and max latency of the P4Runtime requests '
+                             'per switch and method at exit',
+                        action="store_true", required=False, default=False)
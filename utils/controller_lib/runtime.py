@@ -0,0 +1,340 @@
+"""
+Runtime JSON loader.
+运行时 JSON 文件加载：流式读取表项（允许 // 注释），按 P4Info 校验，并行批量下发到多台交换机
+
+Reads the sN-runtime.json format of the P4 tutorials:
+
+    {
+        "target": "bmv2",
+        "p4info": "build/basic.p4.p4info.txt",
+        "bmv2_json": "build/basic.json",
+        "table_entries": [
+            {"table": "MyIngress.ipv4_lpm", "match": {"hdr.ipv4.dstAddr": ["10.0.1.1", 32]},
+             "action_name": "MyIngress.ipv4_forward",
+             "action_params": {"dstAddr": "08:00:00:00:01:11", "port": 1}},
+            ...
+        ]
+    }
+
+// comments are ignored. The file is read a few lines at a time and the
+table entries are decoded one at a time, so a file of any size is loaded
+in constant memory; entries with the same table, match fields, action and
+params are checked against the P4Info only once. Only table_entries is
+installed; the keys after it (e.g. multicast_group_entries) are not read.
+
+applyRuntimeFiles builds and serializes the Update messages in the calling
+thread, once per file, and hands them, batch by batch, to one writer thread
+per switch, so the switches receive their first WriteRequests while the
+rest of the file is still being decoded. The writers of the switches given
+the same file share the serialized bytes, which none of them can modify.
+"""
+import json
+import re
+import threading
+import time
+from collections import namedtuple
+from queue import Queue
+
+import grpc
+from p4.config.v1 import p4info_pb2
+from p4.v1 import p4runtime_pb2
+
+from .batch import DEFAULT_BATCH_SIZE, BatchWriter, printWriteErrors
+
+_WHITESPACE = re.compile(r'\s*')
+# what precedes a comment: anything but quotes and //, and JSON strings,
+# escapes included
+_BEFORE_COMMENT = re.compile(r'[^"/]*(?:(?:"[^"\\]*(?:\\.[^"\\]*)*"|/(?!/))[^"/]*)*')
+# characters read from a runtime file at a time
+_READ_SIZE = 1 << 16
+
+_PRIORITY_MATCH_TYPES = (p4info_pb2.MatchField.TERNARY, p4info_pb2.MatchField.RANGE,
+                         p4info_pb2.MatchField.OPTIONAL)
+
+# Outcome of applying a runtime file to one switch.
+# switch: the switch name, path: the runtime file, entries: number of table
+# entries queued, written/existing: as counted by BatchWriter, errors: the
+# list of UpdateError, error: None, or why the switch stopped being written
+RuntimeResult = namedtuple('RuntimeResult', ['switch', 'path', 'entries', 'written',
+                                             'existing', 'errors', 'error', 'elapsed'])
+
+
+def _stripComments(text):
+    lines = text.split('\n')
+    for number, line in enumerate(lines):
+        if '//' in line:
+            end = _BEFORE_COMMENT.match(line).end()
+            if line.startswith('//', end):
+                lines[number] = line[:end]
+    return '\n'.join(lines)
+
+
+class RuntimeFile(object):
+    """
+    A runtime JSON file. `header` holds the top-level keys found before
+    table_entries (target, p4info, bmv2_json, ...).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._decoder = json.JSONDecoder()
+        with open(path) as f:
+            self.header = self._readHeader(f)[0]
+
+    def entries(self):
+        """
+        Yields the table entries one by one, as dicts, reading the file as
+        they are consumed.
+        """
+        with open(self.path) as f:
+            pos = self._readHeader(f)[1]
+            if pos is None:
+                return
+            while self._peek(pos) != ']':
+                entry, pos = self._decode(pos)
+                yield entry
+                pos = self._compact(self._next(pos, ']'))
+
+    def _readHeader(self, f):
+        # the header, and the position of the first table entry or None
+        self._file = f
+        self._text = ''
+        self._offset = 0
+        self._eof = False
+        header = {}
+        pos = self._expect('{', 0)
+        while self._peek(pos) != '}':
+            key, pos = self._decode(pos)
+            pos = self._expect(':', pos)
+            if key == 'table_entries':
+                return header, self._expect('[', pos)
+            header[key], pos = self._decode(pos)
+            pos = self._next(pos, '}')
+        return header, None
+
+    def _read(self):
+        # appends the next lines of the file, comments stripped; False at
+        # the end of the file
+        if self._eof:
+            return False
+        lines = self._file.readlines(_READ_SIZE)
+        if not lines:
+            self._eof = True
+            return False
+        self._text += _stripComments(''.join(lines))
+        return True
+
+    def _compact(self, pos):
+        # drops the text already decoded; positions are relative to _offset
+        if pos >= _READ_SIZE:
+            self._text = self._text[pos:]
+            self._offset += pos
+            pos = 0
+        return pos
+
+    def _peek(self, pos):
+        while pos >= len(self._text) and self._read():
+            pass
+        return self._text[pos:pos + 1]
+
+    def _decode(self, pos):
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._text, pos)
+            except json.JSONDecodeError as e:
+                if self._read():
+                    continue
+                raise ValueError("%s: %s at offset %d" % (self.path, e.msg, self._offset + e.pos))
+            # a number could go on in the lines not read yet
+            if end < len(self._text) or not self._read():
+                return value, end
+
+    def _next(self, pos, end):
+        # skips the ',' after a value, if it is not the last one
+        pos = self._skip(pos)
+        if self._peek(pos) == ',':
+            return self._skip(pos + 1)
+        if self._peek(pos) != end:
+            raise ValueError("%s: expected ',' or %r at offset %d" % (
+                self.path, end, self._offset + pos))
+        return pos
+
+    def _skip(self, pos):
+        while True:
+            pos = _WHITESPACE.match(self._text, pos).end()
+            if pos < len(self._text) or not self._read():
+                return pos
+
+    def _expect(self, char, pos):
+        pos = self._skip(pos)
+        if self._peek(pos) != char:
+            raise ValueError("%s: expected %r at offset %d" % (self.path, char, self._offset + pos))
+        return self._skip(pos + 1)
+
+
+class RuntimeEntryBuilder(object):
+    """
+    Checks runtime file entries against the P4Info and builds the Update
+    messages installing them.
+    """
+
+    def __init__(self, p4info_helper):
+        self.p4info_helper = p4info_helper
+        self._checked = set()
+
+    def build(self, entry):
+        """
+        :param entry: a dict from RuntimeFile.entries()
+        :return: the p4runtime Update installing the entry
+        """
+        default_action = entry.get('default_action', False)
+        match_fields = entry.get('match')
+        action_params = entry.get('action_params')
+        signature = (entry.get('table'), default_action,
+                     tuple(sorted(match_fields or ())), entry.get('action_name'),
+                     tuple(sorted(action_params or ())), 'priority' in entry)
+        if signature not in self._checked:
+            self._check(entry)
+            self._checked.add(signature)
+        table_entry = self.p4info_helper.buildTableEntry(
+            table_name=entry['table'],
+            match_fields=match_fields,
+            default_action=default_action,
+            action_name=entry['action_name'],
+            action_params=action_params,
+            priority=entry.get('priority'))
+        # same update type as BatchWriter.add
+        update = p4runtime_pb2.Update()
+        update.type = (p4runtime_pb2.Update.MODIFY if default_action
+                       else p4runtime_pb2.Update.INSERT)
+        update.entity.table_entry.CopyFrom(table_entry)
+        return update
+
+    def _check(self, entry):
+        helper = self.p4info_helper
+        for key in ('table', 'action_name'):
+            if key not in entry:
+                raise ValueError("missing %r" % key)
+        table = helper.get('tables', name=entry['table'])
+        match_types = [helper.get_match_field(entry['table'], name=name).match_type
+                       for name in entry.get('match') or ()]
+        action = helper.get('actions', name=entry['action_name'])
+        if action.preamble.id not in [ref.id for ref in table.action_refs]:
+            raise ValueError("action %s is not an action of table %s" % (
+                entry['action_name'], entry['table']))
+        params = set(entry.get('action_params') or ())
+        expected = set(p.name for p in action.params)
+        if params != expected:
+            raise ValueError("action %s takes params %s, got %s" % (
+                entry['action_name'], sorted(expected), sorted(params)))
+        if entry.get('default_action'):
+            if entry.get('match'):
+                raise ValueError("a default action entry has no match")
+        elif any(t in _PRIORITY_MATCH_TYPES for t in match_types) and 'priority' not in entry:
+            raise ValueError("table %s needs a priority" % entry['table'])
+
+
+def _writeLoop(assignment, sw, path, queue, batch_size, skip_existing, results):
+    start = time.time()
+    writer = BatchWriter(batch_size=batch_size, skip_existing=skip_existing)
+    entries = 0
+    error = None
+    while True:
+        chunk = queue.get()
+        if chunk is None:
+            break
+        if error is not None:
+            # keep draining so that the loader never blocks on this switch
+            continue
+        try:
+            for update in chunk:
+                writer.queueUpdate(sw, update)
+            entries += len(chunk)
+        except grpc.RpcError as e:
+            error = "%s (%s)" % (e.details(), e.code().name)
+    errors = []
+    if error is None:
+        try:
+            errors = writer.flush()
+        except grpc.RpcError as e:
+            error = "%s (%s)" % (e.details(), e.code().name)
+    results[assignment] = RuntimeResult(sw.name, path, entries, writer.written.get(sw.name, 0),
+                                writer.existing.get(sw.name, 0), errors, error,
+                                time.time() - start)
+
+
+def applyRuntimeFiles(p4info_helper, assignments, batch_size=DEFAULT_BATCH_SIZE,
+                      skip_existing=False):
+    """
+    Installs the table entries of runtime files on switches.
+
+    :param p4info_helper: the P4Info helper of the program the switches run
+    :param assignments: list of (switch connection, runtime file path); a
+                        file given for several switches is decoded once, a
+                        switch given several files gets them one writer each
+    :param batch_size: max number of updates per WriteRequest
+    :param skip_existing: as in BatchWriter
+    :return: the list of RuntimeResult, in the order of assignments
+    :raises ValueError: if an entry does not match the P4Info; the entries
+                        of the file already queued are still installed
+    """
+    # path -> indexes in assignments; the queues and results are kept per
+    # assignment, the same switch may be given several files
+    by_path = {}
+    for assignment, (sw, path) in enumerate(assignments):
+        by_path.setdefault(path, []).append(assignment)
+    results = {}
+    queues = []
+    threads = []
+    for assignment, (sw, path) in enumerate(assignments):
+        # bounded, so that decoding waits for the slowest switch
+        queues.append(Queue(maxsize=16))
+        thread = threading.Thread(target=_writeLoop,
+                                  args=(assignment, sw, path, queues[assignment], batch_size,
+                                        skip_existing, results))
+        thread.start()
+        threads.append(thread)
+    builder = RuntimeEntryBuilder(p4info_helper)
+    try:
+        for path, targets in by_path.items():
+            chunk = []
+            for number, entry in enumerate(RuntimeFile(path).entries()):
+                try:
+                    # serialized once for all the switches given the file
+                    chunk.append(builder.build(entry).SerializeToString())
+                except Exception as e:
+                    raise ValueError("%s: table entry %d: %s" % (path, number, e))
+                if len(chunk) == batch_size:
+                    for assignment in targets:
+                        queues[assignment].put(chunk)
+                    chunk = []
+            if chunk:
+                for assignment in targets:
+                    queues[assignment].put(chunk)
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+    return [results[assignment] for assignment in range(len(assignments))]
+
+
+def printRuntimeResults(results):
+    """
+    Prints one line per switch, then the rejected updates.
+
+    :param results: the list of RuntimeResult returned by applyRuntimeFiles
+    :return: True if every entry was installed
+    """
+    for result in results:
+        if result.error is not None:
+            print("Failed to install %s on %s: %s" % (result.path, result.switch, result.error))
+            continue
+        line = "Installed %d rules from %s on %s (%.3fs)" % (
+            result.written, result.path, result.switch, result.elapsed)
+        if result.existing:
+            line += " (%d already installed)" % result.existing
+        print(line)
+    for result in results:
+        printWriteErrors(result.errors)
+    return all(result.error is None and not result.errors for result in results)
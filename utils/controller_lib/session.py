@@ -0,0 +1,190 @@
+"""
+Controller session.
+控制器会话：统一建立交换机连接、初始化交换机、下发规则并在退出时按顺序关闭，各练习的控制器只保留自己的规则
+
+Every controller connects to its switches with the proto dumps, the
+request latencies and the metrics attached, brings them up, writes its
+rules with a BatchWriter (or a Reconciler with --reconcile), then on
+Ctrl-C or a gRPC error closes the metrics, the latency report, the
+runtime, the switch connections and the dumps, in this order.
+ControllerSession does all of that, so that a controller only builds its
+rules:
+
+    session = ControllerSession.fromArgs(args)    # addSessionArguments
+    with session:
+        s1 = session.connect('s1', '127.0.0.1:50051', 0)
+        if not session.bringUp(p4info_helper, bmv2_file_path):
+            return
+        writer = session.writer()
+        ...
+        session.flush(writer)
+        session.runtime.run()
+"""
+import grpc
+
+from p4runtime_lib.error_utils import printGrpcError
+
+from .aioruntime import SwitchRuntime
+from .batch import DEFAULT_BATCH_SIZE, BatchWriter, printWriteSummary
+from .bringup import bringUpSwitches, printBringUpResults
+from .connection import ControllerConnection
+from .metrics import MetricsExporter, addMetricsArguments
+from .protolog import ProtoDumps, addProtoDumpArguments
+from .reconcile import Reconciler, printReconcileSummary
+from .rpclatency import RpcLatencies, addRpcLatencyArguments
+
+
+class ControllerSession(object):
+    """
+    The switch connections of a controller and what is attached to them.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, skip_unchanged_pipeline=False,
+                 reconcile=False, proto_dumps=None, metrics=None, rpc_latencies=None):
+        """
+        :param batch_size: max number of updates per WriteRequest
+        :param skip_unchanged_pipeline: leave alone the switches already
+                                        running the program, and their rules
+        :param reconcile: only write the difference with the installed rules
+                          (implies skip_unchanged_pipeline)
+        :param proto_dumps: the protolog.ProtoDumps, none by default
+        :param metrics: the metrics.MetricsExporter, none by default
+        :param rpc_latencies: the rpclatency.RpcLatencies, the one of the
+                              metrics by default
+        """
+        self.batch_size = batch_size
+        self.skip_unchanged_pipeline = skip_unchanged_pipeline or reconcile
+        self.reconcile = reconcile
+        self.proto_dumps = proto_dumps if proto_dumps is not None else ProtoDumps('none')
+        self.metrics = metrics if metrics is not None else MetricsExporter()
+        self.rpc_latencies = (rpc_latencies if rpc_latencies is not None
+                              else self.metrics.rpc_latencies)
+        self.switches = []
+        # the aioruntime.SwitchRuntime after bringUp(), if any
+        self.runtime = None
+
+    @classmethod
+    def fromArgs(cls, args):
+        """
+        :param args: the arguments parsed with addSessionArguments
+        """
+        rpc_latencies = RpcLatencies.fromArgs(args)
+        return cls(args.batch_size, args.skip_unchanged_pipeline,
+                   getattr(args, 'reconcile', False), ProtoDumps.fromArgs(args),
+                   MetricsExporter.fromArgs(args, rpc_latencies), rpc_latencies)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        handled = False
+        if exc_type is KeyboardInterrupt:
+            print(" Shutting down.")
+            handled = True
+        elif exc_type is not None and issubclass(exc_type, grpc.RpcError):
+            printGrpcError(exc_value)
+            handled = True
+        self.close()
+        return handled
+
+    def connect(self, name, address, device_id):
+        """
+        Creates the connection of a switch, its requests dumped to
+        logs/<name>-p4runtime-requests.txt if enabled, and counted and
+        timed for the metrics or the latency report.
+
+        :return: the ControllerConnection
+        """
+        sw = ControllerConnection(name=name, address=address, device_id=device_id)
+        self.proto_dumps.attach(sw, 'logs/%s-p4runtime-requests.txt' % name)
+        self.metrics.attach(sw)
+        if self.rpc_latencies.print_at_close:
+            self.rpc_latencies.attach(sw)
+        self.switches.append(sw)
+        return sw
+
+    def bringUp(self, p4info_helper, bmv2_json_file_path, runtime=True):
+        """
+        Arbitrates and installs the program on the connected switches, all
+        concurrently, prints the outcome, then starts the metrics.
+
+        :param runtime: arbitrate on the StreamChannels of a new
+                        aioruntime.SwitchRuntime, self.runtime; otherwise
+                        with bringup.bringUpSwitches, no stream being read
+        :return: True if every switch was brought up
+        """
+        if runtime:
+            self.runtime = SwitchRuntime(self.switches)
+            results = self.runtime.bringUp(p4info_helper.p4info, bmv2_json_file_path,
+                                           skip_unchanged=self.skip_unchanged_pipeline)
+        else:
+            results = bringUpSwitches(self.switches, p4info_helper.p4info, bmv2_json_file_path,
+                                      skip_unchanged=self.skip_unchanged_pipeline)
+        if not printBringUpResults(results):
+            return False
+        self.metrics.start(p4info_helper, self.runtime, self.proto_dumps)
+        return True
+
+    def writer(self):
+        """
+        :return: a Reconciler with reconcile; otherwise a BatchWriter that
+                 skips the rules a switch kept with its pipeline
+        """
+        if self.reconcile:
+            return Reconciler(batch_size=self.batch_size)
+        return BatchWriter(batch_size=self.batch_size,
+                           skip_existing=self.skip_unchanged_pipeline)
+
+    def flush(self, writer):
+        """
+        Sends the rules queued in a writer of writer() and prints the
+        summary. With a runtime the writes run on its worker thread, not
+        interleaved with the event handlers.
+
+        :return: the list of batch.WriteError
+        """
+        if self.runtime is not None:
+            errors = self.runtime.execute(writer.flush)
+        else:
+            errors = writer.flush()
+        if isinstance(writer, Reconciler):
+            printReconcileSummary(writer, errors)
+        else:
+            printWriteSummary(writer, errors)
+        return errors
+
+    def close(self):
+        """
+        Stops the metrics, prints the latency report if asked to, stops
+        the runtime, shuts the switch connections down, then writes what is
+        left of the proto dumps.
+        """
+        self.metrics.close()
+        self.rpc_latencies.close()
+        if self.runtime is not None:
+            self.runtime.close()
+        for sw in self.switches:
+            sw.shutdown()
+        self.proto_dumps.close()
+
+
+def addSessionArguments(parser, reconcile=True):
+    """
+    Adds --batch-size, --skip-unchanged-pipeline, --reconcile (unless
+    reconcile is False) and the arguments of the proto dumps, of the
+    metrics and of the latency report.
+    """
+    parser.add_argument('--batch-size', help='max number of updates per WriteRequest',
+                        type=int, action="store", required=False,
+                        default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--skip-unchanged-pipeline',
+                        help='do not reinstall the P4 program on switches already running it',
+                        action="store_true", required=False, default=False)
+    if reconcile:
+        parser.add_argument('--reconcile',
+                            help='only write the difference with the rules installed on the '
+                                 'switches (implies --skip-unchanged-pipeline)',
+                            action="store_true", required=False, default=False)
+    addProtoDumpArguments(parser)
+    addMetricsArguments(parser)
+    addRpcLatencyArguments(parser)
@@ -0,0 +1,283 @@
+"""
+Topology-driven route compiler.
+由拓扑描述自动生成各交换机的 ipv4_lpm 转发表项，取代手写的规则列表
+
+Topology reads the topology.json format of the P4 tutorials:
+
+    {
+        "hosts": {"h1": {"ip": "10.0.1.1/24", "mac": "08:00:00:00:01:11"}, ...},
+        "switches": {"s1": {}, ...},
+        "links": [["h1", "s1-p1"], ["s1-p2", "s2-p2"], ...]
+    }
+
+A switch entry may set "mac" and "swid"; they default to the convention
+of the exercises, 08:00:00:00:0N:00 and N for switch sN. Its other keys
+(e.g. "firewall", see portpolicy) are kept with the switch.
+
+RouteCompiler computes one shortest-path tree per switch with hosts (BFS,
+every link costs 1) and turns it into one /32 Route per host and switch.
+Trees and routes are cached: after a link change, only the trees in which
+the link is or becomes part of a shortest path are recomputed, and after a
+host change only the routes towards the switch of that host.
+"""
+import json
+import re
+from collections import OrderedDict, deque, namedtuple
+
+# One host attached to a switch port
+Host = namedtuple('Host', ['name', 'ip', 'mac', 'switch', 'port'])
+
+# One ipv4_lpm entry: on switch, send packets to dst_prefix, an
+# (ip, prefix length) tuple, out of port with dst_mac as destination MAC
+# (the host itself on its switch, the next switch otherwise)
+Route = namedtuple('Route', ['switch', 'dst_prefix', 'dst_mac', 'port'])
+
+_SWITCH_PORT = re.compile(r'^(.+)-p(\d+)$')
+
+
+class Topology(object):
+    """
+    Switches, hosts and the links between them.
+
+    Every change is appended to `changes`, which RouteCompiler consumes to
+    know which cached paths to recompute.
+    """
+
+    def __init__(self):
+        # switch name -> {'mac': ..., 'swid': ..., other attributes}
+        self.switches = OrderedDict()
+        # host name -> Host
+        self.hosts = OrderedDict()
+        # switch name -> {port: (peer switch, peer port)}
+        self.ports = {}
+        self.changes = []
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a topology.json file.
+
+        :param path: the path of the file
+        :return: a Topology
+        """
+        with open(path) as f:
+            return cls.fromDict(json.load(f))
+
+    @classmethod
+    def fromDict(cls, topo):
+        self = cls()
+        for name, params in topo['switches'].items():
+            params = dict(params)
+            self.addSwitch(name, mac=params.pop('mac', None), swid=params.pop('swid', None),
+                           **params)
+        attached = {}
+        for link in topo['links']:
+            # a link may carry latency and bandwidth after its two ends
+            end1, end2 = link[0], link[1]
+            if end1 in topo['hosts'] or end2 in topo['hosts']:
+                host, end = (end1, end2) if end1 in topo['hosts'] else (end2, end1)
+                attached[host] = _parseSwitchPort(end)
+            else:
+                sw1, port1 = _parseSwitchPort(end1)
+                sw2, port2 = _parseSwitchPort(end2)
+                self.addLink(sw1, port1, sw2, port2)
+        for name, params in topo['hosts'].items():
+            if name not in attached:
+                raise ValueError("Host %s is not linked to a switch" % name)
+            switch, port = attached[name]
+            self.addHost(name, params['ip'], params['mac'], switch, port)
+        return self
+
+    def addSwitch(self, name, mac=None, swid=None, **params):
+        """
+        :param params: other attributes of the switch, kept in its dict
+        """
+        if swid is None:
+            digits = re.search(r'\d+$', name)
+            if digits is None:
+                raise ValueError("Cannot derive the id of switch %s, set its swid" % name)
+            swid = int(digits.group())
+        if mac is None:
+            mac = "08:00:00:00:%02x:00" % swid
+        self.switches[name] = dict(params, mac=mac, swid=swid)
+        self.ports.setdefault(name, {})
+        self.changes.append(('switch', name))
+
+    def removeSwitch(self, name):
+        for port in list(self.ports[name]):
+            self.removeLink(name, port)
+        for host in [h for h in self.hosts.values() if h.switch == name]:
+            self.removeHost(host.name)
+        del self.switches[name]
+        del self.ports[name]
+        self.changes.append(('switch', name))
+
+    def addHost(self, name, ip, mac, switch, port):
+        """
+        :param ip: the host address, with or without a /prefix length
+        """
+        self._checkSwitch(switch)
+        if name in self.hosts:
+            self.removeHost(name)
+        self.hosts[name] = Host(name, ip.split('/')[0], mac, switch, port)
+        self.changes.append(('host', switch))
+
+    def removeHost(self, name):
+        host = self.hosts.pop(name)
+        self.changes.append(('host', host.switch))
+
+    def addLink(self, sw1, port1, sw2, port2):
+        self._checkSwitch(sw1)
+        self._checkSwitch(sw2)
+        self.ports[sw1][port1] = (sw2, port2)
+        self.ports[sw2][port2] = (sw1, port1)
+        self.changes.append(('link', sw1, sw2))
+
+    def removeLink(self, sw, port):
+        """Removes the link plugged into port of sw."""
+        peer, peer_port = self.ports[sw].pop(port)
+        del self.ports[peer][peer_port]
+        self.changes.append(('link', sw, peer))
+
+    def switchMac(self, name):
+        return self.switches[name]['mac']
+
+    def switchId(self, name):
+        return self.switches[name]['swid']
+
+    def _checkSwitch(self, name):
+        if name not in self.switches:
+            raise ValueError("Unknown switch %s" % name)
+
+
+def _parseSwitchPort(end):
+    match = _SWITCH_PORT.match(end)
+    if match is None:
+        raise ValueError("Expected a switch port like s1-p1, got %r" % end)
+    return match.group(1), int(match.group(2))
+
+
+class RouteCompiler(object):
+    """
+    Computes the routes of every switch towards every host, reusing the
+    paths of the previous compile() that the topology changes did not affect.
+
+    When a switch has several shortest next hops towards a host, the port
+    of the host picks one of them: the host on port n of its switch takes
+    the n-th next hop, in the order of the next switches in the topology,
+    modulo their number. The hosts of a switch are spread over the
+    equal-cost links as in the hand-written rules of pod-topo (s1 reaches
+    h3 through s3 and h4 through s4, s2 reaches h1 through s3 and h2
+    through s4), the same every time the routes are compiled, and without
+    reshuffling them when other hosts change.
+    """
+
+    def __init__(self, topo):
+        self.topo = topo
+        self._seen = 0
+        # destination switch -> (distance of every switch to it,
+        #                        switch -> [(position of the next switch,
+        #                                    port, MAC of the next switch)])
+        self._trees = {}
+        # destination switch -> list of Route towards its hosts
+        self._routes = {}
+
+    def compile(self):
+        """
+        :return: OrderedDict of switch name -> list of Route, for all switches
+        """
+        self._applyChanges()
+        hosts_at = {}
+        for host in self.topo.hosts.values():
+            hosts_at.setdefault(host.switch, []).append(host)
+        for dst in self.topo.switches:
+            if dst not in hosts_at:
+                # only the switches with hosts are destinations
+                self._trees.pop(dst, None)
+                self._routes[dst] = []
+                continue
+            if dst not in self._trees:
+                self._trees[dst] = self._shortestPaths(dst)
+                self._routes.pop(dst, None)
+            if dst not in self._routes:
+                self._routes[dst] = self._hostRoutes(dst, hosts_at[dst])
+        per_switch = OrderedDict((name, []) for name in self.topo.switches)
+        for dst in self.topo.switches:
+            for route in self._routes[dst]:
+                per_switch[route.switch].append(route)
+        return per_switch
+
+    def routesTo(self, hosts):
+        """
+        Computes the routes of every switch towards the given hosts only,
+        e.g. hosts that were just added, without recomputing the routes
+        towards the other hosts of their switches.
+
+        :param hosts: list of Host of the topology
+        :return: list of Route
+        """
+        self._applyChanges()
+        hosts_at = OrderedDict()
+        for host in hosts:
+            hosts_at.setdefault(host.switch, []).append(host)
+        routes = []
+        for dst, dst_hosts in hosts_at.items():
+            if dst not in self._trees:
+                self._trees[dst] = self._shortestPaths(dst)
+            routes.extend(self._hostRoutes(dst, dst_hosts))
+        return routes
+
+    def _applyChanges(self):
+        changes = self.topo.changes[self._seen:]
+        self._seen = len(self.topo.changes)
+        for change in changes:
+            if change[0] == 'switch':
+                self._trees.clear()
+                self._routes.clear()
+            elif change[0] == 'host':
+                self._routes.pop(change[1], None)
+            else:
+                _, sw1, sw2 = change
+                # a link between two switches at the same distance from dst
+                # is on no shortest path towards dst, before and after
+                for dst in list(self._trees):
+                    dist = self._trees[dst][0]
+                    if dist.get(sw1) != dist.get(sw2):
+                        del self._trees[dst]
+
+    def _shortestPaths(self, dst):
+        ports = self.topo.ports
+        switches = self.topo.switches
+        positions = dict((name, position) for position, name in enumerate(switches))
+        dist = {dst: 0}
+        next_hops = {}
+        queue = deque([dst])
+        while queue:
+            sw = queue.popleft()
+            d = dist[sw] + 1
+            mac = switches[sw]['mac']
+            # peer_port is the port of peer that leads back to sw
+            for peer, peer_port in ports[sw].values():
+                if peer not in dist:
+                    dist[peer] = d
+                    next_hops[peer] = [(positions[sw], peer_port, mac)]
+                    queue.append(peer)
+                elif dist[peer] == d:
+                    next_hops[peer].append((positions[sw], peer_port, mac))
+        for hops in next_hops.values():
+            if len(hops) > 1:
+                hops.sort()
+        return dist, next_hops
+
+    def _hostRoutes(self, dst, hosts):
+        next_hops = self._trees[dst][1].items()
+        routes = []
+        append = routes.append
+        for host in hosts:
+            prefix = (host.ip, 32)
+            append(Route(dst, prefix, host.mac, host.port))
+            pick = host.port - 1
+            for sw, hops in next_hops:
+                _, port, mac = hops[pick % len(hops)]
+                append(Route(sw, prefix, mac, port))
+        return routes
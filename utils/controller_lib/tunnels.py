@@ -0,0 +1,93 @@
+"""
+Full-mesh tunnel provisioning.
+自动建立全互联隧道：自动分配隧道ID，按最短路径在沿途每台交换机上安装转发规则
+
+TunnelProvisioner creates one tunnel from every switch to every host that
+is not attached to it, along the shortest paths of RouteCompiler. Tunnel
+IDs are allocated automatically and stay the same across calls to
+tunnels(), so that the counters indexed by tunnel ID keep their meaning;
+the IDs of tunnels that disappear are reused.
+"""
+import heapq
+from collections import namedtuple
+
+from .topology import RouteCompiler
+
+# One tunnel: the ingress switch encapsulates the packets to host (a
+# topology.Host) with tunnel_id, every switch of path, a list of
+# (switch name, output port), forwards them, and egress, the switch of
+# host, decapsulates them
+Tunnel = namedtuple('Tunnel', ['tunnel_id', 'ingress', 'egress', 'host', 'path'])
+
+
+class TunnelProvisioner(object):
+    """
+    Computes the tunnels of a full mesh over a Topology.
+    """
+
+    def __init__(self, topo, first_id=1, max_id=0xffff):
+        """
+        :param topo: the topology.Topology
+        :param first_id: the smallest tunnel ID to allocate
+        :param max_id: the largest tunnel ID, e.g. the size of the tunnel
+                       counters minus one
+        """
+        self.topo = topo
+        self.compiler = RouteCompiler(topo)
+        self.max_id = max_id
+        # (ingress switch, host name) -> tunnel ID
+        self._ids = {}
+        self._free = []
+        self._next_id = first_id
+
+    def tunnels(self):
+        """
+        :return: the list of Tunnel, sorted by tunnel ID
+        :raises ValueError: if there are more tunnels than tunnel IDs
+        """
+        routes = self.compiler.compile()
+        # (switch, host IP) -> output port towards the host
+        ports = {}
+        for switch_routes in routes.values():
+            for route in switch_routes:
+                ports[(route.switch, route.dst_prefix[0])] = route.port
+
+        wanted = []
+        for host in self.topo.hosts.values():
+            for ingress in self.topo.switches:
+                if ingress == host.switch:
+                    continue
+                path = self._path(ports, ingress, host)
+                if path is not None:
+                    wanted.append((ingress, host, path))
+
+        keys = set((ingress, host.name) for ingress, host, _ in wanted)
+        for key in [key for key in self._ids if key not in keys]:
+            heapq.heappush(self._free, self._ids.pop(key))
+        tunnels = []
+        for ingress, host, path in wanted:
+            tunnel_id = self._ids.get((ingress, host.name))
+            if tunnel_id is None:
+                tunnel_id = self._ids[(ingress, host.name)] = self._allocate()
+            tunnels.append(Tunnel(tunnel_id, ingress, host.switch, host, path))
+        tunnels.sort(key=lambda tunnel: tunnel.tunnel_id)
+        return tunnels
+
+    def _allocate(self):
+        if self._free:
+            return heapq.heappop(self._free)
+        if self._next_id > self.max_id:
+            raise ValueError("No tunnel ID left, the largest one is %d" % self.max_id)
+        self._next_id += 1
+        return self._next_id - 1
+
+    def _path(self, ports, ingress, host):
+        path = []
+        switch = ingress
+        while switch != host.switch:
+            port = ports.get((switch, host.ip))
+            if port is None or len(path) > len(self.topo.switches):
+                return None
+            path.append((switch, port))
+            switch = self.topo.ports[switch][port][0]
+        return path
@@ -0,0 +1,71 @@
+"""
+Protobuf wire format helpers.
+protobuf 线路格式的编码/解码辅助函数：在序列化后的字节上直接拼接或扫描字段，不必构建消息
+
+Building or parsing a large message is slow with the pure Python protobuf
+runtime. The modules that splice serialized fields into a request (batch,
+pipeline, connection) or scan a serialized response for a few fields
+(metrics, fakeswitch) share these helpers: varints, field tags and skipping a field
+of any wire type.
+"""
+
+WIRETYPE_VARINT = 0
+WIRETYPE_FIXED64 = 1
+WIRETYPE_LENGTH_DELIMITED = 2
+WIRETYPE_FIXED32 = 5
+
+
+def encodeVarint(value):
+    """
+    :param value: a non-negative integer
+    :return: its varint encoding
+    """
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decodeVarint(data, pos):
+    """
+    :param data: serialized bytes
+    :param pos: the offset of a varint in data
+    :return: (its value, the offset following it)
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def fieldKey(field_number, wire_type):
+    """
+    :return: the key (tag) of a field, as decoded by decodeVarint
+    """
+    return field_number << 3 | wire_type
+
+
+def skipField(data, pos, wire_type):
+    """
+    :param data: serialized bytes
+    :param pos: the offset of a field value, following its key
+    :param wire_type: the wire type of the field, key & 7
+    :return: the offset following the value
+    """
+    if wire_type == WIRETYPE_VARINT:
+        return decodeVarint(data, pos)[1]
+    if wire_type == WIRETYPE_FIXED64:
+        return pos + 8
+    if wire_type == WIRETYPE_LENGTH_DELIMITED:
+        length, pos = decodeVarint(data, pos)
+        return pos + length
+    if wire_type == WIRETYPE_FIXED32:
+        return pos + 4
+    raise ValueError("Unexpected wire type %d" % wire_type)
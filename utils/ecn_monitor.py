@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# ECN 标记率：解析抓包文件或实时接收的数据包，打印滑动窗口内各目的网段与各条流的 CE 比例
+#
+# Usage: ecn_monitor.py --pcap h2.pcap
+#        ecn_monitor.py --iface eth0 --bucket 0.5 --buckets 20
+# Live capture needs the right to open raw sockets (root, or CAP_NET_RAW).
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from controller_lib.capture import PcapFile, RawCapture
+from controller_lib.ecn import EcnAnalyzer, printEcnRatios
+
+
+def main(pcap_file_paths, iface, bucket, buckets, max_flows, path_prefix, flows,
+         interval, duration):
+    analyzer = EcnAnalyzer(bucket=bucket, buckets=buckets, max_flows=max_flows,
+                           path_prefix=path_prefix)
+    for path in pcap_file_paths:
+        pcap = PcapFile(path)
+        analyzer.add(pcap.data, pcap.offsets, pcap.lengths, pcap.times)
+        print("%s: %d packets" % (path, len(pcap)))
+    if pcap_file_paths:
+        # the window ends with the last packet of the captures
+        printEcnRatios(analyzer, flows)
+    if iface is None:
+        return
+    capture = RawCapture(iface)
+    try:
+        capture.run(analyzer.add, duration=duration,
+                    report=lambda: printEcnRatios(analyzer, flows), interval=interval)
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    capture.close()
+    printEcnRatios(analyzer, flows)
+    print("%d packets received" % capture.received)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CE marking ratios per path and per flow')
+    parser.add_argument('--pcap', help='pcap file to analyze',
+                        type=str, action="append", required=False, default=[])
+    parser.add_argument('--iface', help='interface to capture on after the pcap files',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--bucket', help='seconds per window bucket',
+                        type=float, action="store", required=False, default=1.0)
+    parser.add_argument('--buckets', help='buckets per window',
+                        type=int, action="store", required=False, default=10)
+    parser.add_argument('--max-flows', help='flows whose counts are kept',
+                        type=int, action="store", required=False, default=4096)
+    parser.add_argument('--path-prefix', help='destination prefix length of a path',
+                        type=int, action="store", required=False, default=24)
+    parser.add_argument('--flows', help='busiest flows to print',
+                        type=int, action="store", required=False, default=10)
+    parser.add_argument('--interval', help='seconds between two reports',
+                        type=float, action="store", required=False, default=1.0)
+    parser.add_argument('--duration', help='seconds to capture, forever by default',
+                        type=float, action="store", required=False, default=None)
+    args = parser.parse_args()
+
+    if not args.pcap and args.iface is None:
+        parser.print_help()
+        print("\nGive --pcap or --iface")
+        parser.exit(1)
+    for path in args.pcap:
+        if not os.path.exists(path):
+            parser.print_help()
+            print("\npcap file not found: %s" % path)
+            parser.exit(1)
+    try:
+        main(args.pcap, args.iface, args.bucket, args.buckets, args.max_flows,
+             args.path_prefix, args.flows, args.interval, args.duration)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
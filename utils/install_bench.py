@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# 下发吞吐基准：在进程内的替身交换机上运行各控制器的表项下发路径，扫描表项数、批量大小和交换机数，
+# 以 JSON 输出每秒表项数和 WriteRequest 延迟分布，并可与之前的结果比较以发现性能退化
+#
+# Usage: install_bench.py --entries 1000,10000 --batch-sizes 10,100,1000 --switches 1,4 \
+#            --output bench.json
+#        install_bench.py --output new.json --compare bench.json
+# The p4info files are looked up in the build/ directory of every controller
+# (run 'make' there first), or in --build-dir. The stand-in switches only
+# count the updates (controller_lib.fakeswitch with store=False), so the
+# time measured is the controller's: building the entries, serializing and
+# sending the WriteRequests.
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import socket
+import struct
+import sys
+import time
+from collections import OrderedDict, namedtuple
+
+import grpc
+from google.protobuf.internal import api_implementation
+from p4.v1 import p4runtime_pb2
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(UTILS_DIR)
+sys.path.append(UTILS_DIR)
+from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from controller_lib.batch import BatchWriter
+from controller_lib.connection import ControllerConnection
+from controller_lib.fakeswitch import startFakeSwitches
+from controller_lib.latency import LatencyHistogram
+from controller_lib.learning import HostLearner
+from controller_lib.rpclatency import instrumentSwitch
+from controller_lib.p4index import IndexedP4InfoHelper
+from controller_lib.qos import TRAFFIC_CLASSES
+from controller_lib.topology import Route, Topology
+
+# A write path: the controller whose functions it calls (relative to the
+# repository), the p4info file of its program, and prepare(module,
+# p4info_helper, switches, entries, batch_size) -> (number of entries,
+# install), install() doing the timed part and returning the write errors
+Workload = namedtuple('Workload', ['controller', 'p4info', 'prepare'])
+
+
+def _ip(i):
+    return socket.inet_ntoa(struct.pack('!I', 0x0a000000 + i + 1))
+
+
+def _mac(i):
+    return '08:00:%02x:%02x:%02x:%02x' % tuple(struct.pack('!I', i + 1))
+
+
+def prepareTunnels(module, p4info_helper, switches, entries, batch_size):
+    # writeTunnelRules installs 3 rules per tunnel, on 2 switches
+    tunnels = entries // 3
+
+    def install():
+        writer = BatchWriter(batch_size=batch_size)
+        for i in range(tunnels):
+            module.writeTunnelRules(p4info_helper, writer,
+                                    ingress_sw=switches[i % len(switches)],
+                                    egress_sw=switches[(i + 1) % len(switches)],
+                                    tunnel_id=i + 1, dst_eth_addr=_mac(i), dst_ip_addr=_ip(i))
+        return writer.flush()
+    return tunnels * 3, install
+
+
+def prepareRoutes(module, p4info_helper, switches, entries, batch_size):
+    def install():
+        writer = BatchWriter(batch_size=batch_size)
+        for i in range(entries):
+            module.writeipv4_lpm(p4info_helper, writer, ingress_sw=switches[i % len(switches)],
+                                 dst_eth_addr=_mac(i), dst_ip_addr=(_ip(i), 32),
+                                 switch_port=i % 4 + 1)
+        return writer.flush()
+    return entries, install
+
+
+def prepareQos(module, p4info_helper, switches, entries, batch_size):
+    classes = list(TRAFFIC_CLASSES.values())
+
+    def install():
+        writer = BatchWriter(batch_size=batch_size)
+        for i in range(entries):
+            sw = switches[i % len(switches)]
+            module.writeRules(p4info_helper, writer, sw,
+                              Route(sw.name, (_ip(i), 32), _mac(i), i % 4 + 1),
+                              classes[i % len(classes)])
+        return writer.flush()
+    return entries, install
+
+
+def prepareEcmp(module, p4info_helper, switches, entries, batch_size):
+    # one ecmp_group entry and one ecmp_nhop entry per slot
+    slots = module.DEFAULT_GROUP_SLOTS
+    groups = entries // (slots + 1)
+
+    def install():
+        # meta.ecmp_select is 14 bits wide
+        ecmp = module.EcmpManager(p4info_helper, table_size=1 << 14)
+        writer = BatchWriter(batch_size=batch_size)
+        for i in range(groups):
+            group = ecmp.addGroup(switches[i % len(switches)], (_ip(i), 32), slots=slots)
+            group.setMember(module.NextHop(_mac(2 * i), _ip(2 * i), 2))
+            group.setMember(module.NextHop(_mac(2 * i + 1), _ip(2 * i + 1), 3))
+        ecmp.sync(writer)
+        return writer.flush()
+    return groups * (slots + 1), install
+
+
+def prepareLearnedHosts(module, p4info_helper, switches, entries, batch_size):
+    # the switches in a line, linked by their ports 2 and 3, the hosts on
+    # their port 1; a host takes one route per switch and a learned_hosts
+    # entry
+    topo = Topology()
+    for sw in switches:
+        topo.addSwitch(sw.name)
+    for sw1, sw2 in zip(switches, switches[1:]):
+        topo.addLink(sw1.name, 2, sw2.name, 3)
+    learner = HostLearner(p4info_helper, topo, dict((sw.name, sw) for sw in switches),
+                          batch_size=batch_size)
+    hosts = entries // (len(switches) + 1)
+    digests = [p4runtime_pb2.DigestList(digest_id=learner.digest_id, list_id=i + 1)
+               for i in range(len(switches))]
+    for i in range(hosts):
+        members = digests[i % len(switches)].data.add().struct.members
+        members.add().bitstring = socket.inet_aton(_ip(i))
+        members.add().bitstring = bytes.fromhex(_mac(i).replace(':', ''))
+        members.add().bitstring = b'\x00\x01'
+    for sw, digest_list in zip(switches, digests):
+        learner.add(sw, digest_list)
+
+    def install():
+        return learner.flush()[1]
+    return hosts * (len(switches) + 1), install
+
+
+WORKLOADS = OrderedDict([
+    ('tunnel', Workload('第2次实践作业/mycontroller.py', 'advanced_tunnel.p4.p4info.txt',
+                        prepareTunnels)),
+    ('ipv4_lpm', Workload('第5次实践作业/提高题/firewall_mycontroller.py', 'firewall.p4.p4info.txt',
+                          prepareRoutes)),
+    ('qos', Workload('第4次实践作业/提高题/qos_mycontroller.py', 'qos.p4.p4info.txt', prepareQos)),
+    ('ecmp', Workload('第4次实践作业/提高题/load_balance_mycontroller.py',
+                      'load_balance.p4.p4info.txt', prepareEcmp)),
+    ('learned_hosts', Workload('第5次实践作业/提高题/firewall_mycontroller.py',
+                               'firewall.p4.p4info.txt', prepareLearnedHosts)),
+])
+
+
+def loadController(name, path):
+    """Imports a controller script as a module, without running its main()."""
+    spec = importlib.util.spec_from_file_location('bench_' + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(prepare, module, p4info_helper, fakes, switches, stats, entries, batch_size,
+            repeats, warmup):
+    """
+    Runs a write path warmup + repeats times against freshly reset switches.
+
+    :return: the result dict, see main()
+    """
+    times = []
+    latency = LatencyHistogram()
+    errors = 0
+    for run in range(warmup + repeats):
+        for fake in fakes:
+            fake.reset()
+        for switch_stats in stats:
+            switch_stats.reset()
+        written, install = prepare(module, p4info_helper, switches, entries, batch_size)
+        start = time.perf_counter()
+        failed = install()
+        elapsed = time.perf_counter() - start
+        received = sum(fake.updates for fake in fakes)
+        if received != written:
+            raise ValueError("%d entries written, the switches received %d" % (written, received))
+        if run < warmup:
+            continue
+        times.append(elapsed)
+        errors += len(failed)
+        for switch_stats in stats:
+            histogram = switch_stats.snapshot()[2].get('Write')
+            if histogram is not None:
+                latency.merge(histogram)
+    median = sorted(times)[len(times) // 2]
+    return OrderedDict([
+        ('entries', written),
+        ('batch_size', batch_size),
+        ('switches', len(switches)),
+        ('repeats', repeats),
+        ('seconds', times),
+        ('entries_per_s', written / median if median else 0.0),
+        ('best_entries_per_s', written / min(times) if min(times) else 0.0),
+        ('write_requests', latency.count // repeats),
+        ('write_latency_ms', OrderedDict([
+            ('p50', latency.percentile(50) * 1e3),
+            ('p99', latency.percentile(99) * 1e3),
+            ('max', latency.max * 1e3)])),
+        ('errors', errors),
+    ])
+
+
+def environment():
+    return OrderedDict([
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('python', platform.python_version()),
+        ('grpc', grpc.__version__),
+        ('protobuf_backend', api_implementation.Type()),
+        ('machine', platform.machine()),
+        ('cpus', os.cpu_count()),
+    ])
+
+
+def printResult(workload, result):
+    latency = result['write_latency_ms']
+    print("%-14s %7d entries  batch %5d  %d switches  %9.0f entries/s (best %9.0f)  "
+          "%5d writes  p50 %7.3f ms  p99 %7.3f ms  max %7.3f ms%s" % (
+              workload, result['entries'], result['batch_size'], result['switches'],
+              result['entries_per_s'], result['best_entries_per_s'], result['write_requests'],
+              latency['p50'], latency['p99'], latency['max'],
+              '  %d errors' % result['errors'] if result['errors'] else ''))
+
+
+def compareResults(baseline, results, threshold):
+    """
+    Prints the change of entries/s of every configuration measured in both.
+
+    :return: the number of configurations slower by more than threshold
+    """
+    def key(result):
+        return (result['workload'], result['entries'], result['batch_size'], result['switches'])
+
+    for name in ('python', 'protobuf_backend', 'machine', 'cpus'):
+        if baseline['environment'].get(name) != results['environment'].get(name):
+            print("Warning: %s differs from the baseline: %s, was %s" % (
+                name, results['environment'].get(name), baseline['environment'].get(name)))
+    before = dict((key(result), result) for result in baseline['results'])
+    regressions = 0
+    print('\n----- Compared with the baseline -----')
+    for result in results['results']:
+        old = before.get(key(result))
+        if old is None or not old['entries_per_s']:
+            continue
+        ratio = result['entries_per_s'] / old['entries_per_s']
+        slower = ratio < 1 - threshold
+        regressions += slower
+        print("%-14s %7d entries  batch %5d  %d switches  %9.0f -> %9.0f entries/s  %+6.1f%%%s" % (
+            key(result) + (old['entries_per_s'], result['entries_per_s'], (ratio - 1) * 100,
+                           '  REGRESSION' if slower else '')))
+    return regressions
+
+
+def parseList(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main(workloads, entry_counts, batch_sizes, switch_counts, repeats, warmup, build_dir,
+         output, compare, threshold):
+    fakes = startFakeSwitches(max(switch_counts), store=False)
+    switches = []
+    stats = []
+    for fake in fakes:
+        sw = ControllerConnection(
+            name='s%d' % (fake.device_id + 1),
+            address=fake.address,
+            device_id=fake.device_id)
+        stats.append(instrumentSwitch(sw))
+        switches.append(sw)
+
+    results = OrderedDict([('environment', environment()), ('results', [])])
+    try:
+        for name in workloads:
+            workload = WORKLOADS[name]
+            controller = os.path.join(REPO_DIR, workload.controller)
+            p4info = os.path.join(build_dir or os.path.join(os.path.dirname(controller), 'build'),
+                                  workload.p4info)
+            if not os.path.exists(p4info):
+                print("%-14s skipped, p4info file not found: %s" % (name, p4info))
+                continue
+            module = loadController(name, controller)
+            p4info_helper = IndexedP4InfoHelper(p4info)
+            for count in switch_counts:
+                for entries in entry_counts:
+                    for batch_size in batch_sizes:
+                        try:
+                            result = measure(workload.prepare, module, p4info_helper,
+                                             fakes[:count], switches[:count], stats[:count],
+                                             entries, batch_size, repeats, warmup)
+                        except ValueError as e:
+                            print("%-14s %7d entries  batch %5d  %d switches  skipped: %s" % (
+                                name, entries, batch_size, count, e))
+                            continue
+                        result['workload'] = name
+                        result.move_to_end('workload', last=False)
+                        results['results'].append(result)
+                        printResult(name, result)
+    finally:
+        ShutdownAllSwitchConnections()
+        for sw in switches:
+            sw.channel.close()
+        for fake in fakes:
+            fake.stop()
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Results written to %s" % output)
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)
+        regressions = compareResults(baseline, results, threshold)
+        if regressions:
+            print("%d configurations are more than %.0f%% slower than the baseline" % (
+                regressions, threshold * 100))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measures the rule installation of the controllers against stand-in switches')
+    parser.add_argument('--workloads', help='comma separated write paths: %s' % ', '.join(WORKLOADS),
+                        type=str, action="store", required=False, default=','.join(WORKLOADS))
+    parser.add_argument('--entries', help='comma separated numbers of entries to install',
+                        type=parseList, action="store", required=False, default='1000,5000')
+    parser.add_argument('--batch-sizes', help='comma separated max numbers of updates per '
+                                              'WriteRequest',
+                        type=parseList, action="store", required=False, default='10,100,1000')
+    parser.add_argument('--switches', help='comma separated numbers of switches',
+                        type=parseList, action="store", required=False, default='1,4')
+    parser.add_argument('--repeats', help='measured runs per configuration, the median is kept',
+                        type=int, action="store", required=False, default=3)
+    parser.add_argument('--warmup', help='runs per configuration before the measured ones',
+                        type=int, action="store", required=False, default=1)
+    parser.add_argument('--build-dir', help='directory of the p4info files, instead of the '
+                                            'build/ directory of every controller',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--output', help='JSON file the results are written to',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--compare', help='JSON file of earlier results to compare with; '
+                                          'exits with 1 on a regression',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--threshold', help='slowdown of the median entries/s counted as a regression; '
+                                            'runs of the same tree differ by up to 20%%',
+                        type=float, action="store", required=False, default=0.25)
+    args = parser.parse_args()
+
+    workloads = [name.strip() for name in args.workloads.split(',') if name.strip()]
+    for name in workloads:
+        if name not in WORKLOADS:
+            parser.error("unknown workload %s, expected some of %s" % (name, ', '.join(WORKLOADS)))
+    if args.repeats < 1:
+        parser.error("--repeats must be at least 1")
+    sys.exit(main(workloads, args.entries, args.batch_sizes, args.switches, args.repeats,
+                  args.warmup, args.build_dir, args.output, args.compare, args.threshold))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# 将运行时 JSON 文件（如 s1runtime.json、s1-acl.json）中的表项并行批量下发到交换机
+#
+# Usage: load_runtime.py s1=s1runtime.json s2=s2runtime.json
+# Switch sN is reached at 127.0.0.1:5005N with device id N-1, as in the
+# exercises. The p4info and BMv2 JSON files default to those named by the
+# first runtime file. With --metrics-port it keeps running afterwards and
+# serves the table entries and the --metrics-registers of the switches (e.g.
+# MyEgress.byte_cnt_reg of link_monitor.p4) until interrupted.
+import argparse
+import os
+import re
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from controller_lib.p4index import IndexedP4InfoHelper
+from controller_lib.runtime import RuntimeFile, applyRuntimeFiles, printRuntimeResults
+from controller_lib.session import ControllerSession, addSessionArguments
+
+
+def parseAssignment(arg):
+    match = re.match(r'^(s(\d+))=(.+)$', arg)
+    if match is None:
+        raise argparse.ArgumentTypeError("expected sN=FILE, got %r" % arg)
+    return match.group(1), int(match.group(2)), match.group(3)
+
+
+def main(assignments, p4info_file_path, bmv2_file_path, session):
+    p4info_helper = IndexedP4InfoHelper(p4info_file_path)
+
+    ok = False
+    with session:
+        switches = {}
+        for name, number, _ in assignments:
+            if name not in switches:
+                switches[name] = session.connect(name, '127.0.0.1:%d' % (50050 + number),
+                                                 number - 1)
+
+        # 不需要读取 StreamChannel，只做仲裁和安装程序
+        if not session.bringUp(p4info_helper, bmv2_file_path, runtime=False):
+            return 1
+
+        try:
+            results = applyRuntimeFiles(p4info_helper,
+                                        [(switches[name], path) for name, _, path in assignments],
+                                        batch_size=session.batch_size,
+                                        skip_existing=session.skip_unchanged_pipeline)
+        except ValueError as e:
+            print(e)
+            return 1
+        ok = printRuntimeResults(results)
+        if ok and session.metrics.enabled:
+            print("Serving metrics until interrupted")
+            session.metrics.wait()
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Installs runtime JSON files on switches')
+    parser.add_argument('assignments', help='switch and runtime file, e.g. s1=s1runtime.json',
+                        type=parseAssignment, nargs='+', metavar='sN=FILE')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
+                        type=str, action="store", required=False, default=None)
+    addSessionArguments(parser, reconcile=False)
+    args = parser.parse_args()
+
+    header = RuntimeFile(args.assignments[0][2]).header
+    p4info = args.p4info or header.get('p4info')
+    bmv2_json = args.bmv2_json or header.get('bmv2_json')
+    if not p4info or not os.path.exists(p4info):
+        parser.print_help()
+        print("\np4info file not found: %s\nHave you run 'make'?" % p4info)
+        parser.exit(1)
+    if not bmv2_json or not os.path.exists(bmv2_json):
+        parser.print_help()
+        print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % bmv2_json)
+        parser.exit(1)
+    sys.exit(main(args.assignments, p4info, bmv2_json, ControllerSession.fromArgs(args)))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# MRI 遥测：解析抓包文件或实时接收的数据包中的 swtrace，打印各交换机每一跳队列深度的分位数
+#
+# Usage: mri_monitor.py --pcap h2.pcap
+#        mri_monitor.py --iface eth0 --interval 1
+# Live capture needs the right to open raw sockets (root, or CAP_NET_RAW).
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from controller_lib.capture import PcapFile, RawCapture
+from controller_lib.mri import QueueDepthWindows, decodeMri, printQueueDepths
+
+
+def main(pcap_file_paths, iface, window, interval, duration):
+    windows = QueueDepthWindows(window=window)
+    for path in pcap_file_paths:
+        pcap = PcapFile(path)
+        samples = decodeMri(pcap.data, pcap.offsets, pcap.lengths)
+        windows.add(samples)
+        print("%s: %d packets, %d switch traces" % (path, len(pcap), len(samples.swid)))
+    if pcap_file_paths:
+        printQueueDepths(windows)
+    if iface is None:
+        return
+    capture = RawCapture(iface)
+    try:
+        capture.run(lambda data, offsets, lengths, now:
+                    windows.add(decodeMri(data, offsets, lengths)),
+                    duration=duration, report=lambda: printQueueDepths(windows),
+                    interval=interval)
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    capture.close()
+    printQueueDepths(windows)
+    print("%d packets received" % capture.received)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Queue depth percentiles from MRI traces')
+    parser.add_argument('--pcap', help='pcap file to decode',
+                        type=str, action="append", required=False, default=[])
+    parser.add_argument('--iface', help='interface to capture on after the pcap files',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--window', help='samples kept per switch and hop',
+                        type=int, action="store", required=False, default=4096)
+    parser.add_argument('--interval', help='seconds between two reports',
+                        type=float, action="store", required=False, default=1.0)
+    parser.add_argument('--duration', help='seconds to capture, forever by default',
+                        type=float, action="store", required=False, default=None)
+    args = parser.parse_args()
+
+    if not args.pcap and args.iface is None:
+        parser.print_help()
+        print("\nGive --pcap or --iface")
+        parser.exit(1)
+    for path in args.pcap:
+        if not os.path.exists(path):
+            parser.print_help()
+            print("\npcap file not found: %s" % path)
+            parser.exit(1)
+    try:
+        main(args.pcap, args.iface, args.window, args.interval, args.duration)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# 链路监控：在主机上接收 link_monitor.p4 的探针，周期性打印每条链路的利用率
+#
+# Usage: probe_monitor.py --iface eth0 --interval 1
+# Needs the right to open raw sockets (root, or CAP_NET_RAW).
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from controller_lib.probes import LinkSeries, ProbeCollector
+
+
+def printUtilization(series, window):
+    means = series.mean(window)
+    for (swid, port), rate in series.latest().items():
+        print("Switch %d - Port %d: %.3f Mbps (mean of last %d: %.3f Mbps)" % (
+            swid, port, rate * 8e-6, window, means[(swid, port)] * 8e-6))
+    print('')
+
+
+def main(iface, interval, duration, history, window):
+    series = LinkSeries(history=history)
+    collector = ProbeCollector(iface, series)
+    try:
+        collector.run(duration=duration, interval=interval,
+                      report=lambda s: printUtilization(s, window))
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    collector.close()
+    print("%d probes received, %d invalid" % (collector.received, collector.invalid))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collects the probes of link_monitor.p4')
+    parser.add_argument('--iface', help='interface the probes arrive on',
+                        type=str, action="store", required=False, default='eth0')
+    parser.add_argument('--interval', help='seconds between two reports',
+                        type=float, action="store", required=False, default=1.0)
+    parser.add_argument('--duration', help='seconds to run, forever by default',
+                        type=float, action="store", required=False, default=None)
+    parser.add_argument('--history', help='samples kept per link',
+                        type=int, action="store", required=False, default=1024)
+    parser.add_argument('--window', help='samples averaged per link in the reports',
+                        type=int, action="store", required=False, default=10)
+    args = parser.parse_args()
+    main(args.iface, args.interval, args.duration, args.history, args.window)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# QoS 吞吐量：按 DSCP 统计抓包文件中各流量等级的包数、字节数与平均/峰值速率
+#
+# Usage: qos_report.py --pcap h2.pcap --interval 0.1
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from controller_lib.capture import PcapFile, decodeIpv4
+from controller_lib.qos import classThroughput, printClassThroughput
+
+
+def main(pcap_file_paths, interval):
+    for path in pcap_file_paths:
+        pcap = PcapFile(path)
+        packets = decodeIpv4(pcap.data, pcap.offsets, pcap.lengths)
+        print("%s: %d packets, %d IPv4" % (path, len(pcap), len(packets.packet)))
+        printClassThroughput(classThroughput(packets, pcap.times, interval))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput per DSCP class of pcap files')
+    parser.add_argument('--pcap', help='pcap file to analyze',
+                        type=str, action="append", required=False, default=[])
+    parser.add_argument('--interval', help='seconds over which the peak rate is measured',
+                        type=float, action="store", required=False, default=1.0)
+    args = parser.parse_args()
+
+    if not args.pcap:
+        parser.print_help()
+        print("\nGive --pcap")
+        parser.exit(1)
+    for path in args.pcap:
+        if not os.path.exists(path):
+            parser.print_help()
+            print("\npcap file not found: %s" % path)
+            parser.exit(1)
+    main(args.pcap, args.interval)
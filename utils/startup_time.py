@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# 控制器启动时间：分别在没有与已有 P4Info 二进制缓存时，测量新进程的导入与 P4Info 加载耗时
+#
+# Usage: startup_time.py --p4info build/firewall.p4.p4info.txt --runs 5
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# What a controller does before connecting to the switches; prints the
+# import and P4Info load times in seconds
+_CHILD = """
+import sys, time
+start = time.perf_counter()
+sys.path.append(%(utils)r)
+import grpc
+from controller_lib.batch import BatchWriter
+from controller_lib.bringup import bringUpSwitches
+from controller_lib.connection import ControllerConnection
+from controller_lib.p4index import IndexedP4InfoHelper
+from controller_lib.reconcile import Reconciler
+imported = time.perf_counter()
+IndexedP4InfoHelper(%(p4info)r, cache_dir=%(cache_dir)r)
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def measure(p4info_file_path, cache_dir):
+    """
+    Starts one process.
+
+    :return: (process time, import time, P4Info load time) in seconds
+    """
+    code = _CHILD % {'utils': UTILS_DIR, 'p4info': os.path.abspath(p4info_file_path),
+                     'cache_dir': cache_dir}
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, '-c', code])
+    total = time.perf_counter() - start
+    imported, loaded = (float(v) for v in output.split())
+    return total, imported, loaded
+
+
+def printTimes(label, times):
+    times = sorted(times)
+    total, imported, loaded = times[len(times) // 2]
+    print("%-5s process %7.1f ms, imports %7.1f ms, P4Info %7.2f ms (median of %d)" % (
+        label, total * 1e3, imported * 1e3, loaded * 1e3, len(times)))
+
+
+def main(p4info_file_path, runs):
+    cache_root = tempfile.mkdtemp(prefix='p4info-cache-')
+    try:
+        cold = []
+        for i in range(runs):
+            # a new empty cache every time
+            cold.append(measure(p4info_file_path, os.path.join(cache_root, str(i))))
+        warm = [measure(p4info_file_path, os.path.join(cache_root, '0')) for _ in range(runs)]
+    finally:
+        shutil.rmtree(cache_root)
+    printTimes("cold", cold)
+    printTimes("warm", warm)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Controller start time with and without '
+                                                 'the P4Info cache')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=True)
+    parser.add_argument('--runs', help='processes started per case',
+                        type=int, action="store", required=False, default=5)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.p4info):
+        parser.print_help()
+        print("\np4info file not found: %s\nHave you run 'make'?" % args.p4info)
+        parser.exit(1)
+    main(args.p4info, args.runs)
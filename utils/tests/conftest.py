@@ -0,0 +1,6 @@
+# 测试公共设置：把 utils/ 加入 sys.path，在仓库根目录运行 python -m pytest 即可导入 controller_lib
+# 和 P4 教程放在 utils/ 下的 p4runtime_lib；没有 p4runtime_lib 的测试模块用 pytest.importorskip 跳过
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,100 @@
+# BloomAger 在替身交换机上的回归检查：只清空上一代已置位的单元，再切换当前代
+# （没有 p4runtime_lib 时跳过）
+import pytest
+from p4.v1 import p4data_pb2
+
+pytest.importorskip('p4runtime_lib')
+from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from controller_lib.aging import BloomAger
+from controller_lib.connection import ControllerConnection
+from controller_lib.fakeswitch import FakeSwitch
+from controller_lib.p4index import IndexedP4InfoHelper
+
+# the registers of firewall.p4, two generations of 8 cells
+P4INFO = '''
+registers {
+  preamble { id: 1 name: "MyIngress.bloom_filter_1" alias: "bloom_filter_1" }
+  type_spec { bitstring { bit { bitwidth: 1 } } }
+  size: 16
+}
+registers {
+  preamble { id: 2 name: "MyIngress.bloom_filter_2" alias: "bloom_filter_2" }
+  type_spec { bitstring { bit { bitwidth: 1 } } }
+  size: 16
+}
+registers {
+  preamble { id: 3 name: "MyIngress.bloom_generation" alias: "bloom_generation" }
+  type_spec { bitstring { bit { bitwidth: 1 } } }
+  size: 1
+}
+'''
+
+
+@pytest.fixture
+def switches(tmp_path):
+    p4info_path = tmp_path / 'firewall.p4info.txt'
+    p4info_path.write_text(P4INFO)
+    helper = IndexedP4InfoHelper(str(p4info_path), cache_dir=None)
+    fakes = [FakeSwitch(device_id=i) for i in range(2)]
+    conns = [ControllerConnection(name='s%d' % (i + 1), address=fake.start(), device_id=i)
+             for i, fake in enumerate(fakes)]
+    yield helper, fakes, conns
+    ShutdownAllSwitchConnections()
+    for sw in conns:
+        sw.channel.close()
+    for fake in fakes:
+        fake.stop()
+
+
+def _set(fake, register_id, *indexes):
+    # bits set by the data plane
+    for index in indexes:
+        fake.registers.setdefault(register_id, {})[index] = p4data_pb2.P4Data(bitstring=b'\x01')
+
+
+def _setCells(fake, register_id):
+    return sorted(index for index, data in fake.registers.get(register_id, {}).items()
+                  if data.bitstring.strip(b'\x00'))
+
+
+def test_rotate_clears_only_the_set_cells(switches):
+    helper, fakes, conns = switches
+    ager = BloomAger(helper, conns)
+    assert ager.entries == 8
+    _set(fakes[0], 1, 1, 3, 9, 12)
+    _set(fakes[0], 2, 2, 15)
+    _set(fakes[1], 1, 4)
+
+    occupancy = ager.readOccupancy(conns[0])
+    assert occupancy.current == 0
+    assert occupancy.occupancy == [[2 / 8.0, 2 / 8.0], [1 / 8.0, 1 / 8.0]]
+
+    updates = [fake.updates for fake in fakes]
+    assert ager.rotate() == []
+    # the cells of generation 1 set on s1, and the generation of each switch
+    assert [fake.updates - before for fake, before in zip(fakes, updates)] == [3 + 1, 1]
+    assert _setCells(fakes[0], 1) == [1, 3]
+    assert _setCells(fakes[0], 2) == [2]
+    assert _setCells(fakes[1], 1) == [4]
+    assert [ager.current(sw) for sw in conns] == [1, 1]
+
+    updates = [fake.updates for fake in fakes]
+    assert ager.rotate() == []
+    assert [fake.updates - before for fake, before in zip(fakes, updates)] == [3 + 1, 1 + 1]
+    assert _setCells(fakes[0], 1) == [] and _setCells(fakes[0], 2) == []
+    assert _setCells(fakes[1], 1) == []
+    assert [ager.current(sw) for sw in conns] == [0, 0]
+
+
+def test_generation_is_read_from_the_switch(switches):
+    helper, fakes, conns = switches
+    ager = BloomAger(helper, conns[:1])
+    assert ager.rotate() == []
+    assert ager.current(conns[0]) == 1
+    # brought up again: the registers are back to 0, and so is the generation
+    fakes[0].reset()
+    _set(fakes[0], 1, 10)
+    assert ager.current(conns[0]) == 0
+    assert ager.rotate() == []
+    assert _setCells(fakes[0], 1) == []
+    assert ager.current(conns[0]) == 1
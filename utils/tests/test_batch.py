@@ -0,0 +1,113 @@
+# BatchWriter 对替身交换机的回归检查：运行 python -m pytest utils/tests
+# （没有 p4runtime_lib 时跳过）
+import pytest
+from p4.v1 import p4runtime_pb2
+
+pytest.importorskip('p4runtime_lib')
+from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from controller_lib.batch import BatchWriter, UpdateTemplate
+from controller_lib.connection import ControllerConnection
+from controller_lib.fakeswitch import FakeSwitch
+from controller_lib.p4index import IndexedP4InfoHelper
+
+P4INFO = '''
+tables {
+  preamble { id: 1 name: "MyIngress.hosts" alias: "hosts" }
+  match_fields { id: 1 name: "hdr.ipv4.dstAddr" bitwidth: 32 match_type: EXACT }
+  action_refs { id: 2 }
+  size: 1024
+}
+actions {
+  preamble { id: 2 name: "MyIngress.forward" alias: "forward" }
+  params { id: 1 name: "port" bitwidth: 9 }
+}
+tables {
+  preamble { id: 3 name: "MyIngress.routes" alias: "routes" }
+  match_fields { id: 1 name: "hdr.ipv4.dstAddr" bitwidth: 32 match_type: LPM }
+  match_fields { id: 2 name: "hdr.tcp.dstPort" bitwidth: 16 match_type: TERNARY }
+  action_refs { id: 4 }
+  size: 1024
+}
+actions {
+  preamble { id: 4 name: "MyIngress.route" alias: "route" }
+  params { id: 1 name: "dstAddr" bitwidth: 48 }
+  params { id: 2 name: "port" bitwidth: 9 }
+}
+'''
+
+
+@pytest.fixture
+def switch(tmp_path):
+    p4info_path = tmp_path / 'test.p4info.txt'
+    p4info_path.write_text(P4INFO)
+    helper = IndexedP4InfoHelper(str(p4info_path), cache_dir=None)
+    fake = FakeSwitch(device_id=0)
+    sw = ControllerConnection(name='s1', address=fake.start(), device_id=0)
+    yield helper, fake, sw
+    ShutdownAllSwitchConnections()
+    sw.channel.close()
+    fake.stop()
+
+
+def test_template_matches_built_entry(switch):
+    helper = switch[0]
+    template = UpdateTemplate(helper, p4runtime_pb2.Update.MODIFY, "MyIngress.routes",
+                              {"hdr.ipv4.dstAddr": ("0.0.0.0", 24),
+                               "hdr.tcp.dstPort": (0, 0xff00)},
+                              "MyIngress.route", {"dstAddr": "00:00:00:00:00:00", "port": 0},
+                              priority=10)
+    assert template.widths == [4, 2, 6, 2]
+    for ip, tcp_port, mac, port in [("10.0.1.0", 0x1f00, "08:00:00:00:01:11", 1),
+                                    ("192.168.255.0", 0xff00, "ff:ff:ff:ff:ff:ff", 511)]:
+        expected = p4runtime_pb2.Update()
+        expected.type = p4runtime_pb2.Update.MODIFY
+        expected.entity.table_entry.CopyFrom(helper.buildTableEntry(
+            table_name="MyIngress.routes",
+            match_fields={"hdr.ipv4.dstAddr": (ip, 24), "hdr.tcp.dstPort": (tcp_port, 0xff00)},
+            action_name="MyIngress.route", action_params={"dstAddr": mac, "port": port},
+            priority=10))
+        encoded = template.encode(bytes(map(int, ip.split('.'))), tcp_port.to_bytes(2, 'big'),
+                                  bytes.fromhex(mac.replace(':', '')), port.to_bytes(2, 'big'))
+        assert encoded == expected.SerializeToString()
+        assert p4runtime_pb2.Update.FromString(encoded) == expected
+
+
+def test_template_rejects_wrong_values(switch):
+    template = UpdateTemplate(switch[0], p4runtime_pb2.Update.INSERT, "MyIngress.hosts",
+                              {"hdr.ipv4.dstAddr": "0.0.0.0"}, "MyIngress.forward",
+                              {"port": 0})
+    with pytest.raises(ValueError):
+        template.encode(b'\x0a\x00\x00\x01')
+    with pytest.raises(ValueError):
+        template.encode(b'\x0a\x00\x01', b'\x00\x01')
+
+
+def test_existing_template_insert_is_skipped(switch):
+    helper, fake, sw = switch
+    template = UpdateTemplate(helper, p4runtime_pb2.Update.INSERT, "MyIngress.hosts",
+                              {"hdr.ipv4.dstAddr": "0.0.0.0"}, "MyIngress.forward",
+                              {"port": 0})
+    update = template.encode(b'\x0a\x00\x00\x01', b'\x00\x01')
+    writer = BatchWriter(skip_existing=True)
+    writer.queueUpdate(sw, update)
+    assert writer.flush() == []
+    writer.queueUpdate(sw, update)
+    writer.queueUpdate(sw, template.encode(b'\x0a\x00\x00\x02', b'\x00\x02'))
+    assert writer.flush() == []
+    assert writer.existing == {'s1': 1}
+    assert writer.written == {'s1': 2}
+    assert len(fake.tables) == 2
+
+
+def test_existing_template_insert_is_reported(switch):
+    helper, fake, sw = switch
+    template = UpdateTemplate(helper, p4runtime_pb2.Update.INSERT, "MyIngress.hosts",
+                              {"hdr.ipv4.dstAddr": "0.0.0.0"}, "MyIngress.forward",
+                              {"port": 0})
+    update = template.encode(b'\x0a\x00\x00\x01', b'\x00\x01')
+    writer = BatchWriter()
+    writer.queueUpdate(sw, update)
+    writer.queueUpdate(sw, update)
+    errors = writer.flush()
+    assert len(errors) == 1
+    assert errors[0].update.type == p4runtime_pb2.Update.INSERT
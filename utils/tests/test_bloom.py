@@ -0,0 +1,53 @@
+# 布隆过滤器离线模型的回归检查：NumPy 计算的 crc16/crc32 与逐位实现、zlib 逐一比对
+import zlib
+
+import pytest
+
+np = pytest.importorskip('numpy')
+from controller_lib.bloom import BloomFilterModel, crc16, crc32, flowKeys, syntheticFlows
+
+
+def _crc16Bitwise(data):
+    # CRC-16/ARC bit by bit, as BMv2's crc16: reflected 0x8005, init 0,
+    # no final xor
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def _keys(data):
+    return np.frombuffer(data, dtype=np.uint8).reshape(1, len(data))
+
+
+def test_check_values():
+    # the check values of the catalogue of CRC parameters
+    assert int(crc16(_keys(b'123456789'))[0]) == 0xBB3D
+    assert int(crc32(_keys(b'123456789'))[0]) == 0xCBF43926
+
+
+def test_hashes_of_random_flows():
+    keys = syntheticFlows(2000, np.random.default_rng(3))
+    hash1 = crc16(keys)
+    hash2 = crc32(keys)
+    for row, h1, h2 in zip(keys, hash1, hash2):
+        data = row.tobytes()
+        assert int(h1) == _crc16Bitwise(data)
+        assert int(h2) == zlib.crc32(data)
+
+
+def test_flow_keys_are_in_network_order():
+    keys = flowKeys([0x0a000101], [0x0a000303], [1234], [80])
+    assert keys[0].tobytes() == bytes([10, 0, 1, 1, 10, 0, 3, 3, 0x04, 0xd2, 0, 80, 6])
+
+
+def test_filters_hold_their_flows():
+    model = BloomFilterModel(syntheticFlows(500, np.random.default_rng(4)))
+    filter1, filter2 = model.filters(entries=4096)
+    pos1, pos2 = model.positions(entries=4096)
+    assert filter1[pos1].all() and filter2[pos2].all()
+    assert filter1.sum() == len(set(pos1.tolist()))
+    # a bloom_filter_1 larger than 65536 bits only uses the first 65536
+    assert model.positions(entries=1 << 20)[0].max() < 1 << 16
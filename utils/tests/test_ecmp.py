@@ -0,0 +1,78 @@
+# EcmpGroup.layout 的回归检查：槽位按权重分配，成员或权重变化时只移动必须移动的槽位
+import random
+from collections import Counter
+
+from controller_lib.ecmp import EcmpGroup, NextHop
+
+HOPS = [NextHop("00:00:00:00:01:%02x" % i, "10.0.%d.%d" % (i, i), i) for i in range(1, 7)]
+
+
+def _group(size=16):
+    return EcmpGroup(sw=None, dst_prefix=("10.0.0.1", 32), base=0, size=size)
+
+
+def test_slots_follow_the_weights():
+    group = _group()
+    group.setMember(HOPS[0], 3)
+    group.setMember(HOPS[1], 1)
+    assert group.layout() == list(range(16))
+    assert Counter(group.slots) == {HOPS[0]: 12, HOPS[1]: 4}
+    # largest remainder, ties to the member added first
+    group.setMember(HOPS[2], 1)
+    group.setMember(HOPS[0], 1)
+    group.setMember(HOPS[1], 1)
+    group.layout()
+    assert Counter(group.slots) == {HOPS[0]: 6, HOPS[1]: 5, HOPS[2]: 5}
+    assert group.layout() == []
+
+
+def test_new_member_takes_only_its_share():
+    group = _group()
+    group.setMember(HOPS[0])
+    group.setMember(HOPS[1])
+    group.layout()
+    before = list(group.slots)
+    group.setMember(HOPS[2])
+    changed = group.layout()
+    # 8 + 8 -> 6 + 5 + 5: only the 5 slots of the new member move
+    assert len(changed) == 5
+    assert all(group.slots[i] == HOPS[2] for i in changed)
+    assert all(group.slots[i] == before[i] for i in range(16) if i not in changed)
+
+
+def test_removed_member_gives_back_only_its_slots():
+    group = _group()
+    for nhop in HOPS[:4]:
+        group.setMember(nhop)
+    group.layout()
+    before = list(group.slots)
+    group.removeMember(HOPS[1])
+    changed = group.layout()
+    assert sorted(changed) == [i for i in range(16) if before[i] == HOPS[1]]
+    group.setMember(HOPS[0], 0)
+    group.setMember(HOPS[2], 0)
+    group.setMember(HOPS[3], 0)
+    # a group without members drops in every slot
+    assert group.layout() == list(range(16))
+    assert group.slots == [None] * 16
+
+
+def test_churn_is_minimal():
+    rng = random.Random(7)
+    group = _group(size=32)
+    for _ in range(200):
+        nhop = rng.choice(HOPS)
+        group.setMember(nhop, rng.choice([0, 1, 1, 2, 3, 5]))
+        before = Counter(group.slots)
+        changed = group.layout()
+        after = Counter(group.slots)
+        # every slot kept by a member that still has at least as many is
+        # untouched: the moves are exactly the slots some member lost
+        kept = sum(min(before[member], after[member]) for member in after if member is not None)
+        if group.weights:
+            assert len(changed) == 32 - kept
+            total = sum(group.weights.values())
+            for member, weight in group.weights.items():
+                assert abs(after[member] - weight * 32.0 / total) < 1
+        else:
+            assert group.slots == [None] * 32
@@ -0,0 +1,64 @@
+# LatencyHistogram 的回归检查：对数分桶的边界、百分位误差和合并
+import pytest
+
+from controller_lib.latency import _OVERFLOW, _bucket, _highest, LatencyHistogram
+
+
+def _durations():
+    # every microsecond up to 4096, then the edges of every power of two
+    for us in range(4096):
+        yield us
+    for shift in range(12, 40):
+        for us in ((1 << shift) - 1, 1 << shift, (1 << shift) + 1, 3 << (shift - 1)):
+            yield us
+
+
+def test_buckets_bracket_their_durations():
+    for us in _durations():
+        index = _bucket(us)
+        if us >= 1 << 37:
+            assert index == _OVERFLOW
+            continue
+        assert _highest(index) >= us
+        assert index == 0 or _highest(index - 1) < us
+
+
+def test_buckets_are_exact_then_within_a_sixteenth():
+    assert [_bucket(us) for us in range(32)] == list(range(32))
+    for index in range(32, _OVERFLOW):
+        lowest = _highest(index - 1) + 1
+        width = _highest(index) - lowest + 1
+        assert width * 16 <= lowest
+
+
+def test_percentiles():
+    histogram = LatencyHistogram()
+    for ms in range(1, 1001):
+        histogram.record(ms * 1e-3)
+    assert histogram.count == 1000
+    assert histogram.max == 1.0
+    assert histogram.total == pytest.approx(500.5)
+    for percent, expected in ((50, 0.5), (99, 0.99), (100, 1.0)):
+        value = histogram.percentile(percent)
+        # rounded up to its bucket, never beyond the maximum
+        assert expected <= value <= min(expected * 17 / 16, histogram.max)
+    assert LatencyHistogram().percentile(99) == 0.0
+
+
+def test_merge_and_copy():
+    fast = LatencyHistogram()
+    slow = LatencyHistogram()
+    for _ in range(90):
+        fast.record(100e-6)
+    for _ in range(10):
+        slow.record(2.0)
+    merged = fast.copy()
+    merged.merge(slow)
+    assert fast.count == 90 and merged.count == 100
+    assert merged.percentile(90) <= 100e-6 * 17 / 16
+    assert merged.percentile(91) == 2.0
+    assert merged.max == 2.0
+    # beyond 2^37 microseconds, in the last bucket with the exact maximum
+    merged.record(1e6)
+    assert merged.counts[-1] == 1
+    assert merged.percentile(100) == 1e6
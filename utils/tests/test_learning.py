@@ -0,0 +1,145 @@
+# HostLearner 在替身交换机上的回归检查：重启后由 Reconciler 读回并保留学习到的主机
+# （没有 p4runtime_lib 时跳过）
+import socket
+
+import pytest
+from p4.v1 import p4runtime_pb2
+
+pytest.importorskip('p4runtime_lib')
+from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from controller_lib.connection import ControllerConnection
+from controller_lib.fakeswitch import FakeSwitch
+from controller_lib.learning import HostLearner
+from controller_lib.p4index import IndexedP4InfoHelper
+from controller_lib.reconcile import Reconciler
+from controller_lib.topology import RouteCompiler, Topology
+
+P4INFO = '''
+tables {
+  preamble { id: 1 name: "MyIngress.ipv4_lpm" alias: "ipv4_lpm" }
+  match_fields { id: 1 name: "hdr.ipv4.dstAddr" bitwidth: 32 match_type: LPM }
+  action_refs { id: 10 }
+  size: 1024
+}
+tables {
+  preamble { id: 2 name: "MyIngress.learned_hosts" alias: "learned_hosts" }
+  match_fields { id: 1 name: "hdr.ipv4.srcAddr" bitwidth: 32 match_type: EXACT }
+  match_fields { id: 2 name: "standard_metadata.ingress_port" bitwidth: 9 match_type: EXACT }
+  action_refs { id: 11 }
+  size: 1024
+}
+tables {
+  preamble { id: 3 name: "MyIngress.switch_ports" alias: "switch_ports" }
+  match_fields { id: 1 name: "standard_metadata.ingress_port" bitwidth: 9 match_type: EXACT }
+  action_refs { id: 11 }
+  size: 64
+}
+actions {
+  preamble { id: 10 name: "MyIngress.ipv4_forward" alias: "ipv4_forward" }
+  params { id: 1 name: "dstAddr" bitwidth: 48 }
+  params { id: 2 name: "port" bitwidth: 9 }
+}
+actions {
+  preamble { id: 11 name: "NoAction" alias: "NoAction" }
+}
+digests {
+  preamble { id: 20 name: "learn_t" alias: "learn_t" }
+  type_spec { struct { name: "learn_t" } }
+}
+'''
+
+TOPOLOGY = {
+    "hosts": {"h1": {"ip": "10.0.1.1/24", "mac": "08:00:00:00:01:11"}},
+    "switches": {"s1": {}, "s2": {}},
+    "links": [["h1", "s1-p1"], ["s1-p2", "s2-p1"]],
+}
+
+
+@pytest.fixture
+def switches(tmp_path):
+    p4info_path = tmp_path / 'learning.p4info.txt'
+    p4info_path.write_text(P4INFO)
+    helper = IndexedP4InfoHelper(str(p4info_path), cache_dir=None)
+    fakes = [FakeSwitch(device_id=i) for i in range(2)]
+    conns = dict(('s%d' % (i + 1), ControllerConnection(name='s%d' % (i + 1),
+                                                        address=fake.start(), device_id=i))
+                 for i, fake in enumerate(fakes))
+    yield helper, fakes, conns
+    ShutdownAllSwitchConnections()
+    for sw in conns.values():
+        sw.channel.close()
+    for fake in fakes:
+        fake.stop()
+
+
+def _digestList(learner, ip, mac, port):
+    digest_list = p4runtime_pb2.DigestList(digest_id=learner.digest_id, list_id=1)
+    members = digest_list.data.add().struct.members
+    members.add().bitstring = socket.inet_aton(ip)
+    members.add().bitstring = bytes.fromhex(mac.replace(':', ''))
+    members.add().bitstring = port.to_bytes(2, 'big')
+    return digest_list
+
+
+def _reconcile(helper, conns, restored):
+    # the rules of a controller started again: the topology of the file
+    # only, the learned hosts coming back from the switches
+    topo = Topology.fromDict(TOPOLOGY)
+    learner = HostLearner(helper, topo, conns)
+    reconciler = Reconciler()
+    reconciler.onInstalled(
+        lambda installed: restored.extend(learner.restore(installed, reconciler)))
+    learner.queueKnown(reconciler)
+    for name, routes in RouteCompiler(topo).compile().items():
+        for route in routes:
+            reconciler.add(conns[name], helper.buildTableEntry(
+                table_name="MyIngress.ipv4_lpm",
+                match_fields={"hdr.ipv4.dstAddr": route.dst_prefix},
+                action_name="MyIngress.ipv4_forward",
+                action_params={"dstAddr": route.dst_mac, "port": route.port}))
+    assert reconciler.flush() == []
+    return topo, reconciler
+
+
+def test_learned_hosts_survive_a_restart(switches):
+    helper, fakes, conns = switches
+    restored = []
+    _reconcile(helper, conns, restored)
+    assert restored == []
+    installed = [len(fake.tables) for fake in fakes]
+
+    learner = HostLearner(helper, Topology.fromDict(TOPOLOGY), conns)
+    learner.add(conns['s2'], _digestList(learner, "10.0.2.2", "08:00:00:00:02:22", 3))
+    hosts, errors = learner.flush()
+    assert [host.ip for host in hosts] == ["10.0.2.2"] and errors == []
+    # a route on both switches and the learned_hosts entry of s2
+    assert [len(fake.tables) for fake in fakes] == [installed[0] + 1, installed[1] + 2]
+    learned = [len(fake.tables) for fake in fakes]
+
+    restored = []
+    topo, reconciler = _reconcile(helper, conns, restored)
+    assert [(host.ip, host.mac, host.switch, host.port) for host in restored] == [
+        ("10.0.2.2", "08:00:00:00:02:22", "s2", 3)]
+    assert "10.0.2.2" in topo.hosts
+    assert sum(reconciler.inserted.values()) == 0
+    assert sum(reconciler.modified.values()) == 0
+    assert sum(reconciler.deleted.values()) == 0
+    assert [len(fake.tables) for fake in fakes] == learned
+
+
+def test_learned_host_without_route_is_deleted(switches):
+    helper, fakes, conns = switches
+    restored = []
+    _reconcile(helper, conns, restored)
+    learner = HostLearner(helper, Topology.fromDict(TOPOLOGY), conns)
+    # a learned_hosts entry whose route was never installed
+    learner.writer.add(conns['s2'], helper.buildTableEntry(
+        table_name="MyIngress.learned_hosts",
+        match_fields={"hdr.ipv4.srcAddr": "10.0.2.2", "standard_metadata.ingress_port": 3},
+        action_name="NoAction"))
+    assert learner.writer.flush() == []
+
+    restored = []
+    _, reconciler = _reconcile(helper, conns, restored)
+    assert restored == []
+    assert reconciler.deleted['s2'] == 1
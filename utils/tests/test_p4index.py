@@ -0,0 +1,328 @@
+# P4InfoIndex 与 P4InfoHelper 的一致性检查，使用 p4c 格式的 firewall.p4 p4info（含 digest 与 extern）
+# （没有 p4runtime_lib 时跳过）
+import os
+
+import pytest
+from p4.config.v1 import p4info_pb2
+
+pytest.importorskip('p4runtime_lib')
+from p4runtime_lib.helper import P4InfoHelper
+from controller_lib.p4index import ENTITY_TYPES, IndexedP4InfoHelper, loadP4Info
+
+# The p4info of 第5次实践作业/firewall.p4 in the layout of p4c
+# --p4runtime-files (pkg_info, annotations, initial_default_action,
+# type_info), cut to the entities the controllers use, with an extern
+# instance added as an architecture other than v1model emits them
+P4INFO = '''
+pkg_info {
+  arch: "v1model"
+}
+tables {
+  preamble {
+    id: 33554473
+    name: "MyIngress.ipv4_lpm"
+    alias: "ipv4_lpm"
+  }
+  match_fields {
+    id: 1
+    name: "hdr.ipv4.dstAddr"
+    bitwidth: 32
+    match_type: LPM
+  }
+  action_refs {
+    id: 16799317
+  }
+  action_refs {
+    id: 16805608
+  }
+  action_refs {
+    id: 16800567
+  }
+  initial_default_action {
+    action_id: 16800567
+  }
+  size: 1024
+}
+tables {
+  preamble {
+    id: 33574068
+    name: "MyIngress.learned_hosts"
+    alias: "learned_hosts"
+  }
+  match_fields {
+    id: 1
+    name: "hdr.ipv4.srcAddr"
+    bitwidth: 32
+    match_type: EXACT
+  }
+  match_fields {
+    id: 2
+    name: "standard_metadata.ingress_port"
+    bitwidth: 9
+    match_type: EXACT
+  }
+  action_refs {
+    id: 21257015
+  }
+  action_refs {
+    id: 16791567
+  }
+  size: 1024
+}
+tables {
+  preamble {
+    id: 33606914
+    name: "MyIngress.check_ports"
+    alias: "check_ports"
+  }
+  match_fields {
+    id: 1
+    name: "standard_metadata.ingress_port"
+    bitwidth: 9
+    match_type: EXACT
+  }
+  match_fields {
+    id: 2
+    name: "standard_metadata.egress_spec"
+    bitwidth: 9
+    match_type: EXACT
+  }
+  action_refs {
+    id: 16815580
+  }
+  action_refs {
+    id: 21257015
+  }
+  size: 1024
+}
+actions {
+  preamble {
+    id: 21257015
+    name: "NoAction"
+    alias: "NoAction"
+    annotations: "@noWarn(\\"unused\\")"
+  }
+}
+actions {
+  preamble {
+    id: 16805608
+    name: "MyIngress.drop"
+    alias: "drop"
+  }
+}
+actions {
+  preamble {
+    id: 16799317
+    name: "MyIngress.ipv4_forward"
+    alias: "ipv4_forward"
+  }
+  params {
+    id: 1
+    name: "dstAddr"
+    bitwidth: 48
+  }
+  params {
+    id: 2
+    name: "port"
+    bitwidth: 9
+  }
+}
+actions {
+  preamble {
+    id: 16815580
+    name: "MyIngress.set_direction"
+    alias: "set_direction"
+  }
+  params {
+    id: 1
+    name: "dir"
+    bitwidth: 1
+  }
+}
+actions {
+  preamble {
+    id: 16791567
+    name: "MyIngress.learn"
+    alias: "learn"
+  }
+}
+actions {
+  preamble {
+    id: 16800567
+    name: "MyIngress.miss"
+    alias: "miss"
+  }
+}
+registers {
+  preamble {
+    id: 369119253
+    name: "MyIngress.bloom_filter_1"
+    alias: "bloom_filter_1"
+  }
+  type_spec {
+    bitstring {
+      bit {
+        bitwidth: 1
+      }
+    }
+  }
+  size: 8192
+}
+registers {
+  preamble {
+    id: 369125383
+    name: "MyIngress.bloom_generation"
+    alias: "bloom_generation"
+  }
+  type_spec {
+    bitstring {
+      bit {
+        bitwidth: 1
+      }
+    }
+  }
+  size: 1
+}
+digests {
+  preamble {
+    id: 385923183
+    name: "learn_t"
+    alias: "learn_t"
+  }
+  type_spec {
+    struct {
+      name: "learn_t"
+    }
+  }
+}
+externs {
+  extern_type_id: 129
+  extern_type_name: "Checksum"
+  instances {
+    preamble {
+      id: 2164260865
+      name: "MyIngress.drop"
+      alias: "drop"
+    }
+  }
+}
+type_info {
+  structs {
+    key: "learn_t"
+    value {
+      members {
+        name: "srcAddr"
+        type_spec {
+          bitstring {
+            bit {
+              bitwidth: 32
+            }
+          }
+        }
+      }
+      members {
+        name: "srcMac"
+        type_spec {
+          bitstring {
+            bit {
+              bitwidth: 48
+            }
+          }
+        }
+      }
+      members {
+        name: "ingress_port"
+        type_spec {
+          bitstring {
+            bit {
+              bitwidth: 9
+            }
+          }
+        }
+      }
+    }
+  }
+}
+'''
+
+
+@pytest.fixture
+def p4info_path(tmp_path):
+    path = tmp_path / 'firewall.p4.p4info.txt'
+    path.write_text(P4INFO)
+    return str(path)
+
+
+def test_lookups_match_p4info_helper(p4info_path):
+    reference = P4InfoHelper(p4info_path)
+    helper = IndexedP4InfoHelper(p4info_path, cache_dir=None)
+    checked = 0
+    for entity_type in ENTITY_TYPES:
+        for o in getattr(reference.p4info, entity_type):
+            for name in (o.preamble.name, o.preamble.alias):
+                assert helper.get(entity_type, name=name) == reference.get(entity_type, name=name)
+            assert helper.get(entity_type, id=o.preamble.id) == o
+            checked += 1
+    assert checked == 12
+    assert helper.get_digests_id("learn_t") == 385923183
+    assert helper.get_registers_name(369125383) == "MyIngress.bloom_generation"
+    for table in reference.p4info.tables:
+        for mf in table.match_fields:
+            name = table.preamble.name
+            assert helper.get_match_field(name, name=mf.name) == mf
+            assert helper.get_match_field_id(name, mf.name) == mf.id
+            assert helper.get_match_field_name(name, mf.id) == mf.name
+    for action in reference.p4info.actions:
+        for param in action.params:
+            assert helper.get_action_param(action.preamble.name, name=param.name) == param
+            assert helper.get_action_param(action.preamble.alias, id=param.id) == param
+
+
+def test_extern_instances_are_not_indexed(p4info_path):
+    helper = IndexedP4InfoHelper(p4info_path, cache_dir=None)
+    # an extern instance named like an action never shadows it
+    assert helper.get('actions', name="MyIngress.drop").preamble.id == 16805608
+    assert helper.get('actions', name="drop").preamble.id == 16805608
+    with pytest.raises(AttributeError):
+        helper.get('actions', id=2164260865)
+    with pytest.raises(AttributeError):
+        helper.get('externs', name="MyIngress.drop")
+    assert helper.p4info.externs[0].instances[0].preamble.id == 2164260865
+
+
+def test_unknown_names_raise_attribute_error(p4info_path):
+    helper = IndexedP4InfoHelper(p4info_path, cache_dir=None)
+    with pytest.raises(AttributeError):
+        helper.get('tables', name="MyIngress.missing")
+    with pytest.raises(AttributeError):
+        helper.get('digests', id=1)
+    with pytest.raises(AttributeError):
+        helper.get_match_field("MyIngress.ipv4_lpm", name="hdr.ipv4.srcAddr")
+    with pytest.raises(AttributeError):
+        helper.get_action_param("MyIngress.drop", name="port")
+
+
+def test_decode_table_entry_round_trip(p4info_path):
+    helper = IndexedP4InfoHelper(p4info_path, cache_dir=None)
+    entry = helper.buildTableEntry(
+        table_name="MyIngress.ipv4_lpm",
+        match_fields={"hdr.ipv4.dstAddr": ("10.0.1.1", 32)},
+        action_name="MyIngress.ipv4_forward",
+        action_params={"dstAddr": "08:00:00:00:01:11", "port": 1})
+    assert helper.index.decodeTableEntry(entry) == (
+        "MyIngress.ipv4_lpm", [("hdr.ipv4.dstAddr", (b'\x0a\x00\x01\x01', 32))],
+        "MyIngress.ipv4_forward",
+        [("dstAddr", b'\x08\x00\x00\x00\x01\x11'), ("port", b'\x00\x01')])
+
+
+def test_binary_cache(p4info_path, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    parsed = loadP4Info(p4info_path, cache_dir)
+    cached = os.listdir(cache_dir)
+    assert len(cached) == 1 and cached[0].endswith('.bin')
+    assert loadP4Info(p4info_path, cache_dir) == parsed
+    # a damaged cache entry is parsed again from the text
+    with open(os.path.join(cache_dir, cached[0]), 'wb') as f:
+        f.write(b'\xff\xff\xff')
+    assert loadP4Info(p4info_path, cache_dir) == parsed
+    assert isinstance(parsed, p4info_pb2.P4Info) and len(parsed.digests) == 1
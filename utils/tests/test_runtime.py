@@ -0,0 +1,104 @@
+# 运行时 JSON 加载的回归检查：// 注释剥离（字符串与转义除外）、跨读取块的流式解析、按文件下发
+# （没有 p4runtime_lib 时跳过）
+import json
+
+import pytest
+
+pytest.importorskip('p4runtime_lib')
+from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from controller_lib.connection import ControllerConnection
+from controller_lib.fakeswitch import FakeSwitch
+from controller_lib.p4index import IndexedP4InfoHelper
+from controller_lib.runtime import _READ_SIZE, RuntimeFile, _stripComments, applyRuntimeFiles
+
+P4INFO = '''
+tables {
+  preamble { id: 1 name: "MyIngress.ipv4_lpm" alias: "ipv4_lpm" }
+  match_fields { id: 1 name: "hdr.ipv4.dstAddr" bitwidth: 32 match_type: LPM }
+  action_refs { id: 10 }
+  size: 65536
+}
+actions {
+  preamble { id: 10 name: "MyIngress.ipv4_forward" alias: "ipv4_forward" }
+  params { id: 1 name: "dstAddr" bitwidth: 48 }
+  params { id: 2 name: "port" bitwidth: 9 }
+}
+'''
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('{"a": 1} // comment', '{"a": 1} '),
+    ('// a whole line', ''),
+    ('"no comment"', '"no comment"'),
+    ('"http://example.com" // url', '"http://example.com" '),
+    (r'"a \"// b\" c" // d', r'"a \"// b\" c" '),
+    (r'"ends with \\" // d', r'"ends with \\" '),
+    (r'["\\\"//", 1] // d', r'["\\\"//", 1] '),
+    ('1 / 2 // half', '1 / 2 '),
+    ('"a" "//" // b // c', '"a" "//" '),
+])
+def test_strip_comments(line, expected):
+    assert _stripComments(line) == expected
+
+
+def test_strip_comments_keeps_the_lines():
+    text = '{\n  // header\n  "target": "bmv2", // the target\n  "p4info": "a//b"\n}\n'
+    stripped = _stripComments(text)
+    assert stripped.count('\n') == text.count('\n')
+    assert json.loads(stripped) == {"target": "bmv2", "p4info": "a//b"}
+
+
+def _entry(i):
+    return {"table": "MyIngress.ipv4_lpm",
+            "match": {"hdr.ipv4.dstAddr": ["10.%d.%d.0" % (i >> 8, i & 0xff), 24]},
+            "action_name": "MyIngress.ipv4_forward",
+            "action_params": {"dstAddr": "08:00:00:00:01:11", "port": i % 512}}
+
+
+def _write(path, count):
+    # several read blocks, with comments everywhere
+    with open(path, 'w') as f:
+        f.write('{ // s1\n  "target": "bmv2",\n  "p4info": "build/basic.p4.p4info.txt",\n'
+                '  "table_entries": [ // routes\n')
+        for i in range(count):
+            separator = ',' if i + 1 < count else ''
+            f.write('    %s%s // entry "%d"\n' % (json.dumps(_entry(i)), separator, i))
+        f.write('  ],\n  "multicast_group_entries": []\n}\n')
+
+
+def test_entries_are_streamed(tmp_path):
+    path = str(tmp_path / 's1-runtime.json')
+    _write(path, 2000)
+    assert len(open(path).read()) > 2 * _READ_SIZE
+    runtime = RuntimeFile(path)
+    assert runtime.header == {"target": "bmv2", "p4info": "build/basic.p4.p4info.txt"}
+    assert list(runtime.entries()) == [_entry(i) for i in range(2000)]
+
+
+def test_malformed_file_reports_its_offset(tmp_path):
+    path = tmp_path / 'bad-runtime.json'
+    path.write_text('{"table_entries": [{"table": 1} {"table": 2}]}')
+    with pytest.raises(ValueError, match="expected ','"):
+        list(RuntimeFile(str(path)).entries())
+
+
+def test_file_is_installed_on_every_switch(tmp_path):
+    p4info_path = tmp_path / 'basic.p4info.txt'
+    p4info_path.write_text(P4INFO)
+    helper = IndexedP4InfoHelper(str(p4info_path), cache_dir=None)
+    path = str(tmp_path / 'runtime.json')
+    _write(path, 300)
+    fakes = [FakeSwitch(device_id=i) for i in range(2)]
+    conns = [ControllerConnection(name='s%d' % (i + 1), address=fake.start(), device_id=i)
+             for i, fake in enumerate(fakes)]
+    try:
+        results = applyRuntimeFiles(helper, [(sw, path) for sw in conns], batch_size=128)
+        assert [(r.switch, r.entries, r.written, r.errors, r.error) for r in results] == [
+            ('s1', 300, 300, [], None), ('s2', 300, 300, [], None)]
+        assert [(fake.writes, len(fake.tables)) for fake in fakes] == [(3, 300), (3, 300)]
+    finally:
+        ShutdownAllSwitchConnections()
+        for sw in conns:
+            sw.channel.close()
+        for fake in fakes:
+            fake.stop()
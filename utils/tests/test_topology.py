@@ -0,0 +1,119 @@
+# RouteCompiler 与 TunnelProvisioner 的回归检查：pod-topo 路径、拓扑变化后的缓存失效、隧道 ID 复用
+import os
+import random
+
+import pytest
+
+from controller_lib.topology import Route, RouteCompiler, Topology
+from controller_lib.tunnels import TunnelProvisioner
+
+POD_TOPO = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                        '第5次实践作业', '提高题', 'pod-topo', 'topology.json')
+
+
+def _ring(switches, hosts_per_switch=2):
+    topo = {"hosts": {}, "switches": dict(('s%d' % i, {}) for i in range(1, switches + 1)),
+            "links": []}
+    for i in range(1, switches + 1):
+        for j in range(1, hosts_per_switch + 1):
+            name = 'h%d_%d' % (i, j)
+            topo["hosts"][name] = {"ip": "10.0.%d.%d/24" % (i, j),
+                                   "mac": "08:00:00:00:%02x:%02x" % (i, j)}
+            topo["links"].append([name, 's%d-p%d' % (i, j)])
+        peer = i % switches + 1
+        topo["links"].append(['s%d-p%d' % (i, hosts_per_switch + 1),
+                              's%d-p%d' % (peer, hosts_per_switch + 2)])
+    return Topology.fromDict(topo)
+
+
+def test_pod_topo_routes():
+    routes = RouteCompiler(Topology.load(POD_TOPO)).compile()
+    ports = dict(((route.switch, route.dst_prefix[0]), route.port)
+                 for switch_routes in routes.values() for route in switch_routes)
+    # the paths of the hand-written rules: s1 reaches h3 through s3 and h4
+    # through s4, s2 reaches h1 through s3 and h2 through s4
+    assert ports[("s1", "10.0.3.3")] == 3 and ports[("s1", "10.0.4.4")] == 4
+    assert ports[("s2", "10.0.1.1")] == 4 and ports[("s2", "10.0.2.2")] == 3
+    assert Route("s1", ("10.0.1.1", 32), "08:00:00:00:01:11", 1) in routes["s1"]
+    assert Route("s3", ("10.0.1.1", 32), "08:00:00:00:01:00", 1) in routes["s3"]
+    assert [len(switch_routes) for switch_routes in routes.values()] == [4, 4, 4, 4]
+
+
+def test_changes_give_the_routes_of_a_new_compiler():
+    rng = random.Random(1)
+    topo = _ring(6)
+    compiler = RouteCompiler(topo)
+    compiler.compile()
+    removed = []
+    for _ in range(40):
+        if removed and rng.random() < 0.5:
+            topo.addLink(*removed.pop(rng.randrange(len(removed))))
+        else:
+            sw = rng.choice(list(topo.switches))
+            links = list(topo.ports[sw])
+            if links:
+                port = rng.choice(links)
+                peer, peer_port = topo.ports[sw][port]
+                topo.removeLink(sw, port)
+                removed.append((sw, port, peer, peer_port))
+        if rng.random() < 0.3:
+            host = rng.choice(list(topo.hosts.values()))
+            topo.addHost(host.name, host.ip, host.mac, rng.choice(list(topo.switches)),
+                         host.port + 10)
+        assert compiler.compile() == RouteCompiler(topo).compile()
+
+
+def test_unaffected_paths_are_kept():
+    topo = _ring(4)
+    compiler = RouteCompiler(topo)
+    compiler.compile()
+    trees = dict(compiler._trees)
+    # s2 and s4 are at the same distance from s1 and from s3: a link between
+    # them is on no shortest path towards s1 or s3
+    topo.addLink('s2', 5, 's4', 5)
+    compiler.compile()
+    assert compiler._trees['s1'] is trees['s1']
+    assert compiler._trees['s3'] is trees['s3']
+    assert compiler._trees['s2'] is not trees['s2']
+    assert compiler._trees['s4'] is not trees['s4']
+
+    trees = dict(compiler._trees)
+    routes = dict(compiler._routes)
+    topo.addHost('h5', '10.0.5.5', '08:00:00:00:05:55', 's3', 6)
+    compiler.compile()
+    assert compiler._trees == trees
+    for dst in ('s1', 's2', 's4'):
+        assert compiler._routes[dst] is routes[dst]
+    assert compiler._routes['s3'] is not routes['s3']
+
+
+def test_tunnel_ids_are_kept_and_reused():
+    topo = _ring(3, hosts_per_switch=1)
+    provisioner = TunnelProvisioner(topo, first_id=1, max_id=8)
+    tunnels = provisioner.tunnels()
+    # every switch to every host of the other switches
+    assert [t.tunnel_id for t in tunnels] == [1, 2, 3, 4, 5, 6]
+    ids = dict(((t.ingress, t.host.name), t.tunnel_id) for t in tunnels)
+    for t in tunnels:
+        assert t.path[0][0] == t.ingress
+        assert topo.ports[t.path[-1][0]][t.path[-1][1]][0] == t.egress
+
+    # the IDs of the other tunnels do not move when a host leaves
+    topo.removeHost('h2_1')
+    tunnels = provisioner.tunnels()
+    assert len(tunnels) == 4
+    for t in tunnels:
+        assert t.tunnel_id == ids[(t.ingress, t.host.name)]
+    freed = sorted(tunnel_id for (_, host), tunnel_id in ids.items() if host == 'h2_1')
+
+    # a new host takes the smallest free IDs first, then new ones
+    topo.addHost('h4', '10.0.4.4', '08:00:00:00:04:04', 's1', 5)
+    topo.addHost('h5', '10.0.5.5', '08:00:00:00:05:05', 's2', 5)
+    tunnels = provisioner.tunnels()
+    new_ids = sorted(t.tunnel_id for t in tunnels if t.host.name in ('h4', 'h5'))
+    assert new_ids == freed + [7, 8]
+    assert len(set(t.tunnel_id for t in tunnels)) == len(tunnels) == 8
+
+    topo.addHost('h6', '10.0.6.6', '08:00:00:00:06:06', 's3', 5)
+    with pytest.raises(ValueError):
+        provisioner.tunnels()
@@ -2,25 +2,24 @@
 import argparse
 import os
 import sys
-from time import sleep
-
-import grpc
 
 # Import P4Runtime lib from parent utils dir
 # Probably there's a better way of doing this.
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
-import p4runtime_lib.bmv2
-import p4runtime_lib.helper
-from p4runtime_lib.error_utils import printGrpcError
-from p4runtime_lib.switch import ShutdownAllSwitchConnections
+# controller_lib lives in the utils dir at the top of this repository
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../utils/'))
+from controller_lib.p4index import IndexedP4InfoHelper
+from controller_lib.session import ControllerSession, addSessionArguments
 
 SWITCH_TO_HOST_PORT = 1
 SWITCH_TO_SWITCH_PORT = 2 # 指定了交换机的端口号
 
 
-def writeTunnelRules(p4info_helper, ingress_sw, egress_sw, tunnel_id,
+def writeTunnelRules(p4info_helper, writer, ingress_sw, egress_sw, tunnel_id,
                      dst_eth_addr, dst_ip_addr):
     """
     Installs three rules:
@@ -34,6 +33,7 @@ def writeTunnelRules(p4info_helper, ingress_sw, egress_sw, tunnel_id,
        with the specified ID and sends it to the host
        出交换机上的隧道出口规则，使用指定的 ID 对流量解封装，并将其发送到主机
     :param p4info_helper: the P4Info helper
+    :param writer: the BatchWriter the rules are queued on
     :param ingress_sw: the ingress switch connection
     :param egress_sw: the egress switch connection
     :param tunnel_id: the specified tunnel ID
@@ -53,8 +53,7 @@ def writeTunnelRules(p4info_helper, ingress_sw, egress_sw, tunnel_id,
             "dst_id": tunnel_id, # 动作参数是 tunnel_id
         })
     # 需要使用 p4info_helper 解析器来将规则转化为 P4Runtime 能够识别的形式
-    ingress_sw.WriteTableEntry(table_entry) # 调用 WriteTableEntry ，将生成的匹配动作表项加入交换机
-    print("Installed ingress tunnel rule on %s" % ingress_sw.name)
+    writer.add(ingress_sw, table_entry) # 将生成的匹配动作表项加入批量写入队列
 
     # 2) Tunnel Transit Rule 隧道传输规则
     # The rule will need to be added to the myTunnel_exact table and match on 
@@ -86,8 +85,7 @@ def writeTunnelRules(p4info_helper, ingress_sw, egress_sw, tunnel_id,
         action_params={
             "port": SWITCH_TO_SWITCH_PORT # 动作参数是端口 2
         })
-    ingress_sw.WriteTableEntry(table_entry) # 调用 WriteTableEntry ，将生成的匹配动作表项加入交换机
-    print("Installed transit tunnel rule on %s" % ingress_sw.name)
+    writer.add(ingress_sw, table_entry) # 将生成的匹配动作表项加入批量写入队列
 
     # 3) Tunnel Egress Rule 隧道出口规则
     # For our simple topology, the host will always be located on the
@@ -107,8 +105,7 @@ def writeTunnelRules(p4info_helper, ingress_sw, egress_sw, tunnel_id,
             "dstAddr": dst_eth_addr,
             "port": SWITCH_TO_HOST_PORT
         })
-    egress_sw.WriteTableEntry(table_entry)
-    print("Installed egress tunnel rule on %s" % egress_sw.name)
+    writer.add(egress_sw, table_entry)
 
 
 def readTableRules(p4info_helper, sw):
@@ -116,30 +113,22 @@ def readTableRules(p4info_helper, sw):
     Reads the table entries from all tables on the switch.
     从交换机上的所有表中读取表条目
     
-    :param p4info_helper: the P4Info helper
+    :param p4info_helper: the IndexedP4InfoHelper
     :param sw: the switch connection
     """
     print('\n----- Reading tables rules for %s -----' % sw.name)
     for response in sw.ReadTableEntries():
         for entity in response.entities:
-            entry = entity.table_entry 
-            # TODO For extra credit, you can use the p4info_helper to translate
-            #      the IDs in the entry to names
-            # 使用 p4info_helper 将条目中的 ID 转换为名称
-            
-            table_name = p4info_helper.get_tables_name(entry.table_id) # 利用 get_tables_name 函数得到表名
+            # 利用预先建立的索引把条目中的表、匹配域、动作和参数的 ID 一次转换为名称
+            table_name, match, action_name, params = \
+                p4info_helper.index.decodeTableEntry(entity.table_entry)
             print('%s: ' % table_name, end=' ')
-            for m in entry.match:
-                print(p4info_helper.get_match_field_name(table_name, m.field_id), end=' ') # 利用 get_match_field_name 函数得到匹配域中各匹配项名
-                print('%r' % (p4info_helper.get_match_field_value(m),), end=' ') # 利用 get_match_field_value 函数得到匹配项的值
-            action = entry.action.action 
-            action_name = p4info_helper.get_actions_name(action.action_id) # 利用 get_actions_name 函数得到动作名
+            for field_name, value in match: # 匹配域中各匹配项名和值
+                print(field_name, '%r' % (value,), end=' ')
             print('->', action_name, end=' ')
-            for p in action.params: # 得到动作参数名和值
-                print(p4info_helper.get_action_param_name(action_name, p.param_id), end=' ')
-                print('%r' % p.value, end=' ')
-                
-            print(entry)
+            for param_name, value in params: # 动作参数名和值
+                print(param_name, '%r' % value, end=' ')
+            print()
             print('-----')
 
 
@@ -163,70 +152,58 @@ def printCounter(p4info_helper, sw, counter_name, index):
                 counter.data.packet_count, counter.data.byte_count
             ))
 
-def main(p4info_file_path, bmv2_file_path):
+def printTunnelCounters(p4info_helper, s1, s2):
+    """
+    Prints the ingress and egress counters of the two tunnels.
+    打印两条隧道的入口和出口计数器
+    """
+    print('\n----- Reading tunnel counters -----')
+    printCounter(p4info_helper, s1, "MyIngress.ingressTunnelCounter", 100)
+    printCounter(p4info_helper, s2, "MyIngress.egressTunnelCounter", 100)
+    printCounter(p4info_helper, s2, "MyIngress.ingressTunnelCounter", 200)
+    printCounter(p4info_helper, s1, "MyIngress.egressTunnelCounter", 200)
+
+def main(p4info_file_path, bmv2_file_path, session):
     # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path) # 初始化 p4info_helper
+    p4info_helper = IndexedP4InfoHelper(p4info_file_path) # 初始化 p4info_helper
 
-    try:
+    with session:
         # Create a switch connection object for s1 and s2;
         # 为s1和s2创建交换机连接对象
         # this is backed by a P4Runtime gRPC connection.
         # 这是由一个运行时gRPC连接支持的
         # Also, dump all P4Runtime messages sent to switch to given txt files.
-        # 此外，将发送给交换机的所有 P4Runtime 消息转存到给定的 txt 文件
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
+        # 此外，将发送给交换机的所有 P4Runtime 消息转存到 logs/ 下的文件（--proto-dump 选择交换机）
+        s1 = session.connect('s1', '127.0.0.1:50051', 0)
+        s2 = session.connect('s2', '127.0.0.1:50052', 1)
 
         # Send master arbitration update message to establish this controller as
         # master (required by P4Runtime before performing any other write operation)
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-
-        # Install the P4 program on the switches
+        # and install the P4 program on the switches
         # 在交换机上安装 P4 程序
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
+        if not session.bringUp(p4info_helper, bmv2_file_path):
+            return
+        writer = session.writer()
 
         # Write the rules that tunnel traffic from h1 to h2
-        writeTunnelRules(p4info_helper, ingress_sw=s1, egress_sw=s2, tunnel_id=100,
+        writeTunnelRules(p4info_helper, writer, ingress_sw=s1, egress_sw=s2, tunnel_id=100,
                          dst_eth_addr="08:00:00:00:02:22", dst_ip_addr="10.0.2.2")
 
         # Write the rules that tunnel traffic from h2 to h1
-        writeTunnelRules(p4info_helper, ingress_sw=s2, egress_sw=s1, tunnel_id=200,
+        writeTunnelRules(p4info_helper, writer, ingress_sw=s2, egress_sw=s1, tunnel_id=200,
                          dst_eth_addr="08:00:00:00:01:11", dst_ip_addr="10.0.1.1")
 
+        session.flush(writer)
+
         # TODO Uncomment the following two lines to read table entries from s1 and s2
         # 读取 s1 和 s2 中的表条目
         readTableRules(p4info_helper, s1)
         readTableRules(p4info_helper, s2)
 
         # Print the tunnel counters every 2 seconds
-        while True:
-            sleep(2)
-            print('\n----- Reading tunnel counters -----')
-            printCounter(p4info_helper, s1, "MyIngress.ingressTunnelCounter", 100)
-            printCounter(p4info_helper, s2, "MyIngress.egressTunnelCounter", 100)
-            printCounter(p4info_helper, s2, "MyIngress.ingressTunnelCounter", 200)
-            printCounter(p4info_helper, s1, "MyIngress.egressTunnelCounter", 200)
-
-    except KeyboardInterrupt:
-        print(" Shutting down.")
-    except grpc.RpcError as e:
-        printGrpcError(e)
-
-    ShutdownAllSwitchConnections()
+        # 每 2 秒打印一次隧道计数器，其余时间事件循环处于空闲
+        session.runtime.every(2, printTunnelCounters, p4info_helper, s1, s2)
+        session.runtime.run()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='P4Runtime Controller')
@@ -236,6 +213,7 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/advanced_tunnel.json')
+    addSessionArguments(parser)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -246,4 +224,4 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
+    main(args.p4info, args.bmv2_json, ControllerSession.fromArgs(args))
@@ -2,113 +2,88 @@
 import argparse
 import os
 import sys
-from time import sleep
-
-import grpc
+from collections import OrderedDict
 
 # Import P4Runtime lib from parent utils dir
 # Probably there's a better way of doing this.
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
-import p4runtime_lib.bmv2
-import p4runtime_lib.helper
-from p4runtime_lib.error_utils import printGrpcError
-from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from controller_lib.counters import CounterPoller
+from controller_lib.p4index import IndexedP4InfoHelper
+from controller_lib.session import ControllerSession, addSessionArguments
+from controller_lib.topology import Topology
+from controller_lib.tunnels import TunnelProvisioner
 
-SWITCH_TO_HOST_PORT = 1
-SWITCH_TO_SWITCH_PORT = 2 # 指定了交换机的端口号
+# myTunnel.dst_id is 16 bits wide, and so are the tunnel counters
+# 隧道ID为16位，隧道计数器也有 65536 项
+MAX_TUNNEL_ID = 0xffff
 
 
-def writeTunnelRules(p4info_helper, ingress_sw, egress_sw, tunnel_id,
-                     dst_eth_addr, dst_ip_addr, switch_port):
+def writeTunnelRules(p4info_helper, writer, switches, tunnel):
     """
-    Installs three rules:
+    Installs the rules of a tunnel:
     1) An tunnel ingress rule on the ingress switch in the ipv4_lpm table that
-       encapsulates traffic into a tunnel with the specified ID
+       encapsulates traffic into a tunnel with the tunnel ID
        ipv4_lpm 表中入交换机上的隧道入口规则，将流量封装到具有指定 ID 的隧道中
-    2) A transit rule on the ingress switch that forwards traffic based on
-       the specified ID
-       入交换机上的传输规则，该规则根据指定的 ID 转发流量
+    2) A transit rule on every switch of the path, from the ingress switch to
+       the one before the egress switch, that forwards traffic based on the
+       tunnel ID towards the next switch
+       路径上每台交换机（入交换机到出交换机的前一台）的传输规则，根据隧道 ID 将流量转发到下一台交换机
     3) An tunnel egress rule on the egress switch that decapsulates traffic
-       with the specified ID and sends it to the host
+       with the tunnel ID and sends it to the host
        出交换机上的隧道出口规则，使用指定的 ID 对流量解封装，并将其发送到主机
     :param p4info_helper: the P4Info helper
-    :param ingress_sw: the ingress switch connection
-    :param egress_sw: the egress switch connection
-    :param tunnel_id: the specified tunnel ID
-    :param dst_eth_addr: the destination IP to match in the ingress rule
-    :param dst_ip_addr: the destination Ethernet address to write in the
-                        egress rule
+    :param writer: the BatchWriter the rules are queued on
+    :param switches: dict of switch name -> switch connection
+    :param tunnel: the tunnels.Tunnel
     """
+    host = tunnel.host
     # 1) Tunnel Ingress Rule 隧道入口规则
     table_entry = p4info_helper.buildTableEntry(
         table_name="MyIngress.ipv4_lpm", # 定义表名
         match_fields={
-            "hdr.ipv4.dstAddr": (dst_ip_addr, 32)
-            # 若包头对应的 hdr.ipv4.dstAddr 字段与参数中的 dst_ip_addr 匹配，则执行这一条表项的对应动作
+            "hdr.ipv4.dstAddr": (host.ip, 32)
+            # 若包头对应的 hdr.ipv4.dstAddr 字段与目的主机的 IP 匹配，则执行这一条表项的对应动作
         }, # 设置匹配域
         action_name="MyIngress.myTunnel_ingress", # 定义动作名
         action_params={ 
-            "dst_id": tunnel_id, # 动作参数是 tunnel_id
+            "dst_id": tunnel.tunnel_id, # 动作参数是 tunnel_id
         })
     # 需要使用 p4info_helper 解析器来将规则转化为 P4Runtime 能够识别的形式
-    ingress_sw.WriteTableEntry(table_entry) # 调用 WriteTableEntry ，将生成的匹配动作表项加入交换机
-    print("Installed ingress tunnel rule on %s" % ingress_sw.name)
-
-    # 2) Tunnel Transit Rule 隧道传输规则
-    # The rule will need to be added to the myTunnel_exact table and match on 
-    # the tunnel ID (hdr.myTunnel.dst_id). Traffic will need to be forwarded 
-    # using the myTunnel_forward action on the port connected to the next switch. 
-    # 需要将规则添加到myTunnel_exact表中并匹配隧道 ID (hdr.myTunnel.dst_id)。
-    # 需要在连接到下一个交换机的端口上使用myTunnel_forward操作转发流量。
-    
-    # For our simple topology, switch 1 and switch 2 are connected using a
-    # link attached to port 2 on both switches. We have defined a variable at
-    # the top of the file, SWITCH_TO_SWITCH_PORT, that you can use as the output
-    # port for this action.
-    # 对于我们的简单拓扑结构，交换机1和交换机2使用连接到两个交换机上端口2的链路进行连接。
-    
-    # We will only need a transit rule on the ingress switch because we are
-    # using a simple topology. In general, you'll need on transit rule for
-    # each switch in the path (except the last switch, which has the egress rule),
-    # and you will need to select the port dynamically for each switch based on
-    # your topology.
-
-    # TODO build the transit rule
-    # TODO install the transit rule on the ingress switch
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.myTunnel_exact", # 定义表名
-        match_fields={
-            "hdr.myTunnel.dst_id": tunnel_id # 匹配隧道 ID (hdr.myTunnel.dst_id)
-        }, # 设置匹配域
-        action_name="MyIngress.myTunnel_forward", # 定义动作名
-        action_params={
-            "port": switch_port # 动作参数是端口
-        })
-    ingress_sw.WriteTableEntry(table_entry) # 调用 WriteTableEntry ，将生成的匹配动作表项加入交换机
-    print("Installed transit tunnel rule on %s" % ingress_sw.name)
+    writer.add(switches[tunnel.ingress], table_entry) # 将生成的匹配动作表项加入批量写入队列
+
+    # 2) Tunnel Transit Rules 隧道传输规则
+    # The rules match on the tunnel ID (hdr.myTunnel.dst_id) in the
+    # myTunnel_exact table and forward the traffic with the myTunnel_forward
+    # action on the port connected to the next switch of the path.
+    # 在myTunnel_exact表中匹配隧道 ID，用myTunnel_forward操作从连接路径上下一台交换机的端口转发流量
+    for sw_name, port in tunnel.path:
+        table_entry = p4info_helper.buildTableEntry(
+            table_name="MyIngress.myTunnel_exact", # 定义表名
+            match_fields={
+                "hdr.myTunnel.dst_id": tunnel.tunnel_id # 匹配隧道 ID (hdr.myTunnel.dst_id)
+            }, # 设置匹配域
+            action_name="MyIngress.myTunnel_forward", # 定义动作名
+            action_params={
+                "port": port # 动作参数是端口
+            })
+        writer.add(switches[sw_name], table_entry) # 将生成的匹配动作表项加入批量写入队列
 
     # 3) Tunnel Egress Rule 隧道出口规则
-    # For our simple topology, the host will always be located on the
-    # SWITCH_TO_HOST_PORT (port 1).
-    # 对于我们的简单拓扑结构，主机将始终位于交换机端口 1 上
-    
-    # In general, you will need to keep track of which port the host is
-    # connected to.
-    
+    # The host is on the port given by the topology
+    # 主机所在的端口由拓扑给出
     table_entry = p4info_helper.buildTableEntry(
         table_name="MyIngress.myTunnel_exact",
         match_fields={
-            "hdr.myTunnel.dst_id": tunnel_id
+            "hdr.myTunnel.dst_id": tunnel.tunnel_id
         },
         action_name="MyIngress.myTunnel_egress",
         action_params={
-            "dstAddr": dst_eth_addr,
-            "port": SWITCH_TO_HOST_PORT
+            "dstAddr": host.mac,
+            "port": host.port
         })
-    egress_sw.WriteTableEntry(table_entry)
-    print("Installed egress tunnel rule on %s" % egress_sw.name)
+    writer.add(switches[tunnel.egress], table_entry)
 
 
 def readTableRules(p4info_helper, sw):
@@ -116,157 +91,113 @@ def readTableRules(p4info_helper, sw):
     Reads the table entries from all tables on the switch.
     从交换机上的所有表中读取表条目
     
-    :param p4info_helper: the P4Info helper
+    :param p4info_helper: the IndexedP4InfoHelper
     :param sw: the switch connection
     """
     print('\n----- Reading tables rules for %s -----' % sw.name)
     for response in sw.ReadTableEntries():
         for entity in response.entities:
-            entry = entity.table_entry 
-            # TODO For extra credit, you can use the p4info_helper to translate
-            #      the IDs in the entry to names
-            # 使用 p4info_helper 将条目中的 ID 转换为名称
-            
-            table_name = p4info_helper.get_tables_name(entry.table_id) # 利用 get_tables_name 函数得到表名
+            # 利用预先建立的索引把条目中的表、匹配域、动作和参数的 ID 一次转换为名称
+            table_name, match, action_name, params = \
+                p4info_helper.index.decodeTableEntry(entity.table_entry)
             print('%s: ' % table_name, end=' ')
-            for m in entry.match:
-                print(p4info_helper.get_match_field_name(table_name, m.field_id), end=' ') # 利用 get_match_field_name 函数得到匹配域中各匹配项名
-                print('%r' % (p4info_helper.get_match_field_value(m),), end=' ') # 利用 get_match_field_value 函数得到匹配项的值
-            action = entry.action.action 
-            action_name = p4info_helper.get_actions_name(action.action_id) # 利用 get_actions_name 函数得到动作名
+            for field_name, value in match: # 匹配域中各匹配项名和值
+                print(field_name, '%r' % (value,), end=' ')
             print('->', action_name, end=' ')
-            for p in action.params: # 得到动作参数名和值
-                print(p4info_helper.get_action_param_name(action_name, p.param_id), end=' ')
-                print('%r' % p.value, end=' ')
-                
-            print(entry)
+            for param_name, value in params: # 动作参数名和值
+                print(param_name, '%r' % value, end=' ')
+            print()
             print('-----')
 
 
-def printCounter(p4info_helper, sw, counter_name, index):
+def printCounter(snapshots, sw, counter_name, index):
     """
-    Reads the specified counter at the specified index from the switch. In our
-    program, the index is the tunnel ID. If the index is 0, it will return all
-    values from the counter.
-    从交换机中读取指定索引对应的计数器，索引是隧道ID，如果索引为0，它将从计数器中返回所有值。
-    
-    :param p4info_helper: the P4Info helper
+    Prints the specified counter at the specified index, as read by the last
+    CounterPoller.poll(). In our program, the index is the tunnel ID.
+    打印最近一次轮询得到的指定索引的计数器值及速率，索引是隧道ID。
+
+    :param snapshots: the snapshots returned by CounterPoller.poll()
     :param sw:  the switch connection
     :param counter_name: the name of the counter from the P4 program
     :param index: the counter index (in our case, the tunnel ID)
     """
-    for response in sw.ReadCounters(p4info_helper.get_counters_id(counter_name), index):
-        for entity in response.entities:
-            counter = entity.counter_entry
-            print("%s %s %d: %d packets (%d bytes)" % (
-                sw.name, counter_name, index,
-                counter.data.packet_count, counter.data.byte_count
-            ))
+    packets, bytes, packet_rate, byte_rate = snapshots[(sw.name, counter_name)].lookup(index)
+    print("%s %s %d: %d packets (%d bytes), %.1f packets/s (%.1f bytes/s)" % (
+        sw.name, counter_name, index, packets, bytes, packet_rate, byte_rate
+    ))
 
-def main(p4info_file_path, bmv2_file_path):
-    # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path) # 初始化 p4info_helper
+def printTunnelCounters(poller, switches, tunnels, metrics):
+    """
+    Reads the tunnel counters with the poller and prints them per tunnel.
+    读取隧道计数器并按隧道打印，同时交给指标导出器发布
 
-    try:
-        # Create a switch connection object for s1 and s2;
-        # 为s1和s2创建交换机连接对象
+    :param poller: the CounterPoller watching the tunnel counters
+    :param switches: dict of switch name -> switch connection
+    :param tunnels: the list of tunnels.Tunnel
+    :param metrics: the MetricsExporter the counters are published on
+    """
+    snapshots = poller.poll()
+    metrics.publishCounters(snapshots)
+    print('\n----- Reading tunnel counters -----')
+    for tunnel in tunnels:
+        print('\n----- %s -> %s (%s) -----' % (tunnel.ingress, tunnel.egress,
+                                             tunnel.host.name))
+        printCounter(snapshots, switches[tunnel.ingress],
+                     "MyIngress.ingressTunnelCounter", tunnel.tunnel_id)
+        printCounter(snapshots, switches[tunnel.egress],
+                     "MyIngress.egressTunnelCounter", tunnel.tunnel_id)
+
+def main(p4info_file_path, bmv2_file_path, topo_file_path, poll_interval, session):
+    # Instantiate a P4Runtime helper from the p4info file
+    p4info_helper = IndexedP4InfoHelper(p4info_file_path) # 初始化 p4info_helper
+    # 读取拓扑，为每台交换机到每台其他交换机上的主机自动分配隧道ID并计算路径
+    topo = Topology.load(topo_file_path)
+    tunnels = TunnelProvisioner(topo, max_id=MAX_TUNNEL_ID).tunnels()
+
+    with session:
+        # Create a switch connection object for every switch of the topology;
+        # 为拓扑中的每台交换机创建交换机连接对象，按拓扑中的顺序使用 gRPC 端口 50051、50052……
         # this is backed by a P4Runtime gRPC connection.
         # 这是由一个运行时gRPC连接支持的
         # Also, dump all P4Runtime messages sent to switch to given txt files.
-        # 此外，将发送给交换机的所有 P4Runtime 消息转存到给定的 txt 文件
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
+        # 此外，将发送给交换机的所有 P4Runtime 消息转存到 logs/ 下的文件（--proto-dump 选择交换机）
+        switches = OrderedDict()
+        for device_id, name in enumerate(topo.switches):
+            switches[name] = session.connect(name, '127.0.0.1:%d' % (50051 + device_id),
+                                             device_id)
 
         # Send master arbitration update message to establish this controller as
         # master (required by P4Runtime before performing any other write operation)
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
-
-        # Install the P4 program on the switches
+        # and install the P4 program on the switches
         # 在交换机上安装 P4 程序
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
-
-        # Write the rules that tunnel traffic from h1 to h2
-        writeTunnelRules(p4info_helper, ingress_sw=s1, egress_sw=s2, tunnel_id=100,
-                         dst_eth_addr="08:00:00:00:02:22", dst_ip_addr="10.0.2.2", switch_port=2)
-
-        # Write the rules that tunnel traffic from h2 to h1
-        writeTunnelRules(p4info_helper, ingress_sw=s2, egress_sw=s1, tunnel_id=101,
-                         dst_eth_addr="08:00:00:00:01:11", dst_ip_addr="10.0.1.1", switch_port=2)
-        
-        # Write the rules that tunnel traffic from h1 to h3
-        writeTunnelRules(p4info_helper, ingress_sw=s1, egress_sw=s3, tunnel_id=200,
-                         dst_eth_addr="08:00:00:00:03:33", dst_ip_addr="10.0.3.3", switch_port=3)
-        
-        # Write the rules that tunnel traffic from h3 to h1
-        writeTunnelRules(p4info_helper, ingress_sw=s3, egress_sw=s1, tunnel_id=201,
-                         dst_eth_addr="08:00:00:00:01:11", dst_ip_addr="10.0.1.1", switch_port=2)
-        
-        # Write the rules that tunnel traffic from h2 to h3
-        writeTunnelRules(p4info_helper, ingress_sw=s2, egress_sw=s3, tunnel_id=300,
-                         dst_eth_addr="08:00:00:00:03:33", dst_ip_addr="10.0.3.3", switch_port=3)
-        
-        # Write the rules that tunnel traffic from h3 to h2
-        writeTunnelRules(p4info_helper, ingress_sw=s3, egress_sw=s2, tunnel_id=301,
-                         dst_eth_addr="08:00:00:00:02:22", dst_ip_addr="10.0.2.2", switch_port=3)
-
-        # TODO Uncomment the following two lines to read table entries from s1 and s2
-        # 读取 s1 和 s2 中的表条目
-        readTableRules(p4info_helper, s1)
-        readTableRules(p4info_helper, s2)
-        readTableRules(p4info_helper, s3)
-
-        # Print the tunnel counters every 2 seconds
-        while True:
-            sleep(2)
-            print('\n----- Reading tunnel counters -----')
-            print('\n----- s1 ->  s2 -----')
-            printCounter(p4info_helper, s1, "MyIngress.ingressTunnelCounter", 100)
-            printCounter(p4info_helper, s2, "MyIngress.egressTunnelCounter", 100)
-            print('\n----- s2 ->  s1 -----')
-            printCounter(p4info_helper, s2, "MyIngress.ingressTunnelCounter", 101)
-            printCounter(p4info_helper, s1, "MyIngress.egressTunnelCounter", 101)
-            print('\n----- s1 ->  s3 -----')
-            printCounter(p4info_helper, s1, "MyIngress.ingressTunnelCounter", 200)
-            printCounter(p4info_helper, s3, "MyIngress.egressTunnelCounter", 200)
-            print('\n----- s3 ->  s1 -----')
-            printCounter(p4info_helper, s3, "MyIngress.ingressTunnelCounter", 201)
-            printCounter(p4info_helper, s1, "MyIngress.egressTunnelCounter", 201)
-            print('\n----- s2 ->  s3 -----')
-            printCounter(p4info_helper, s2, "MyIngress.ingressTunnelCounter", 300)
-            printCounter(p4info_helper, s3, "MyIngress.egressTunnelCounter", 300)
-            print('\n----- s3 ->  s2 -----')
-            printCounter(p4info_helper, s3, "MyIngress.ingressTunnelCounter", 301)
-            printCounter(p4info_helper, s2, "MyIngress.egressTunnelCounter", 301)
-
-    except KeyboardInterrupt:
-        print(" Shutting down.")
-    except grpc.RpcError as e:
-        printGrpcError(e)
-
-    ShutdownAllSwitchConnections()
+        if not session.bringUp(p4info_helper, bmv2_file_path):
+            return
+        writer = session.writer()
+
+        # The tunnels from every switch to the hosts of the other switches
+        # 每台交换机到其他交换机上各主机的隧道
+        for tunnel in tunnels:
+            writeTunnelRules(p4info_helper, writer, switches, tunnel)
+
+        session.flush(writer)
+
+        # 读取各交换机中的表条目
+        for sw in switches.values():
+            readTableRules(p4info_helper, sw)
+
+        # Read the counters of all tunnels with one ReadRequest per switch
+        # 每台交换机只用一个 ReadRequest 读取所有隧道的计数器
+        poller = CounterPoller(p4info_helper)
+        for tunnel in tunnels:
+            poller.watch(switches[tunnel.ingress], "MyIngress.ingressTunnelCounter",
+                         [tunnel.tunnel_id])
+            poller.watch(switches[tunnel.egress], "MyIngress.egressTunnelCounter",
+                         [tunnel.tunnel_id])
+
+        # Print the tunnel counters every poll_interval seconds
+        session.runtime.every(poll_interval, printTunnelCounters, poller, switches, tunnels,
+                              session.metrics)
+        session.runtime.run()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='P4Runtime Controller')
@@ -276,6 +207,12 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/advanced_tunnel.json')
+    parser.add_argument('--topo', help='topology JSON file',
+                        type=str, action="store", required=False,
+                        default='./topology.json')
+    parser.add_argument('--poll-interval', help='seconds between two tunnel counter reads',
+                        type=float, action="store", required=False, default=2.0)
+    addSessionArguments(parser)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -286,4 +223,9 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
+    if not os.path.exists(args.topo):
+        parser.print_help()
+        print("\nTopology file not found: %s" % args.topo)
+        parser.exit(1)
+    main(args.p4info, args.bmv2_json, args.topo, args.poll_interval,
+         ControllerSession.fromArgs(args))
@@ -2,21 +2,16 @@
 import argparse
 import os
 import sys
-from time import sleep
-
-import grpc
 
 # Import P4Runtime lib from parent utils dir
 # Probably there's a better way of doing this.
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
-import p4runtime_lib.bmv2
-import p4runtime_lib.helper
-from p4runtime_lib.error_utils import printGrpcError
-from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from controller_lib.p4index import IndexedP4InfoHelper
+from controller_lib.session import ControllerSession, addSessionArguments
 
-def writeRules(p4info_helper, ingress_sw,
+def writeRules(p4info_helper, writer, ingress_sw,
                      dst_eth_addr, dst_ip_addr, switch_port):
     
     table_entry = p4info_helper.buildTableEntry(
@@ -31,85 +26,57 @@ def writeRules(p4info_helper, ingress_sw,
             "port": switch_port 
         })
     # 需要使用 p4info_helper 解析器来将规则转化为 P4Runtime 能够识别的形式
-    ingress_sw.WriteTableEntry(table_entry) # 调用 WriteTableEntry ，将生成的匹配动作表项加入交换机
-    print("Installed rule on %s" % ingress_sw.name)
+    writer.add(ingress_sw, table_entry) # 将生成的匹配动作表项加入批量写入队列
 
-def main(p4info_file_path, bmv2_file_path):
+def main(p4info_file_path, bmv2_file_path, session):
     # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path) # 初始化 p4info_helper
+    p4info_helper = IndexedP4InfoHelper(p4info_file_path) # 初始化 p4info_helper
 
-    try:
+    with session:
         # 为s1、s2、s3创建交换机连接对象
         # 这是由一个运行时gRPC连接支持的
-        # 此外，将发送给交换机的所有 P4Runtime 消息转存到给定的 txt 文件
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
+        # 此外，将发送给交换机的所有 P4Runtime 消息转存到 logs/ 下的文件（--proto-dump 选择交换机）
+        s1 = session.connect('s1', '127.0.0.1:50051', 0)
+        s2 = session.connect('s2', '127.0.0.1:50052', 1)
+        s3 = session.connect('s3', '127.0.0.1:50053', 2)
 
         # Send master arbitration update message to establish this controller as
         # master (required by P4Runtime before performing any other write operation)
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
-
-        # Install the P4 program on the switches
+        # and install the P4 program on the switches
         # 在交换机上安装 P4 程序
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
+        if not session.bringUp(p4info_helper, bmv2_file_path):
+            return
+        writer = session.writer()
 
-        writeRules(p4info_helper, ingress_sw=s1,
+        writeRules(p4info_helper, writer, ingress_sw=s1,
                          dst_eth_addr="08:00:00:00:01:01", dst_ip_addr=("10.0.1.1", 32), switch_port=2)
-        writeRules(p4info_helper, ingress_sw=s1,
+        writeRules(p4info_helper, writer, ingress_sw=s1,
                          dst_eth_addr="08:00:00:00:01:11", dst_ip_addr=("10.0.1.11", 32), switch_port=1)
-        writeRules(p4info_helper, ingress_sw=s1,
+        writeRules(p4info_helper, writer, ingress_sw=s1,
                          dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=("10.0.2.0", 24), switch_port=3)
-        writeRules(p4info_helper, ingress_sw=s1,
+        writeRules(p4info_helper, writer, ingress_sw=s1,
                          dst_eth_addr="08:00:00:00:03:00", dst_ip_addr=("10.0.3.0", 24), switch_port=4)
     
-        writeRules(p4info_helper, ingress_sw=s2,
+        writeRules(p4info_helper, writer, ingress_sw=s2,
                          dst_eth_addr="08:00:00:00:02:02", dst_ip_addr=("10.0.2.2", 32), switch_port=2)
-        writeRules(p4info_helper, ingress_sw=s2,
+        writeRules(p4info_helper, writer, ingress_sw=s2,
                          dst_eth_addr="08:00:00:00:02:22", dst_ip_addr=("10.0.2.22", 32), switch_port=1)
-        writeRules(p4info_helper, ingress_sw=s2,
+        writeRules(p4info_helper, writer, ingress_sw=s2,
                          dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=("10.0.1.0", 24), switch_port=3)
-        writeRules(p4info_helper, ingress_sw=s2,
+        writeRules(p4info_helper, writer, ingress_sw=s2,
                          dst_eth_addr="08:00:00:00:03:00", dst_ip_addr=("10.0.3.0", 24), switch_port=4)
         
-        writeRules(p4info_helper, ingress_sw=s3,
+        writeRules(p4info_helper, writer, ingress_sw=s3,
                          dst_eth_addr="08:00:00:00:03:03", dst_ip_addr=("10.0.3.3", 32), switch_port=1)
-        writeRules(p4info_helper, ingress_sw=s3,
+        writeRules(p4info_helper, writer, ingress_sw=s3,
                          dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=("10.0.1.0", 24), switch_port=2)
-        writeRules(p4info_helper, ingress_sw=s3,
+        writeRules(p4info_helper, writer, ingress_sw=s3,
                          dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=("10.0.2.0", 24), switch_port=3)
-        
-        while True:
-            sleep(2)
-            
-    except KeyboardInterrupt:
-        print(" Shutting down.")
-    except grpc.RpcError as e:
-        printGrpcError(e)
 
-    ShutdownAllSwitchConnections()
+        session.flush(writer)
+        
+        # 没有周期任务：等待交换机的消息，直到 Ctrl-C
+        session.runtime.run()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='P4Runtime Controller')
@@ -119,6 +86,7 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/ecn.json')
+    addSessionArguments(parser)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -129,4 +97,4 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
+    main(args.p4info, args.bmv2_json, ControllerSession.fromArgs(args))
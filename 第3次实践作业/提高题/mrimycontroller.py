@@ -2,21 +2,17 @@
 import argparse
 import os
 import sys
-from time import sleep
-
-import grpc
 
 # Import P4Runtime lib from parent utils dir
 # Probably there's a better way of doing this.
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
-import p4runtime_lib.bmv2
-import p4runtime_lib.helper
-from p4runtime_lib.error_utils import printGrpcError
-from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from controller_lib.p4index import IndexedP4InfoHelper
+from controller_lib.session import ControllerSession, addSessionArguments
+from controller_lib.topology import RouteCompiler, Topology
 
-def writeRules(p4info_helper, ingress_sw,
+def writeRules(p4info_helper, writer, ingress_sw,
                      dst_eth_addr, dst_ip_addr, switch_port):
 
     table_entry = p4info_helper.buildTableEntry(
@@ -31,10 +27,9 @@ def writeRules(p4info_helper, ingress_sw,
             "port": switch_port
         })
     # 需要使用 p4info_helper 解析器来将规则转化为 P4Runtime 能够识别的形式
-    ingress_sw.WriteTableEntry(table_entry) # 调用 WriteTableEntry ，将生成的匹配动作表项加入交换机
-    print("Installed rule on %s" % ingress_sw.name)
+    writer.add(ingress_sw, table_entry) # 将生成的匹配动作表项加入批量写入队列
 
-def writeswtrace(p4info_helper, egress_sw,
+def writeswtrace(p4info_helper, writer, egress_sw,
                         switch_id):
 
     table_entry = p4info_helper.buildTableEntry(
@@ -44,89 +39,41 @@ def writeswtrace(p4info_helper, egress_sw,
             "swid": switch_id
         })
     # 需要使用 p4info_helper 解析器来将规则转化为 P4Runtime 能够识别的形式
-    egress_sw.WriteTableEntry(table_entry) # 调用 WriteTableEntry ，将生成的匹配动作表项加入交换机
-    print("Installed rule on %s" % egress_sw.name)
+    writer.add(egress_sw, table_entry) # 将生成的匹配动作表项加入批量写入队列
 
-def main(p4info_file_path, bmv2_file_path):
+def main(p4info_file_path, bmv2_file_path, topo_file_path, session):
     # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path) # 初始化 p4info_helper
+    p4info_helper = IndexedP4InfoHelper(p4info_file_path) # 初始化 p4info_helper
+    # 读取拓扑并一次算出所有交换机到各主机的最短路径转发规则
+    topo = Topology.load(topo_file_path)
+    routes = RouteCompiler(topo).compile()
 
-    try:
-        # 为s1、s2、s3创建交换机连接对象
+    with session:
+        # 为拓扑中的每台交换机创建交换机连接对象，按拓扑中的顺序使用 gRPC 端口 50051、50052……
         # 这是由一个运行时gRPC连接支持的
-        # 此外，将发送给交换机的所有 P4Runtime 消息转存到给定的 txt 文件
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
+        # 此外，将发送给交换机的所有 P4Runtime 消息转存到 logs/ 下的文件（--proto-dump 选择交换机）
+        switches = [session.connect(name, '127.0.0.1:%d' % (50051 + device_id), device_id)
+                    for device_id, name in enumerate(topo.switches)]
 
         # Send master arbitration update message to establish this controller as
         # master (required by P4Runtime before performing any other write operation)
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
-
-        # Install the P4 program on the switches
+        # and install the P4 program on the switches
         # 在交换机上安装 P4 程序
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
-
-        writeRules(p4info_helper, ingress_sw=s1,
-                         dst_eth_addr="08:00:00:00:01:01", dst_ip_addr=("10.0.1.1", 32), switch_port=2)
-        writeRules(p4info_helper, ingress_sw=s1,
-                         dst_eth_addr="08:00:00:00:01:11", dst_ip_addr=("10.0.1.11", 32), switch_port=1)
-        writeRules(p4info_helper, ingress_sw=s1,
-                         dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=("10.0.2.0", 24), switch_port=3)
-        writeRules(p4info_helper, ingress_sw=s1,
-                         dst_eth_addr="08:00:00:00:03:00", dst_ip_addr=("10.0.3.0", 24), switch_port=4)
-
-        writeRules(p4info_helper, ingress_sw=s2,
-                         dst_eth_addr="08:00:00:00:02:02", dst_ip_addr=("10.0.2.2", 32), switch_port=2)
-        writeRules(p4info_helper, ingress_sw=s2,
-                         dst_eth_addr="08:00:00:00:02:22", dst_ip_addr=("10.0.2.22", 32), switch_port=1)
-        writeRules(p4info_helper, ingress_sw=s2,
-                         dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=("10.0.1.0", 24), switch_port=3)
-        writeRules(p4info_helper, ingress_sw=s2,
-                         dst_eth_addr="08:00:00:00:03:00", dst_ip_addr=("10.0.3.0", 24), switch_port=4)
-
-        writeRules(p4info_helper, ingress_sw=s3,
-                         dst_eth_addr="08:00:00:00:03:03", dst_ip_addr=("10.0.3.3", 32), switch_port=1)
-        writeRules(p4info_helper, ingress_sw=s3,
-                         dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=("10.0.1.0", 24), switch_port=2)
-        writeRules(p4info_helper, ingress_sw=s3,
-                         dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=("10.0.2.0", 24), switch_port=3)
+        if not session.bringUp(p4info_helper, bmv2_file_path):
+            return
+        writer = session.writer()
 
-        writeswtrace(p4info_helper,egress_sw=s1,switch_id=1)
-        writeswtrace(p4info_helper,egress_sw=s2,switch_id=2)
-        writeswtrace(p4info_helper,egress_sw=s3,switch_id=3)
+        for sw in switches:
+            for route in routes[sw.name]:
+                writeRules(p4info_helper, writer, ingress_sw=sw,
+                           dst_eth_addr=route.dst_mac, dst_ip_addr=route.dst_prefix,
+                           switch_port=route.port)
+            writeswtrace(p4info_helper, writer, egress_sw=sw, switch_id=topo.switchId(sw.name))
 
-        while True:
-            sleep(2)
+        session.flush(writer)
 
-    except KeyboardInterrupt:
-        print(" Shutting down.")
-    except grpc.RpcError as e:
-        printGrpcError(e)
-
-    ShutdownAllSwitchConnections()
+        # 没有周期任务：等待交换机的消息，直到 Ctrl-C
+        session.runtime.run()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='P4Runtime Controller')
@@ -136,6 +83,10 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/mri.json')
+    parser.add_argument('--topo', help='topology JSON file',
+                        type=str, action="store", required=False,
+                        default='./topology.json')
+    addSessionArguments(parser)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -146,4 +97,8 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
+    if not os.path.exists(args.topo):
+        parser.print_help()
+        print("\nTopology file not found: %s" % args.topo)
+        parser.exit(1)
+    main(args.p4info, args.bmv2_json, args.topo, ControllerSession.fromArgs(args))
@@ -2,21 +2,21 @@
 import argparse
 import os
 import sys
-from time import sleep
-
-import grpc
 
 # Import P4Runtime lib from parent utils dir
 # Probably there's a better way of doing this.
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
-import p4runtime_lib.bmv2
-import p4runtime_lib.helper
-from p4runtime_lib.error_utils import printGrpcError
-from p4runtime_lib.switch import ShutdownAllSwitchConnections
-
-def writecheck_ports(p4info_helper, ingress_sw,
+from controller_lib.aging import BloomAger, printBloomOccupancy
+from controller_lib.batch import printWriteErrors
+from controller_lib.learning import HostLearner, printLearnedHosts
+from controller_lib.p4index import IndexedP4InfoHelper
+from controller_lib.portpolicy import directionRules, portRoles
+from controller_lib.session import ControllerSession, addSessionArguments
+from controller_lib.topology import RouteCompiler, Topology
+
+def writecheck_ports(p4info_helper, writer, ingress_sw,
                      ingress_port, egress_spec, dire):
 
     table_entry = p4info_helper.buildTableEntry(
@@ -31,10 +31,9 @@ def writecheck_ports(p4info_helper, ingress_sw,
             "dir": dire
         })
     # 需要使用 p4info_helper 解析器来将规则转化为 P4Runtime 能够识别的形式
-    ingress_sw.WriteTableEntry(table_entry) # 调用 WriteTableEntry ，将生成的匹配动作表项加入交换机
-    print("Installed rule on %s" % ingress_sw.name)
+    writer.add(ingress_sw, table_entry) # 将生成的匹配动作表项加入批量写入队列
 
-def writeipv4_lpm(p4info_helper, ingress_sw,
+def writeipv4_lpm(p4info_helper, writer, ingress_sw,
                      dst_eth_addr, dst_ip_addr, switch_port):
 
     table_entry = p4info_helper.buildTableEntry(
@@ -49,113 +48,83 @@ def writeipv4_lpm(p4info_helper, ingress_sw,
             "port": switch_port
         })
     # 需要使用 p4info_helper 解析器来将规则转化为 P4Runtime 能够识别的形式
-    ingress_sw.WriteTableEntry(table_entry) # 调用 WriteTableEntry ，将生成的匹配动作表项加入交换机
-    print("Installed rule on %s" % ingress_sw.name)
+    writer.add(ingress_sw, table_entry) # 将生成的匹配动作表项加入批量写入队列
+
+def ageBloomFilters(ager):
+    # 打印各防火墙布隆过滤器的占用率，然后清空旧的一代并切换当前代
+    printBloomOccupancy([ager.readOccupancy(sw) for sw in ager.switches])
+    printWriteErrors(ager.rotate())
+
+def restoreLearnedHosts(learner, installed, reconciler):
+    print("Restored %d learned hosts" % len(learner.restore(installed, reconciler)))
+
+def installLearnedHosts(learner):
+    # 为上次安装以来学习到的主机批量下发转发表项
+    printLearnedHosts(learner, *learner.flush())
 
-def main(p4info_file_path, bmv2_file_path):
+def main(p4info_file_path, bmv2_file_path, topo_file_path, bloom_aging, learn, learn_interval,
+         session):
     # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path) # 初始化 p4info_helper
+    p4info_helper = IndexedP4InfoHelper(p4info_file_path) # 初始化 p4info_helper
+    # 读取拓扑
+    topo = Topology.load(topo_file_path)
 
-    try:
-        # 为s1、s2、s3创建交换机连接对象
+    with session:
+        # 为拓扑中的每台交换机创建交换机连接对象，按拓扑中的顺序使用 gRPC 端口 50051、50052……
         # 这是由一个运行时gRPC连接支持的
-        # 此外，将发送给交换机的所有 P4Runtime 消息转存到给定的 txt 文件
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
-        s4 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s4',
-            address='127.0.0.1:50054',
-            device_id=3,
-            proto_dump_file='logs/s4-p4runtime-requests.txt')
+        # 此外，将发送给交换机的所有 P4Runtime 消息转存到 logs/ 下的文件（--proto-dump 选择交换机）
+        switches = [session.connect(name, '127.0.0.1:%d' % (50051 + device_id), device_id)
+                    for device_id, name in enumerate(topo.switches)]
 
         # Send master arbitration update message to establish this controller as
         # master (required by P4Runtime before performing any other write operation)
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
-        s4.MasterArbitrationUpdate()
-
-        # Install the P4 program on the switches
+        # and install the P4 program on the switches
         # 在交换机上安装 P4 程序
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
-        s4.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s4")
-
-        writecheck_ports(p4info_helper, ingress_sw=s1, ingress_port=1, egress_spec=3, dire=0)
-        writecheck_ports(p4info_helper, ingress_sw=s1, ingress_port=1, egress_spec=4, dire=0)
-        writecheck_ports(p4info_helper, ingress_sw=s1, ingress_port=2, egress_spec=3, dire=0)
-        writecheck_ports(p4info_helper, ingress_sw=s1, ingress_port=2, egress_spec=4, dire=0)
-        writecheck_ports(p4info_helper, ingress_sw=s1, ingress_port=3, egress_spec=1, dire=1)
-        writecheck_ports(p4info_helper, ingress_sw=s1, ingress_port=3, egress_spec=2, dire=1)
-        writecheck_ports(p4info_helper, ingress_sw=s1, ingress_port=4, egress_spec=1, dire=1)
-        writecheck_ports(p4info_helper, ingress_sw=s1, ingress_port=4, egress_spec=2, dire=1)
-        writeipv4_lpm(p4info_helper, ingress_sw=s1,
-                         dst_eth_addr="08:00:00:00:01:11", dst_ip_addr=["10.0.1.1", 32], switch_port=1)
-        writeipv4_lpm(p4info_helper, ingress_sw=s1,
-                         dst_eth_addr="08:00:00:00:02:22", dst_ip_addr=["10.0.2.2", 32], switch_port=2)
-        writeipv4_lpm(p4info_helper, ingress_sw=s1,
-                         dst_eth_addr="08:00:00:00:03:00", dst_ip_addr=["10.0.3.3", 32], switch_port=3)
-        writeipv4_lpm(p4info_helper, ingress_sw=s1,
-                         dst_eth_addr="08:00:00:00:04:00", dst_ip_addr=["10.0.4.4", 32], switch_port=4)
-
-        writeipv4_lpm(p4info_helper, ingress_sw=s2,
-                         dst_eth_addr="08:00:00:00:03:00", dst_ip_addr=["10.0.1.1", 32], switch_port=4)
-        writeipv4_lpm(p4info_helper, ingress_sw=s2,
-                         dst_eth_addr="08:00:00:00:04:00", dst_ip_addr=["10.0.2.2", 32], switch_port=3)
-        writeipv4_lpm(p4info_helper, ingress_sw=s2,
-                         dst_eth_addr="08:00:00:00:03:33", dst_ip_addr=["10.0.3.3", 32], switch_port=1)
-        writeipv4_lpm(p4info_helper, ingress_sw=s2,
-                         dst_eth_addr="08:00:00:00:04:44", dst_ip_addr=["10.0.4.4", 32], switch_port=2)
-
-        writeipv4_lpm(p4info_helper, ingress_sw=s3,
-                         dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=["10.0.1.1", 32], switch_port=1)
-        writeipv4_lpm(p4info_helper, ingress_sw=s3,
-                         dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=["10.0.2.2", 32], switch_port=1)
-        writeipv4_lpm(p4info_helper, ingress_sw=s3,
-                         dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=["10.0.3.3", 32], switch_port=2)
-        writeipv4_lpm(p4info_helper, ingress_sw=s3,
-                         dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=["10.0.4.4", 32], switch_port=2)
-
-        writeipv4_lpm(p4info_helper, ingress_sw=s4,
-                         dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=["10.0.1.1", 32], switch_port=2)
-        writeipv4_lpm(p4info_helper, ingress_sw=s4,
-                         dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=["10.0.2.2", 32], switch_port=2)
-        writeipv4_lpm(p4info_helper, ingress_sw=s4,
-                         dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=["10.0.3.3", 32], switch_port=1)
-        writeipv4_lpm(p4info_helper, ingress_sw=s4,
-                         dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=["10.0.4.4", 32], switch_port=1)
-
-        while True:
-            sleep(2)
-
-    except KeyboardInterrupt:
-        print(" Shutting down.")
-    except grpc.RpcError as e:
-        printGrpcError(e)
-
-    ShutdownAllSwitchConnections()
+        if not session.bringUp(p4info_helper, bmv2_file_path):
+            return
+        writer = session.writer()
+
+        # 防火墙部署在拓扑中声明了内部/外部端口的交换机上（pod-topo 中只有 s1），
+        # 为每一对跨越内外边界的端口生成 check_ports 方向表项
+        by_name = dict((sw.name, sw) for sw in switches)
+        firewalls = []
+        for roles in portRoles(topo):
+            firewalls.append(by_name[roles.switch])
+            for ingress_port, egress_spec, dire in directionRules(roles):
+                writecheck_ports(p4info_helper, writer, ingress_sw=by_name[roles.switch],
+                                 ingress_port=ingress_port, egress_spec=egress_spec, dire=dire)
+        # 反应式学习：交换机为未知的源主机发送 learn digest，控制器合并去重后批量下发到这些主机的转发表项；
+        # 交换机之间的端口和拓扑中已有的主机预先写入，不会触发学习
+        learner = None
+        if learn:
+            learner = HostLearner(p4info_helper, topo, by_name, batch_size=session.batch_size)
+            if session.reconcile:
+                # 增量同步读取交换机后，从读到的表项中找回上次运行学习到的主机并加入拓扑，保留它们的表项而不是删除
+                writer.onInstalled(lambda installed: restoreLearnedHosts(learner, installed, writer))
+            learner.queueKnown(writer)
+        # 一次算出所有交换机到各主机的最短路径转发规则
+        routes = RouteCompiler(topo).compile()
+        for sw in switches:
+            for route in routes[sw.name]:
+                writeipv4_lpm(p4info_helper, writer, ingress_sw=sw,
+                              dst_eth_addr=route.dst_mac, dst_ip_addr=route.dst_prefix,
+                              switch_port=route.port)
+
+        session.flush(writer)
+
+        runtime = session.runtime
+        if learner is not None:
+            # 运行时从仲裁起就在读取 StreamChannel，先注册处理函数再开启 digest，不丢失最早的 digest
+            runtime.on('digest', learner.add)
+            printWriteErrors(learner.enableDigests())
+            runtime.every(learn_interval, installLearnedHosts, learner)
+            session.metrics.add(learner.metrics)
+
+        # 布隆过滤器老化：每隔 bloom_aging 秒统计占用率，清空旧的一代并切换当前代
+        if bloom_aging:
+            ager = BloomAger(p4info_helper, firewalls)
+            runtime.every(bloom_aging, ageBloomFilters, ager)
+        runtime.run()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='P4Runtime Controller')
@@ -165,6 +134,21 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/firewall.json')
+    parser.add_argument('--topo', help='topology JSON file',
+                        type=str, action="store", required=False,
+                        default='./pod-topo/topology.json')
+    parser.add_argument('--bloom-aging',
+                        help='seconds between two rotations of the Bloom filter generations, '
+                             '0 to never age connections',
+                        type=float, action="store", required=False, default=0)
+    parser.add_argument('--learn',
+                        help='install the routes towards the hosts the switches learn from '
+                             'their traffic',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('--learn-interval',
+                        help='seconds between two installations of the learned hosts',
+                        type=float, action="store", required=False, default=0.1)
+    addSessionArguments(parser)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -175,4 +159,9 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
+    if not os.path.exists(args.topo):
+        parser.print_help()
+        print("\nTopology file not found: %s" % args.topo)
+        parser.exit(1)
+    main(args.p4info, args.bmv2_json, args.topo, args.bloom_aging, args.learn,
+         args.learn_interval, ControllerSession.fromArgs(args))